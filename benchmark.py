@@ -0,0 +1,123 @@
+"""
+openclassrooms Python - Project 2
+bookscraper package
+@author Christian Debray - christian.debray@gmail.com
+"""
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from mockserver import MockBooksServer, MockCatalog
+from scraper import Scraper
+from books_to_scrape_generators import BooksToScrapeGenerator
+from bookdatawriter import WRITER_FORMATS, COMPRESSION_SUFFIXES
+from urlsets import URL_SET_KINDS
+import logging
+logger = logging.getLogger(__name__)
+
+def serve_catalog(conn, catalog_options: dict, server_options: dict):
+    """
+    Runs a mock server in a child process, so that it competes neither for the GIL nor for the memory measured in the scraping process.
+    Sends the base url through the connection, then the server stats once asked to stop.
+    """
+    with MockBooksServer(MockCatalog(**catalog_options), **server_options) as server:
+        conn.send(server.base_url)
+        conn.recv()
+        conn.send({'requests': server.requests_count, 'bytes_sent': server.bytes_sent, 'errors_injected': server.errors_injected})
+
+def run_benchmark(catalog_options: dict, server_options: dict, scraper_options: dict, output_dir: str = None) -> dict:
+    """
+    Scrapes the entire catalog served by a mock server, returns the throughput of the run:
+    pages (index and product pages) and images per second, MB received per second, peak RSS of the scraping process.
+    The peak RSS is the peak of the whole process lifetime: run a single benchmark per process to compare configurations.
+    """
+    parent_conn, child_conn = multiprocessing.Pipe()
+    server_process = multiprocessing.Process(target= serve_catalog, args= (child_conn, catalog_options, server_options), daemon= True)
+    server_process.start()
+    tmp_dir = None
+    try:
+        base_url = parent_conn.recv()
+        if output_dir is None:
+            output_dir = tmp_dir = tempfile.mkdtemp(prefix= "bookscraper-benchmark-")
+        scraper = Scraper(output_dir, BooksToScrapeGenerator(), **scraper_options)
+        start = time.perf_counter()
+        try:
+            scraper.scrape_all_categories(base_url)
+        finally:
+            # wait for the background image downloads
+            scraper.close()
+        elapsed = time.perf_counter() - start
+        parent_conn.send("stop")
+        server_stats = parent_conn.recv()
+    finally:
+        server_process.join(timeout= 5)
+        if server_process.is_alive():
+            server_process.terminate()
+        if tmp_dir:
+            shutil.rmtree(tmp_dir, ignore_errors= True)
+    report = scraper.metrics.report()
+    stages = report['stages']
+    pages = sum(stages.get(stage, {}).get('count', 0) for stage in ["index_fetch", "product_fetch"])
+    images = stages.get("image_fetch", {}).get('count', 0)
+    received = sum(stats['bytes'] for stage, stats in stages.items() if stage.endswith("_fetch"))
+    return {
+        'time': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'catalog': catalog_options,
+        'server': server_options,
+        'scraper': scraper_options,
+        'elapsed_seconds': round(elapsed, 3),
+        'pages': pages,
+        'images': images,
+        'pages_per_second': round(pages / elapsed, 2),
+        'images_per_second': round(images / elapsed, 2),
+        'mb_per_second': round(received / elapsed / 1_000_000, 3),
+        # ru_maxrss is in KiB on Linux, in bytes on macOS
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 if sys.platform != "darwin" else 1024 * 1024), 1),
+        'server_stats': server_stats,
+        'counters': report['counters'],
+        'stages': {stage: {k: stats[k] for k in ['count', 'errors', 'p50_seconds', 'p95_seconds']} for stage, stats in stages.items()}
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog="benchmark",
+        description="Scrape a generated catalog served by a local mock server (see mockserver.py), report the throughput:\npages/s, MB/s and peak RSS. Run once per configuration to compare the results.",
+        formatter_class=argparse.RawTextHelpFormatter
+    )
+    parser.add_argument("--categories", type= int, default= 10, help="number of categories (defaults to 10)")
+    parser.add_argument("--books-per-category", type= int, default= 50, help="number of books per category (defaults to 50)")
+    parser.add_argument("--latency", type= float, default= 0.0, help="delay added by the server to each response, in seconds")
+    parser.add_argument("--jitter", type= float, default= 0.0, help="random delay (0 to N seconds) added to the latency")
+    parser.add_argument("--error-rate", type= float, default= 0.0, help="probability of answering a request with an injected error")
+    parser.add_argument("--error-kinds", nargs="+", choices= MockBooksServer.ERROR_KINDS, default= ["500"], help="errors to inject (defaults to 500)")
+    parser.add_argument("--workers", type= int, default= 1, help="scraper workers (see scrapebooks.py --workers)")
+    parser.add_argument("--images", choices= Scraper.IMAGE_MODES, default= Scraper.IMAGES_INLINE, help="image download mode (see scrapebooks.py --images)")
+    parser.add_argument("--image-workers", type= int, default= 2, help="image download threads with --images background")
+    parser.add_argument("--format", dest="output_format", choices= list(WRITER_FORMATS.keys()), default="csv", help="output format")
+    parser.add_argument("--compress", dest="compression", choices= [c for c in COMPRESSION_SUFFIXES if c], default=None, help="output compression")
+    parser.add_argument("--seen-urls", dest="seen_urls", choices= URL_SET_KINDS, default="digest", help="seen urls set")
+    parser.add_argument("-d", "--outputdir", default=None, help="keep the scraped data in this directory (defaults to a temporary directory, deleted after the run)")
+    parser.add_argument("-o", "--output", default=None, help="append the results to this JSON Lines file")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+    if args.outputdir and not os.path.exists(args.outputdir):
+        os.makedirs(args.outputdir, mode=0o777)
+    results = run_benchmark(
+        catalog_options= {'categories': args.categories, 'books_per_category': args.books_per_category},
+        server_options= {'latency': args.latency, 'jitter': args.jitter, 'error_rate': args.error_rate, 'error_kinds': args.error_kinds},
+        scraper_options= {
+            'requests_delay': 0, 'workers': args.workers, 'images': args.images, 'image_workers': args.image_workers,
+            'output_format': args.output_format, 'compression': args.compression, 'seen_urls': args.seen_urls},
+        output_dir= args.outputdir)
+    print(
+        f"{results['pages']} pages, {results['images']} images in {results['elapsed_seconds']:.2f}s: "
+        f"{results['pages_per_second']:.1f} pages/s, {results['mb_per_second']:.2f} MB/s, peak RSS {results['peak_rss_mb']:.1f} MB")
+    if args.output:
+        with open(args.output, "a", encoding= "utf-8") as f:
+            f.write(json.dumps(results) + "\n")
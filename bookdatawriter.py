@@ -4,50 +4,418 @@ bookscraper package
 @author Christian Debray - christian.debray@gmail.com
 """
 from bookdata import BookData
+from abc import ABC, abstractmethod
+from collections.abc import Generator
 import os, pathlib
+import io
+import queue
+import threading
 import csv
+import gzip
+import json
+import zlib
+try:
+    # optional dependency, only required for zstd compressed output
+    import zstandard
+except ImportError:
+    zstandard = None
+import logging
+logger = logging.getLogger(__name__)
 
-class BookDataWriter:
+COMPRESSION_SUFFIXES = {
+    None: '',
+    'gzip': '.gz',
+    'zstd': '.zst'
+}
+
+def open_text_stream(filename: str, mode: str = "r", compression: str = None) -> io.TextIOBase:
     """
-    Export Book Data objects to a CSV file
+    Opens a text stream to a plain, gzip or zstd compressed file.
+    mode -- "r" (read) or "a" (append)
+
+    Compressed files are appended as new gzip members / zstd frames,
+    so that an existing output file can still be read as a single stream.
+    """
+    if compression is None:
+        return open(filename, mode= mode, newline= "", encoding= "utf-8")
+    if compression == 'gzip':
+        return gzip.open(filename, mode= mode + "t", newline= "", encoding= "utf-8")
+    if compression == 'zstd':
+        if zstandard is None:
+            raise ModuleNotFoundError("zstd compression requires the zstandard package (pip install zstandard)")
+        raw = open(filename, mode= mode + "b")
+        if mode == "r":
+            stream = zstandard.ZstdDecompressor().stream_reader(raw, read_across_frames= True, closefd= True)
+        else:
+            stream = zstandard.ZstdCompressor().stream_writer(raw, closefd= True)
+        return io.TextIOWrapper(stream, newline= "", encoding= "utf-8")
+    raise ValueError(f"Unsupported compression: {compression}")
+
+def _new_decompressor(compression: str):
+    """
+    Decompresses a single gzip member / zstd frame, see repair_compressed_file()
     """
-    def __init__(self, filename: str):
-        # check path to output file exists and is writable
+    if compression == 'gzip':
+        return zlib.decompressobj(wbits= 16 + zlib.MAX_WBITS)
+    if zstandard is None:
+        raise ModuleNotFoundError("zstd compression requires the zstandard package (pip install zstandard)")
+    return zstandard.ZstdDecompressor().decompressobj()
+
+def repair_compressed_file(filename: str, compression: str) -> bool:
+    """
+    Makes an interrupted compressed output file readable (and appendable) again.
+
+    A writer that did not close its stream (ex. the process was killed) leaves the last gzip member / zstd frame
+    unterminated: its flushed records can be decompressed, but the member or frame appended by the next run could not.
+    The records of the unterminated member are truncated from the file and written back as a complete member / frame.
+    Returns True if the file was repaired.
+    """
+    if compression is None or not os.path.isfile(filename):
+        return False
+    # end offset of the last complete member / frame, and data of the incomplete one
+    complete_size = 0
+    offset = 0
+    decompressor = None
+    tail: list[bytes] = []
+    with open(filename, "rb") as f:
+        while chunk := f.read(1 << 16):
+            while chunk:
+                if decompressor is None:
+                    decompressor = _new_decompressor(compression)
+                    tail = []
+                tail.append(decompressor.decompress(chunk))
+                if not decompressor.eof:
+                    offset += len(chunk)
+                    break
+                unused_data = decompressor.unused_data
+                offset += len(chunk) - len(unused_data)
+                complete_size = offset
+                decompressor = None
+                chunk = unused_data
+    if decompressor is None:
+        return False
+    data = b"".join(tail)
+    # drop a partly written record
+    data = data[:data.rfind(b"\n") + 1]
+    with open(filename, "r+b") as f:
+        f.truncate(complete_size)
+        f.seek(complete_size)
+        if data:
+            f.write(gzip.compress(data) if compression == 'gzip' else zstandard.ZstdCompressor().compress(data))
+    return True
+
+
+class AbstractBookDataWriter(ABC):
+    """
+    Export Book Data objects to an output file.
+
+    Writers stream their records: the output file is opened on the first call to append_data()
+    and kept open until close() is called. Writers can be used as context managers.
+    Records may be appended from several threads.
+    """
+    file_extension = ""
+
+    def __init__(self, filename: str, compression: str = None, check_path: bool = True):
+        """
+        check_path -- check the output directory exists and is writable (see QueueBookDataWriter, which may not write to it)
+        """
         path = os.path.dirname(filename) or os.path.curdir
         self.path = os.path.abspath(path)
-        if not(os.path.exists(path) and os.access(path, os.W_OK)):
-            raise FileNotFoundError("Can't output to CSV file: base dir is not accessible (check the base directory exists and is writable)")
         self.basename = os.path.basename(filename)
         self.full_file_path = os.path.join(path, self.basename)
-        if os.path.exists(self.full_file_path) and not os.access(self.full_file_path, os.W_OK):
-            raise FileNotFoundError("Existing output file is not writable.")
-        if os.path.exists(self.full_file_path) and not os.path.isfile(self.full_file_path):
-            raise FileExistsError("Ouptut path is not a file")
-        
-        self.delimiter = ","
-        self.newline = ""
-        self.quotechar='"'
-        self.escapechar="\\"
-        # create an empty book to set the CSV field names
+        if check_path:
+            # check path to output file exists and is writable
+            if not(os.path.exists(path) and os.access(path, os.W_OK)):
+                raise FileNotFoundError("Can't output to file: base dir is not accessible (check the base directory exists and is writable)")
+            if os.path.exists(self.full_file_path) and not os.access(self.full_file_path, os.W_OK):
+                raise FileNotFoundError("Existing output file is not writable.")
+            if os.path.exists(self.full_file_path) and not os.path.isfile(self.full_file_path):
+                raise FileExistsError("Ouptut path is not a file")
+        if compression not in COMPRESSION_SUFFIXES:
+            raise ValueError(f"Unsupported compression: {compression}")
+        self.compression = compression
+        self._stream: io.TextIOBase = None
+        self._lock = threading.Lock()
+        # an interrupted compressed output is repaired once, before it is read or appended to
+        self._repair_checked = False
+        # create an empty book to set the field names
         b = BookData()
-        self.csv_fields = b.export().keys()
+        self.fields = list(b.export().keys())
+
+    def append_data(self, book_data: BookData) -> bool:
+        """
+        writes the data found in a BookData object to the end of the ouptut file
+        """
+        return self.append_record(book_data.export())
+
+    def append_record(self, record: dict) -> bool:
+        """
+        writes an exported record (as returned by BookData.export()) to the end of the output file
+        """
+        with self._lock:
+            if self._stream is None:
+                self._open_stream()
+            success = self._write_record(record)
+            # keep the output readable (and crash safe) row by row: the url of a record is marked as scraped
+            # right after, the record must not stay in a buffer. Compressed streams are synced without ending
+            # the gzip member or zstd frame (Z_SYNC_FLUSH / FLUSH_BLOCK), at some cost on the compression ratio.
+            self._stream.flush()
+        return success
+
+    def read_records(self) -> Generator[dict]:
+        """
+        Lazily reads the records already stored in the output file.
+        """
+        with self._lock:
+            if self._stream is None:
+                self._repair_output()
+        if os.path.isfile(self.full_file_path) and os.stat(self.full_file_path).st_size > 0:
+            with open_text_stream(self.full_file_path, "r", self.compression) as f:
+                yield from self.read_stream(f)
+
+    def close(self):
+        """
+        Flushes and closes the output stream.
+        """
+        with self._lock:
+            if self._stream is not None:
+                self._stream.close()
+                self._stream = None
+
+    def __enter__(self):
+        return self
 
-    def append_data(self, book_data: BookData):
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _repair_output(self):
         """
-        writes the data found in a BookData object to the end of the ouptut csv file
+        Repairs an interrupted compressed output file once, before it is read or appended to (see repair_compressed_file()).
+        Called with the lock held.
         """
+        if not self._repair_checked:
+            self._repair_checked = True
+            if repair_compressed_file(self.full_file_path, self.compression):
+                logger.warning(f"Repaired interrupted output file {self.full_file_path}")
+
+    def _open_stream(self):
+        self._repair_output()
+        is_new_file = not os.path.exists(self.full_file_path) or os.stat(self.full_file_path).st_size == 0
         if not os.path.exists(self.full_file_path):
             p = pathlib.Path(self.full_file_path)
             p.touch(0o666)
+        self._stream = open_text_stream(self.full_file_path, "a", self.compression)
+        self._on_stream_opened(is_new_file)
 
-        with open(self.full_file_path, newline=self.newline, mode="a") as f:
-            writer = csv.DictWriter(f, fieldnames=self.csv_fields, delimiter=self.delimiter, quotechar=self.quotechar, escapechar=self.escapechar)
-            # if the file is empty, also add a header
-            stat = os.stat(self.full_file_path)
-            if stat.st_size == 0:
-                writer.writeheader()
-            # now write the actual data
-            success = writer.writerow(book_data.export())
+    def _on_stream_opened(self, is_new_file: bool):
+        """
+        Called once the output stream is opened, typically to write a header.
+        """
+        pass
 
-        return success
-    
+    @abstractmethod
+    def _write_record(self, record: dict) -> bool:
+        """
+        Writes a single record to the open output stream.
+        """
+        pass
+
+    @classmethod
+    @abstractmethod
+    def read_stream(cls, stream: io.TextIOBase) -> Generator[dict]:
+        """
+        Reads records from an input stream.
+        """
+        pass
+
+
+class BookDataWriter(AbstractBookDataWriter):
+    """
+    Export Book Data objects to a CSV file
+    """
+    file_extension = ".csv"
+    delimiter = ","
+    quotechar = '"'
+    escapechar = "\\"
+
+    def __init__(self, filename: str, compression: str = None):
+        super().__init__(filename, compression)
+        self.csv_fields = self.fields
+        self._csv_writer: csv.DictWriter = None
+
+    def _on_stream_opened(self, is_new_file: bool):
+        self._csv_writer = csv.DictWriter(self._stream, fieldnames=self.csv_fields, delimiter=self.delimiter, quotechar=self.quotechar, escapechar=self.escapechar)
+        # if the file is empty, also add a header
+        if is_new_file:
+            self._csv_writer.writeheader()
+
+    def _write_record(self, record: dict) -> bool:
+        return self._csv_writer.writerow(record)
+
+    @classmethod
+    def read_stream(cls, stream: io.TextIOBase) -> Generator[dict]:
+        yield from csv.DictReader(stream, delimiter=cls.delimiter, quotechar=cls.quotechar, escapechar=cls.escapechar)
+
+
+class JsonLinesBookDataWriter(AbstractBookDataWriter):
+    """
+    Export Book Data objects to a JSON Lines file (one JSON object per line)
+    """
+    file_extension = ".jsonl"
+
+    def _write_record(self, record: dict) -> bool:
+        return self._stream.write(json.dumps(record, ensure_ascii= False) + "\n") > 0
+
+    @classmethod
+    def read_stream(cls, stream: io.TextIOBase) -> Generator[dict]:
+        for line in stream:
+            if line.strip():
+                yield json.loads(line)
+
+
+class StreamClosed(BaseException):
+    """
+    Raised in the scraping threads when the consumer of a book stream is gone (see QueueBookDataWriter).
+    Like a KeyboardInterrupt, it interrupts the crawl (and saves its checkpoint) instead of being handled as a scraping error.
+    """
+    pass
+
+
+class QueueBookDataWriter(AbstractBookDataWriter):
+    """
+    Hands the books to a consumer through a bounded queue (see Scraper.iter_books()), and optionally tees them
+    to a file writer: the queue and the output file are then two consumers of the same books.
+    Without a file writer, nothing is written to disk: the output file name only identifies the category.
+
+    append_data() blocks while the queue is full, so that the scraping threads wait for the consumer (backpressure).
+    Once the consumer is gone (closed is set), it raises a StreamClosed exception.
+    """
+    # wait between 2 checks of the closed flag, while the queue is full
+    PUT_TIMEOUT = 0.1
+
+    def __init__(self, filename: str, books: queue.Queue, closed: threading.Event, writer: AbstractBookDataWriter = None):
+        # the output directory may not exist: without a file writer, nothing is written
+        super().__init__(filename, compression= writer.compression if writer else None, check_path= False)
+        self.books = books
+        self.closed = closed
+        self.writer = writer
+
+    def append_data(self, book_data: BookData) -> bool:
+        if self.writer is not None:
+            self.writer.append_data(book_data)
+        return self._put(book_data)
+
+    def append_record(self, record: dict) -> bool:
+        """
+        Hands an exported record (ex. a book copied from a previous output) to the consumer as a BookData object.
+        """
+        if self.writer is not None:
+            self.writer.append_record(record)
+        book_data = BookData()
+        for field, value in record.items():
+            if hasattr(book_data, field):
+                setattr(book_data, field, value)
+        return self._put(book_data)
+
+    def read_records(self) -> Generator[dict]:
+        if self.writer is not None:
+            yield from self.writer.read_records()
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+    def _put(self, book_data: BookData) -> bool:
+        while True:
+            if self.closed.is_set():
+                raise StreamClosed()
+            try:
+                self.books.put(book_data, timeout= self.PUT_TIMEOUT)
+                return True
+            except queue.Full:
+                continue
+
+    def _write_record(self, record: dict) -> bool:
+        return self.append_record(record)
+
+    @classmethod
+    def read_stream(cls, stream: io.TextIOBase) -> Generator[dict]:
+        yield from ()
+
+
+WRITER_FORMATS: dict[str, type[AbstractBookDataWriter]] = {
+    'csv': BookDataWriter,
+    'jsonl': JsonLinesBookDataWriter
+}
+
+def output_file_suffix(output_format: str = "csv", compression: str = None) -> str:
+    """
+    Returns the file extension matching an output format and compression, ex.: ".jsonl.gz"
+    """
+    return WRITER_FORMATS[output_format].file_extension + COMPRESSION_SUFFIXES[compression]
+
+def create_writer(filename: str, output_format: str = "csv", compression: str = None) -> AbstractBookDataWriter:
+    """
+    Instanciates the writer matching an output format ("csv" or "jsonl").
+    compression -- None, "gzip" or "zstd"
+    """
+    if output_format not in WRITER_FORMATS:
+        raise ValueError(f"Unsupported output format: {output_format}")
+    return WRITER_FORMATS[output_format](filename, compression= compression)
+
+def guess_output_format(filename: str) -> tuple[str, str]:
+    """
+    Guesses the output format and compression of an output file from its extension.
+    Returns a tuple (output format, compression), ex.: ("jsonl", "gzip")
+    """
+    for compression, compression_suffix in COMPRESSION_SUFFIXES.items():
+        for output_format, writer_class in WRITER_FORMATS.items():
+            if compression and filename.endswith(writer_class.file_extension + compression_suffix):
+                return (output_format, compression)
+    for output_format, writer_class in WRITER_FORMATS.items():
+        if filename.endswith(writer_class.file_extension):
+            return (output_format, None)
+    raise ValueError(f"Unknown output format: {filename}")
+
+def read_output_records(filename: str) -> Generator[dict]:
+    """
+    Lazily reads the records of an existing output file, whatever its format and compression.
+    The file may be stored in a read-only directory.
+    """
+    output_format, compression = guess_output_format(filename)
+    with open_text_stream(filename, "r", compression) as f:
+        yield from WRITER_FORMATS[output_format].read_stream(f)
+
+if __name__ == "__main__":
+    import shutil
+    import tempfile
+    book = BookData()
+    book.universal_product_code = "a897fe39b1053632"
+    book.title = 'A "quoted" title, with commas'
+    book.product_description = "multi\nline \\ description"
+    book.price_including_tax = 51.77
+    compressions = [None, 'gzip'] + (['zstd'] if zstandard else [])
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for output_format in WRITER_FORMATS:
+            for compression in compressions:
+                filename = os.path.join(tmp_dir, "test" + output_file_suffix(output_format, compression))
+                # write twice to the same file to check appending to an existing output
+                for i in range(2):
+                    with create_writer(filename, output_format, compression) as writer:
+                        assert writer.append_data(book)
+                assert guess_output_format(filename) == (output_format, compression)
+                records = list(read_output_records(filename))
+                assert len(records) == 2, f"{filename}: expected 2 records, found {len(records)}"
+                assert records[1]['title'] == book.title
+                assert records[1]['product_description'] == book.product_description
+                print(f"{os.path.basename(filename)}: {os.stat(filename).st_size} bytes")
+                # interrupted writer: a copy of the output taken before close() ends with an unterminated member / frame
+                interrupted_filename = os.path.join(tmp_dir, "interrupted" + output_file_suffix(output_format, compression))
+                with create_writer(filename, output_format, compression) as writer:
+                    assert writer.append_data(book)
+                    shutil.copyfile(filename, interrupted_filename)
+                assert repair_compressed_file(interrupted_filename, compression) == (compression is not None)
+                with create_writer(interrupted_filename, output_format, compression) as writer:
+                    assert writer.append_data(book)
+                assert len(list(read_output_records(interrupted_filename))) == 4
+    print("Test completed")
@@ -46,6 +46,22 @@ class BooksToScrapeGenerator(AbstractScrapingGenerator):
         else:
             return []
 
+    def gen_listing_items_from_index(self, index_soup: bs4.BeautifulSoup, base_url: str) -> list[dict[str, str]]:
+        """
+        called by ScrapeIndex._read_url_index()
+        Reads the product urls, with the price and availability shown on the listing.
+        """
+        listing_items = []
+        for product_pod in index_soup.css.select('section ol.row > li article.product_pod'):
+            if link := product_pod.css.select_one('h3 a'):
+                item = {'url': urllib.parse.urljoin(base_url, link.attrs.get('href', ''))}
+                if price_tag := product_pod.css.select_one('p.price_color'):
+                    item['price'] = " ".join(price_tag.stripped_strings)
+                if availability_tag := product_pod.css.select_one('p.instock.availability'):
+                    item['availability'] = " ".join(availability_tag.stripped_strings)
+                listing_items.append(item)
+        return listing_items
+
     def gen_index_next_page_url(self, index_soup: bs4.BeautifulSoup, base_url: str) -> str:
         """
         called by ScrapeIndex._read_url_index()
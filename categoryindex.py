@@ -8,19 +8,30 @@ from bs4 import BeautifulSoup
 import re
 from remotedatasource import RemoteDataSource
 from scraping_generators import AbstractScrapingGenerator
+from urlstatestore import UrlStateStore
+from urlsets import DigestUrlSet, BloomUrlSet
+from metrics import Metrics
 import logging
 logger = logging.getLogger(__name__)
 
 class CategoryIndex(ScrapeIndex):
-    def __init__(self, category_url: str, scraping_generator: AbstractScrapingGenerator, data_src: RemoteDataSource = None):
-        super().__init__(data_src=data_src, scraping_generator = scraping_generator)
+    def __init__(self, category_url: str, scraping_generator: AbstractScrapingGenerator, data_src: RemoteDataSource = None, url_store: UrlStateStore = None, seen_urls: DigestUrlSet | BloomUrlSet = None, metrics: Metrics = None):
+        super().__init__(data_src=data_src, scraping_generator = scraping_generator, url_store= url_store, seen_urls= seen_urls, metrics= metrics)
         self.category_url: str = category_url
         self.category_name: str = ''
         self.total_books: int = 0
-        category_html = self.src.read_text(self.category_url)
-        self.category_soup = BeautifulSoup(category_html, 'html.parser')
+        self._categories: dict[str, str] = None
+        category_html = self.fetch_index_html(self.category_url)
+        self.category_soup: BeautifulSoup = BeautifulSoup(category_html, 'html.parser')
         self._read_category_info()
         self.load_generator_from_url(self.category_url)
+
+    def release(self):
+        """
+        Drops the parsed category page to free memory.
+        The category name, book count and the list of categories (if already read) are kept.
+        """
+        self.category_soup = None
     
     def _read_category_info(self):
         """
@@ -36,7 +47,12 @@ class CategoryIndex(ScrapeIndex):
         Reads category names and urls from the navigation menu.
         Returns a dictionary mapping category urls to category names.
         """
-        return self.scraping_generator.gen_categories_urls(base_url= self.category_url, category_soup= self.category_soup)
+        if self._categories is None:
+            if self.category_soup is None:
+                # the parsed page has been released, read it again
+                self.category_soup = BeautifulSoup(self.fetch_index_html(self.category_url), 'html.parser')
+            self._categories = self.scraping_generator.gen_categories_urls(base_url= self.category_url, category_soup= self.category_soup)
+        return self._categories
 
     def _normalize_stripped_strings(self, stripped_strings):
         return " ".join([s.strip() for s in re.split(r'[\t\n\r\f\v]+', stripped_strings)])
@@ -44,14 +60,20 @@ class CategoryIndex(ScrapeIndex):
 if __name__ == "__main__":
     logging.basicConfig(level=logging.DEBUG)
     from books_to_scrape_generators import BooksToScrapeGenerator
-    cat_idx = CategoryIndex(
-        category_url= 'https://books.toscrape.com/catalogue/category/books/travel_2/index.html',
-        scraping_generator= BooksToScrapeGenerator()
-    )
-    print(cat_idx.category_name, cat_idx.category_url)
-    print("\nAll categories:")
-    for url, cat_name in cat_idx.list_categories().items():
-        print(cat_name, url)
-    print("\nBooks in this category:")
-    for url in cat_idx.list_urls_to_scrape():
-        print(url)
+    from mockserver import MockBooksServer, MockCatalog
+    with MockBooksServer(MockCatalog(categories= 3, books_per_category= 30)) as server:
+        cat_idx = CategoryIndex(
+            category_url= server.base_url + 'catalogue/category/books/category-2_3/index.html',
+            scraping_generator= BooksToScrapeGenerator()
+        )
+        print(cat_idx.category_name, cat_idx.category_url)
+        print("\nAll categories:")
+        for url, cat_name in cat_idx.list_categories().items():
+            print(cat_name, url)
+        print("\nBooks in this category:")
+        urls = list(cat_idx.list_urls_to_scrape())
+        for url in urls:
+            print(url)
+        assert cat_idx.category_name == "Category 2" and cat_idx.total_books == 30
+        assert len(cat_idx.list_categories()) == 3 and len(set(urls)) == 30
+    print("Test completed")
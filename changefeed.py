@@ -0,0 +1,173 @@
+"""
+openclassrooms Python - Project 2
+bookscraper package
+@author Christian Debray - christian.debray@gmail.com
+"""
+from bookdatawriter import open_text_stream, guess_output_format, read_output_records, output_file_suffix
+from collections.abc import Generator, Iterable
+from operator import itemgetter
+import argparse
+import heapq
+import itertools
+import json
+import os
+import tempfile
+import logging
+logger = logging.getLogger(__name__)
+
+CHANGE_FEED_BASENAME = "changefeed"
+DEFAULT_KEY = "universal_product_code"
+DEFAULT_FIELDS = ["price_including_tax", "number_available", "review_rating"]
+
+def list_output_files(data_dir: str, basenames: list[str] = None) -> list[str]:
+    """
+    Lists the book data output files (csv, jsonl, compressed or not) found in a directory, sorted by name.
+    The change feed itself is ignored.
+    basenames -- optionally restrict the list to the given file names
+    """
+    output_files = []
+    if not os.path.isdir(data_dir):
+        return output_files
+    with os.scandir(data_dir) as entries:
+        for entry in entries:
+            if not entry.is_file() or entry.name.startswith(".") or entry.name.startswith(CHANGE_FEED_BASENAME + "."):
+                continue
+            if basenames is not None and entry.name not in basenames:
+                continue
+            try:
+                guess_output_format(entry.name)
+            except ValueError:
+                continue
+            output_files.append(entry.path)
+    return sorted(output_files)
+
+def sort_records(records: Iterable[dict], key: str = DEFAULT_KEY, chunk_size: int = 50_000) -> Generator[dict]:
+    """
+    Lazily sorts records by key with bounded memory (external merge sort):
+    records are sorted by chunks of chunk_size, spilled to temporary files and merged back.
+    Records without a key are ignored.
+    """
+    key_getter = itemgetter(key)
+    with tempfile.TemporaryDirectory(prefix= "changefeed_") as tmp_dir:
+        spill_files = []
+        chunk = []
+        for record in records:
+            if not record.get(key):
+                continue
+            chunk.append(record)
+            if len(chunk) >= chunk_size:
+                spill_files.append(_spill_chunk(chunk, key_getter, tmp_dir, len(spill_files)))
+                chunk = []
+        chunk.sort(key= key_getter)
+        if not spill_files:
+            yield from chunk
+            return
+        streams = [open(f, "r", encoding= "utf-8") for f in spill_files]
+        try:
+            sorted_streams = [(json.loads(line) for line in stream) for stream in streams]
+            yield from heapq.merge(*sorted_streams, chunk, key= key_getter)
+        finally:
+            for stream in streams:
+                stream.close()
+
+def _spill_chunk(chunk: list[dict], key_getter, tmp_dir: str, n: int) -> str:
+    chunk.sort(key= key_getter)
+    path = os.path.join(tmp_dir, f"chunk_{n}.jsonl")
+    with open(path, "w", encoding= "utf-8") as f:
+        for record in chunk:
+            f.write(json.dumps(record, ensure_ascii= False) + "\n")
+    return path
+
+def _unique_keys(sorted_records: Iterable[dict], key: str) -> Generator[dict]:
+    """
+    Collapses consecutive records with the same key, keeps the last one.
+    """
+    for _, group in itertools.groupby(sorted_records, key= itemgetter(key)):
+        *_, last = group
+        yield last
+
+def diff_sorted_records(previous: Iterable[dict], current: Iterable[dict], key: str = DEFAULT_KEY, fields: list[str] = None) -> Generator[dict]:
+    """
+    Compares two streams of records sorted by key (sorted merge), and lists the changes:
+    ```
+    {"op": "added", "universal_product_code": ..., "record": {...}}
+    {"op": "removed", "universal_product_code": ..., "record": {...}}
+    {"op": "modified", "universal_product_code": ..., "product_page_url": ..., "changes": {"price_including_tax": {"old": ..., "new": ...}}}
+    ```
+    Field values are compared as strings, so that csv and jsonl outputs can be compared with each other.
+    """
+    fields = fields or DEFAULT_FIELDS
+    previous_iter = _unique_keys(previous, key)
+    current_iter = _unique_keys(current, key)
+    p = next(previous_iter, None)
+    c = next(current_iter, None)
+    while p is not None or c is not None:
+        if c is None or (p is not None and p[key] < c[key]):
+            yield {'op': 'removed', key: p[key], 'record': p}
+            p = next(previous_iter, None)
+        elif p is None or c[key] < p[key]:
+            yield {'op': 'added', key: c[key], 'record': c}
+            c = next(current_iter, None)
+        else:
+            changes = {
+                field: {'old': p.get(field), 'new': c.get(field)}
+                for field in fields if str(p.get(field)) != str(c.get(field))}
+            if changes:
+                yield {'op': 'modified', key: c[key], 'product_page_url': c.get('product_page_url'), 'changes': changes}
+            p = next(previous_iter, None)
+            c = next(current_iter, None)
+
+def write_change_feed(
+        previous_dir: str,
+        current_dir: str,
+        output_file: str = None,
+        fields: list[str] = None,
+        basenames: list[str] = None,
+        compression: str = None,
+        chunk_size: int = 50_000) -> dict[str, int]:
+    """
+    Writes the changes between the outputs of two runs to a JSON Lines file (see diff_sorted_records()).
+    Both outputs are streamed and sorted by universal product code with bounded memory.
+
+    output_file -- defaults to changefeed.jsonl in current_dir (plus the compression suffix)
+    basenames -- only compare the given output files (ex. when a single category was scraped)
+    Returns the number of changes by type.
+    """
+    if output_file is None:
+        output_file = os.path.join(current_dir, CHANGE_FEED_BASENAME + output_file_suffix("jsonl", compression))
+    def chain_records(data_dir):
+        for path in list_output_files(data_dir, basenames):
+            yield from read_output_records(path)
+    counts = {'added': 0, 'removed': 0, 'modified': 0}
+    if os.path.exists(output_file):
+        os.remove(output_file)
+    with open_text_stream(output_file, "a", compression) as f:
+        changes = diff_sorted_records(
+            sort_records(chain_records(previous_dir), chunk_size= chunk_size),
+            sort_records(chain_records(current_dir), chunk_size= chunk_size),
+            fields= fields)
+        for change in changes:
+            counts[change['op']] += 1
+            f.write(json.dumps(change, ensure_ascii= False) + "\n")
+    logger.info(f"Wrote change feed to {output_file}: {counts}")
+    return counts
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog="changefeed",
+        description="List the books added, removed or modified between the outputs of two scraping runs.",
+        formatter_class=argparse.RawTextHelpFormatter
+    )
+    parser.add_argument("previous_dir", help="output directory of the previous run")
+    parser.add_argument("current_dir", help="output directory of the current run")
+    parser.add_argument("-o", "--output", default=None, help="path to the change feed (defaults to changefeed.jsonl in current_dir)")
+    parser.add_argument(
+        "--fields",
+        action="extend",
+        nargs="+",
+        default=[],
+        help="fields to compare (defaults to {0})".format(" ".join(DEFAULT_FIELDS))
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    print(write_change_feed(args.previous_dir, args.current_dir, output_file= args.output, fields= args.fields or None))
@@ -0,0 +1,106 @@
+"""
+openclassrooms Python - Project 2
+bookscraper package
+@author Christian Debray - christian.debray@gmail.com
+"""
+import json
+import os
+import time
+import logging
+logger = logging.getLogger(__name__)
+
+class CrawlCheckpoint:
+    """
+    Saves the state of a crawl (its frontier) to a JSON file, so that an interrupted crawl can be resumed.
+
+    The state is a JSON serializable dictionary built by the Scraper, typically:
+    ```
+    {
+        "scrape_type": "scrape_all",
+        "scrape_url": "https://books.toscrape.com/",
+        "remaining_categories": [[category_url, output_file], ...],
+        "current_category": {"url": ..., "output_file": ..., "next_index_url": ..., "pending_urls": [...]},
+        "pending_images": [{"image_url": ..., "universal_product_code": ..., "image_dir": ...}, ...]
+    }
+    ```
+    Writes are atomic (temporary file + rename): a crash while saving leaves the previous checkpoint intact.
+    """
+    DEFAULT_FILENAME = ".scrape_checkpoint.json"
+    VERSION = 1
+
+    def __init__(self, path: str, interval: float = 30.0):
+        """
+        path -- path to the checkpoint file
+        interval -- minimum delay in seconds between two periodic saves (see save())
+        """
+        self.path = path
+        self.interval = interval
+        self._last_save: float = 0.0
+
+    def exists(self) -> bool:
+        return os.path.isfile(self.path)
+
+    def load(self) -> dict | None:
+        """
+        Returns the saved state, or None if there is no (valid) checkpoint.
+        """
+        if not self.exists():
+            return None
+        try:
+            with open(self.path, "r") as f:
+                checkpoint = json.load(f)
+        except (OSError, ValueError):
+            logger.warning(f"Can't read checkpoint file {self.path}, ignore it.", exc_info= True)
+            return None
+        if checkpoint.get('version') != self.VERSION:
+            logger.warning(f"Unsupported checkpoint version in {self.path}, ignore it.")
+            return None
+        return checkpoint.get('state')
+
+    def is_due(self) -> bool:
+        """
+        Returns True if the checkpoint interval has elapsed since the last save.
+        Lets the caller skip building a large state that would not be saved.
+        """
+        return time.monotonic() - self._last_save >= self.interval
+
+    def save(self, state: dict, force: bool = False) -> bool:
+        """
+        Saves the state if the checkpoint interval has elapsed since the last save, or if force is True.
+        Returns True if the state has been written.
+        """
+        now = time.monotonic()
+        if not force and not self.is_due():
+            return False
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({'version': self.VERSION, 'saved_at': time.time(), 'state': state}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        self._last_save = now
+        logger.debug(f"Saved checkpoint to {self.path}")
+        return True
+
+    def clear(self):
+        """
+        Removes the checkpoint file, typically once the crawl is completed.
+        """
+        if self.exists():
+            os.remove(self.path)
+
+if __name__ == "__main__":
+    import tempfile
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        checkpoint = CrawlCheckpoint(os.path.join(tmp_dir, CrawlCheckpoint.DEFAULT_FILENAME), interval= 60)
+        assert checkpoint.load() is None
+        state = {'scrape_type': 'scrape_all', 'remaining_categories': [["https://example.com/cat", "cat.csv"]]}
+        assert checkpoint.save(state)
+        # throttled:
+        assert not checkpoint.save({'scrape_type': 'other'})
+        assert checkpoint.load() == state
+        assert checkpoint.save({'scrape_type': 'other'}, force= True)
+        assert checkpoint.load()['scrape_type'] == 'other'
+        checkpoint.clear()
+        assert checkpoint.load() is None
+    print("Test completed")
@@ -0,0 +1,291 @@
+"""
+openclassrooms Python - Project 2
+bookscraper package
+@author Christian Debray - christian.debray@gmail.com
+"""
+from concurrent.futures import ThreadPoolExecutor
+import math
+import threading
+import time
+from bs4 import BeautifulSoup
+from categoryindex import CategoryIndex
+from imagepipeline import IMAGES_INLINE, IMAGES_BACKGROUND, IMAGES_DEFER, IMAGES_SKIP, IMAGE_MODES
+from metrics import Metrics
+from remotedatasource import RemoteDataSource
+from scraping_generators import AbstractScrapingGenerator
+from scrapetypes import SCRAPE_ALL, SCRAPE_CATEGORY, SCRAPE_PRODUCT
+import logging
+logger = logging.getLogger(__name__)
+
+class CrawlPlanner:
+    """
+    Dry run of a crawl: fetches only the home page and the first page of each category (the category header
+    shows the number of books), plus one sample product page and its image, and computes the requests
+    and bytes of the crawl, and an estimate of its duration for the configured workers and requests delay.
+
+    The counts match a crawl to an empty output directory: books already scraped (resumed or incremental crawls)
+    are not known until the listings are read, so the plan is an upper bound for them. Retries are not counted.
+
+    Usage:
+    ```
+     planner = CrawlPlanner(BooksToScrapeGenerator(), workers= 4, requests_delay= 0.5)
+     plan = planner.plan('https://books.toscrape.com/')
+     print(CrawlPlanner.summary(plan))
+    ```
+    """
+    def __init__(
+            self,
+            scraping_generator: AbstractScrapingGenerator,
+            workers: int = 1,
+            requests_delay: float = 0,
+            timeout: tuple[float, float] = (3.05, 7.0),
+            images: str = IMAGES_INLINE,
+            image_workers: int = 2,
+            scrape_contents: bool = True):
+        """
+        The parameters describe the planned crawl, see Scraper.__init__().
+        The probe requests are sent by up to workers threads, each waiting requests_delay between 2 requests.
+        """
+        if images not in IMAGE_MODES:
+            raise ValueError(f"Unsupported images mode: {images}")
+        self.scraping_generator = scraping_generator
+        self.workers: int = max(1, workers)
+        self.requests_delay: float = requests_delay
+        self.timeout = timeout
+        self.images: str = images
+        self.image_workers: int = max(1, image_workers)
+        self.scrape_contents: bool = scrape_contents
+        # probe requests, without the requests delay
+        self.metrics = Metrics()
+        self._thread_local = threading.local()
+
+    @property
+    def _data_source(self) -> RemoteDataSource:
+        """
+        The data source of the current thread. The requests delay is spent outside of the measured fetches.
+        """
+        if (data_source := getattr(self._thread_local, 'data_source', None)) is None:
+            data_source = self._thread_local.data_source = RemoteDataSource(timeout= self.timeout)
+        return data_source
+
+    def plan(self, url: str, scrape_type: str = SCRAPE_ALL) -> dict:
+        """
+        Probes the site and returns the plan of the crawl of url (the catalog home page, a category page or a product page):
+        {'scrape_url', 'scrape_type', 'categories': [{'name', 'url', 'books', 'index_pages', 'requests', 'bytes'}, ...],
+        'totals': {'books', 'requests', 'bytes'}, 'probe': {...}, 'estimate': {...}}
+        Requests are counted per kind: {'index': ..., 'product': ..., 'image': ...}
+        """
+        categories = []
+        home_requests = 0
+        if scrape_type == SCRAPE_PRODUCT:
+            self._probe_product(url)
+        else:
+            if scrape_type == SCRAPE_ALL:
+                home_index = self._probe_category(url)
+                category_urls = list(home_index.list_categories())
+                home_requests = 1
+            else:
+                category_urls = [url]
+            with ThreadPoolExecutor(max_workers= self.workers, thread_name_prefix= "planner") as executor:
+                category_indexes = list(executor.map(self._probe_category, category_urls))
+            categories = [self._plan_category(category_index) for category_index in category_indexes]
+            # a sample product page and its image, from the largest category
+            if self.scrape_contents and (sample := max(category_indexes, key= lambda c: c.total_books)).total_books:
+                self._probe_product(self.scraping_generator.gen_product_urls_from_index(sample.category_soup, sample.category_url)[0])
+        probe = self._probe_stats()
+        for category in categories:
+            category['bytes'] = (
+                category['requests']['index'] * probe['index_page_bytes']
+                + category['requests']['product'] * probe['product_page_bytes']
+                + category['requests']['image'] * probe['image_bytes'])
+        if scrape_type == SCRAPE_PRODUCT:
+            requests = {'index': 0, 'product': 1, 'image': int(self._fetches_images())}
+            books = 1
+        else:
+            requests = {kind: sum(c['requests'][kind] for c in categories) for kind in ('index', 'product', 'image')}
+            requests['index'] += home_requests
+            books = sum(c['books'] for c in categories)
+        plan = {
+            'scrape_url': url,
+            'scrape_type': scrape_type,
+            'categories': categories,
+            'totals': {
+                'books': books,
+                'requests': requests,
+                'bytes': round(
+                    requests['index'] * probe['index_page_bytes']
+                    + requests['product'] * probe['product_page_bytes']
+                    + requests['image'] * probe['image_bytes'])
+            },
+            'probe': probe
+        }
+        plan['estimate'] = self.estimate(plan)
+        return plan
+
+    def estimate(self, plan: dict) -> dict:
+        """
+        Estimates the duration of the planned crawl from the latencies measured by the probe requests.
+        Each request takes its latency plus the requests delay, product pages also take the parse time of the sample page.
+        With a single worker, the pages are read one after the other; with several workers, the requests are shared
+        by the workers, but the index pages of a category are read in turn and the parsing does not run in parallel (GIL).
+        Background images are downloaded by the image workers during the page crawl.
+        """
+        probe = plan['probe']
+        index_time = probe['index_latency'] + self.requests_delay
+        product_time = probe['product_latency'] + probe['parse_seconds'] + self.requests_delay
+        image_time = probe['image_latency'] + self.requests_delay
+        requests = plan['totals']['requests']
+        pages_seconds = requests['index'] * index_time + requests['product'] * product_time
+        images_seconds = requests['image'] * image_time
+        if self.images == IMAGES_INLINE:
+            pages_seconds += images_seconds
+            images_seconds = 0.0
+        # longest chain of index pages
+        critical_path = max([c['requests']['index'] * index_time for c in plan['categories']], default= 0.0)
+        pages_seconds = max(pages_seconds / self.workers, critical_path, requests['product'] * probe['parse_seconds'])
+        images_seconds /= self.image_workers
+        return {
+            'workers': self.workers,
+            'requests_delay': self.requests_delay,
+            'images': self.images,
+            'image_workers': self.image_workers,
+            'pages_seconds': round(pages_seconds, 3),
+            'images_seconds': round(images_seconds, 3),
+            'seconds': round(max(pages_seconds, images_seconds), 3)
+        }
+
+    @staticmethod
+    def summary(plan: dict) -> str:
+        """
+        Formats a plan as a table of the requests per category, followed by the totals and the estimated duration.
+        """
+        lines = [f"{'category':<32}{'books':>8}{'index':>8}{'product':>9}{'image':>8}{'MB':>10}"]
+        for category in plan['categories']:
+            requests = category['requests']
+            lines.append(
+                f"{category['name'][:31]:<32}{category['books']:>8}{requests['index']:>8}{requests['product']:>9}"
+                f"{requests['image']:>8}{category['bytes'] / 1e6:>10.2f}")
+        totals = plan['totals']
+        requests = totals['requests']
+        lines.append(
+            f"{'total':<32}{totals['books']:>8}{requests['index']:>8}{requests['product']:>9}"
+            f"{requests['image']:>8}{totals['bytes'] / 1e6:>10.2f}")
+        probe = plan['probe']
+        estimate = plan['estimate']
+        lines.append(
+            f"Probe: {probe['requests']} requests, latency index {probe['index_latency'] * 1000:.0f}ms,"
+            f" product {probe['product_latency'] * 1000:.0f}ms (parse {probe['parse_seconds'] * 1000:.0f}ms), image {probe['image_latency'] * 1000:.0f}ms")
+        lines.append(
+            f"Estimate: {sum(requests.values())} requests in {CrawlPlanner._format_duration(estimate['seconds'])}"
+            f" with {estimate['workers']} workers, {estimate['requests_delay']}s delay, images {estimate['images']}"
+            + (f" ({estimate['image_workers']} image workers)" if estimate['images'] == IMAGES_BACKGROUND else ""))
+        return "\n".join(lines)
+
+    @staticmethod
+    def _format_duration(seconds: float) -> str:
+        if seconds < 60:
+            return f"{seconds:.1f}s"
+        minutes, seconds = divmod(round(seconds), 60)
+        hours, minutes = divmod(minutes, 60)
+        return f"{hours}h{minutes:02d}m{seconds:02d}s" if hours else f"{minutes}m{seconds:02d}s"
+
+    def _plan_category(self, category_index: CategoryIndex) -> dict:
+        """
+        Counts the requests of a category, from its book count and the number of books listed on its first page.
+        """
+        books = category_index.total_books
+        page_size = len(self.scraping_generator.gen_product_urls_from_index(category_index.category_soup, category_index.category_url))
+        index_pages = math.ceil(books / page_size) if page_size else 1
+        # a single worker reads the category page, then lists its books from the first index page (the same page) again
+        index_requests = index_pages + (1 if self.workers == 1 else 0)
+        products = books if self.scrape_contents else 0
+        return {
+            'name': category_index.category_name,
+            'url': category_index.category_url,
+            'books': books,
+            'index_pages': index_pages,
+            'requests': {'index': index_requests, 'product': products, 'image': products if self._fetches_images() else 0}
+        }
+
+    def _fetches_images(self) -> bool:
+        """
+        True if the crawl downloads the images (deferred images are only downloaded later, see --fetch-images).
+        """
+        return self.scrape_contents and self.images not in (IMAGES_DEFER, IMAGES_SKIP)
+
+    def _probe_category(self, url: str) -> CategoryIndex:
+        self._wait()
+        return CategoryIndex(category_url= url, scraping_generator= self.scraping_generator, data_src= self._data_source, metrics= self.metrics)
+
+    def _probe_product(self, url: str):
+        """
+        Fetches a product page, and its image if the crawl downloads the images.
+        """
+        self._wait()
+        with self.metrics.measure("product_fetch") as m:
+            html = self._data_source.read_text(url)
+            m.bytes = len(self._data_source.response.content)
+        with self.metrics.measure("parse"):
+            book = self.scraping_generator.gen_book_data(BeautifulSoup(html, 'html.parser'), url)
+        if self._fetches_images() and book and book.image_url:
+            self._wait()
+            with self.metrics.measure("image_fetch") as m:
+                m.bytes = len(self._data_source.fetch_binary(book.image_url) or b'')
+
+    def _wait(self):
+        if self.requests_delay > 0:
+            time.sleep(self.requests_delay)
+
+    def _probe_stats(self) -> dict:
+        """
+        Mean latency and size of the probe requests per kind, and parse time of the sample product page.
+        Product pages and images default to the index pages when not probed.
+        """
+        stages = self.metrics.report()['stages']
+        def stage_stats(stage: str, default: tuple[float, float]) -> tuple[float, float]:
+            if not (stats := stages.get(stage)):
+                return default
+            return stats['mean_seconds'], stats['bytes'] / stats['count']
+        index_stats = stage_stats("index_fetch", (0.0, 0.0))
+        product_stats = stage_stats("product_fetch", index_stats)
+        image_stats = stage_stats("image_fetch", product_stats)
+        return {
+            'requests': sum(stats['count'] for stage, stats in stages.items() if stage.endswith("_fetch")),
+            'index_latency': index_stats[0],
+            'index_page_bytes': round(index_stats[1]),
+            'product_latency': product_stats[0],
+            'product_page_bytes': round(product_stats[1]),
+            'image_latency': image_stats[0],
+            'image_bytes': round(image_stats[1]),
+            'parse_seconds': stages['parse']['mean_seconds'] if 'parse' in stages else 0.0
+        }
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    import tempfile
+    from books_to_scrape_generators import BooksToScrapeGenerator
+    from mockserver import MockBooksServer, MockCatalog
+    from scraper import Scraper
+    with MockBooksServer(MockCatalog(categories= 3, books_per_category= 30), latency= 0.005) as server:
+        planner = CrawlPlanner(BooksToScrapeGenerator())
+        plan = planner.plan(server.base_url)
+        print(CrawlPlanner.summary(plan))
+        assert [c['books'] for c in plan['categories']] == [30, 30, 30]
+        assert [c['index_pages'] for c in plan['categories']] == [2, 2, 2]
+        # home page, the category pages and a sample product and image
+        assert plan['probe']['requests'] == 6
+        # check the planned requests against actual crawls, with one and several workers
+        for workers in (1, 3):
+            plan = CrawlPlanner(BooksToScrapeGenerator(), workers= workers).plan(server.base_url)
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                scraper = Scraper(output_dir= tmp_dir, scraping_generator= BooksToScrapeGenerator(), requests_delay= 0, workers= workers)
+                start = time.perf_counter()
+                scraper.scrape_all_categories(server.base_url)
+                scraper.close()
+                print(f"{workers} workers: estimated {plan['estimate']['seconds']:.2f}s, crawled in {time.perf_counter() - start:.2f}s")
+                stages = scraper.metrics.report()['stages']
+                actual = {kind: stages[f"{kind}_fetch"]['count'] for kind in ('index', 'product', 'image')}
+                assert plan['totals']['requests'] == actual, (plan['totals']['requests'], actual)
+        plan = CrawlPlanner(BooksToScrapeGenerator(), images= IMAGES_SKIP).plan(server.base_url + "catalogue/category/books/category-2_3/index.html", SCRAPE_CATEGORY)
+        assert plan['totals']['requests'] == {'index': 3, 'product': 30, 'image': 0}
+    print("Test completed")
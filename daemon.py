@@ -0,0 +1,390 @@
+"""
+openclassrooms Python - Project 2
+bookscraper package
+@author Christian Debray - christian.debray@gmail.com
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from collections import deque
+import argparse
+import datetime
+import json
+import os
+import re
+import shutil
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from scraper import Scraper
+from remotedatasource import create_session, connection_stats
+from changefeed import write_change_feed
+import logging
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONTROL_ADDRESS = ("127.0.0.1", 8700)
+
+class ScrapeDaemon:
+    """
+    Long running scraper: recrawls a catalog on a schedule, and takes orders from a local control endpoint.
+
+    Two kinds of runs, each to its own directory in the base directory (ex. full_2024-05-03_02-00-00):
+     - full: crawls the entire catalog (or category), every night at full_at (local time)
+     - check: incremental recrawl from the latest run (see Scraper's delta_from): reads the category listings,
+       only scrapes the books that are new or whose price or availability changed, copies the others.
+       Runs every check_interval minutes.
+    A change feed from the previous run is written to each run directory (see changefeed.py).
+
+    Unlike separate invocations of scrapebooks.py, the daemon keeps a single HTTP session (and its connection pool)
+    warm across runs, and keeps the schedule, the latest run and the runs history in memory.
+    Each run directory is a complete snapshot of the catalog: a check run hard links the images of the unchanged books
+    from the previous run (see Scraper's delta_from) instead of copying them, so the snapshots share their unchanged files.
+    keep_runs bounds the disk usage: only the latest run directories are kept, the older ones are removed.
+    The crawl state is not kept in memory: each run gets a new Scraper, with its own url state store, seen urls
+    and category indexes, and a check run reads the url states, listing hashes and output files of the previous run
+    from its directory.
+    The latest run and history are also saved to daemon_state.json in the base directory, so that a restarted daemon
+    goes on from the latest run, and first resumes a run left interrupted (see Scraper.resume()).
+
+    The control endpoint is a small HTTP server, bound to localhost by default:
+     - GET /status: state, current run, latest runs, next scheduled runs
+     - POST /run/full, POST /run/check: queue a run
+     - POST /stop: stop once the current run is done
+
+    Usage:
+    ```
+     daemon = ScrapeDaemon('https://books.toscrape.com/', 'data/daemon', {'scraping_generator': BooksToScrapeGenerator()})
+     daemon.run_forever()
+    ```
+    """
+    FULL = "full"
+    CHECK = "check"
+    RUN_KINDS = [FULL, CHECK]
+
+    STATE_FILENAME = "daemon_state.json"
+    METRICS_BASENAME = "scrape_metrics.json"
+
+    # runs kept in the history
+    HISTORY_SIZE = 50
+    # run directories, named after their kind and start time (UTC)
+    RUN_DIR_PATTERN = re.compile(r'^(full|check)_(\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2})$')
+
+    def __init__(
+            self,
+            scrape_url: str,
+            base_dir: str,
+            scraper_options: dict,
+            scrape_type: str = Scraper.SCRAPE_ALL,
+            full_at: str = "02:00",
+            check_interval: float = 60.0,
+            control_address: tuple[str, int] = DEFAULT_CONTROL_ADDRESS,
+            changes_fields: list[str] = None,
+            keep_runs: int = None):
+        """
+        scraper_options -- options of the Scraper of each run (see Scraper.__init__()), except output_dir and delta_from
+        scrape_type -- Scraper.SCRAPE_ALL (scrape_url is the catalog home page) or Scraper.SCRAPE_CATEGORY
+        full_at -- time of the nightly full crawl, "HH:MM" (local time). None disables the nightly crawl.
+        check_interval -- minutes between 2 listing checks. 0 disables the listing checks.
+        control_address -- (host, port) of the control endpoint. None disables the endpoint.
+        changes_fields -- fields compared in the change feeds (see changefeed.py)
+        keep_runs -- number of run directories kept in the base directory, the older ones are removed after each run
+        (the latest successful run, the base of the next check, is always kept). None keeps all the runs.
+        """
+        if scrape_type not in (Scraper.SCRAPE_ALL, Scraper.SCRAPE_CATEGORY):
+            raise ValueError(f"Unsupported scrape type in daemon mode: {scrape_type}")
+        if keep_runs is not None and keep_runs < 1:
+            raise ValueError("The daemon should keep at least 1 run directory")
+        self.scrape_url = scrape_url
+        self.scrape_type = scrape_type
+        self.base_dir = base_dir
+        self.full_at: tuple[int, int] = self.parse_time_of_day(full_at) if full_at else None
+        self.check_interval: float = check_interval
+        self.control_address = control_address
+        self.changes_fields = changes_fields
+        self.keep_runs = keep_runs
+        # a single session for all the runs and threads, with a connection pool for all the workers
+        pool_size = max(1, scraper_options.get('workers', 1)) + max(1, scraper_options.get('image_workers', 2))
+        if scraper_options.get('hedge_percentile') is not None:
+            pool_size *= 2
+        self.session = create_session(pool_size= scraper_options.get('pool_size') or pool_size, keep_alive= scraper_options.get('keep_alive', True))
+        self.scraper_options = dict(scraper_options, session= self.session)
+        self._lock = threading.Condition()
+        self._queue: deque[str] = deque()
+        self._stopping = False
+        self._current: dict = None
+        self._started_at = time.time()
+        self._httpd: ThreadingHTTPServer = None
+        state = self._load_state()
+        self._latest_dir: str = state.get('latest_dir')
+        self._history: deque[dict] = deque(state.get('history', []), maxlen= self.HISTORY_SIZE)
+        # an interrupted run, resumed first
+        self._interrupted: dict = state.get('current')
+        self._last_run_end: float = self._history[-1]['ended_at'] if self._history else 0.0
+        self._next_full: float = self._next_full_time(time.time())
+        self._next_check: float = (self._last_run_end or time.time()) + self.check_interval * 60 if self.check_interval > 0 else None
+
+    @staticmethod
+    def parse_time_of_day(time_of_day: str) -> tuple[int, int]:
+        """
+        Parses "HH:MM", raises a ValueError if invalid.
+        """
+        parsed = datetime.datetime.strptime(time_of_day, "%H:%M")
+        return (parsed.hour, parsed.minute)
+
+    def trigger(self, kind: str) -> bool:
+        """
+        Queues a run (see RUN_KINDS). Returns False if a run of this kind is already queued.
+        """
+        if kind not in self.RUN_KINDS:
+            raise ValueError(f"Unknown run kind: {kind}")
+        with self._lock:
+            if kind in self._queue:
+                return False
+            self._queue.append(kind)
+            self._lock.notify_all()
+        return True
+
+    def stop(self):
+        """
+        Stops the daemon once the current run is done.
+        """
+        with self._lock:
+            self._stopping = True
+            self._lock.notify_all()
+
+    def status(self) -> dict:
+        with self._lock:
+            return {
+                'scrape_url': self.scrape_url,
+                'base_dir': self.base_dir,
+                'state': "stopping" if self._stopping else ("running" if self._current else "idle"),
+                'uptime_seconds': round(time.time() - self._started_at, 1),
+                'current': dict(self._current) if self._current else None,
+                'queued': list(self._queue),
+                'latest_dir': self._latest_dir,
+                'next_full': self._format_time(self._next_full),
+                'next_check': self._format_time(self._next_check),
+                'history': list(self._history)[-10:],
+                # requests and connections since the start: a warm session re-uses its connections across runs
+                'connections': connection_stats(self.session)
+            }
+
+    def run_forever(self):
+        """
+        Runs the scheduled and triggered runs until stopped (see stop(), or POST /stop).
+        The runs execute in the calling thread: a KeyboardInterrupt interrupts the current run, which is resumed
+        from its checkpoint when the daemon is started again.
+        """
+        if self.control_address:
+            self._httpd = ThreadingHTTPServer(self.control_address, self._make_handler())
+            self._httpd.daemon_threads = True
+            threading.Thread(target= self._httpd.serve_forever, name= "daemon-control", daemon= True).start()
+            logger.info(f"Control endpoint listening on http://{self.control_address[0]}:{self._httpd.server_address[1]}/")
+        if self._latest_dir is None and not self._interrupted:
+            # first start: crawl right away
+            self.trigger(self.FULL)
+        try:
+            if self._interrupted:
+                self.run_once(self._interrupted['kind'], resume_dir= self._interrupted['output_dir'])
+            while (kind := self._next_run()) is not None:
+                self.run_once(kind)
+        finally:
+            if self._httpd is not None:
+                self._httpd.shutdown()
+                self._httpd.server_close()
+            self.session.close()
+
+    def run_once(self, kind: str, resume_dir: str = None) -> dict:
+        """
+        Runs a full crawl or a listing check right away, in the calling thread. Returns the run summary, added to the history.
+        resume_dir -- resume an interrupted run from the checkpoint found in its directory
+        """
+        output_dir = resume_dir or os.path.join(self.base_dir, f"{kind}_{datetime.datetime.now(datetime.timezone.utc).strftime('%Y-%m-%d_%H-%M-%S')}")
+        previous_dir = self._latest_dir if self._latest_dir and os.path.isdir(self._latest_dir) else None
+        if resume_dir and self._interrupted:
+            delta_from = self._interrupted.get('delta_from')
+        else:
+            # a check without a previous run is a full crawl
+            delta_from = previous_dir if kind == self.CHECK else None
+        run = {'kind': kind, 'output_dir': output_dir, 'delta_from': delta_from, 'started_at': time.time()}
+        with self._lock:
+            self._current = run
+        self._save_state()
+        os.makedirs(output_dir, mode= 0o777, exist_ok= True)
+        logger.info(f"Start {kind} run to {output_dir}" + (f" (from {run['delta_from']})" if run['delta_from'] else ""))
+        # a new scraper per run: the url states and listing hashes of the previous run are read from its directory
+        scraper = Scraper(output_dir= output_dir, delta_from= run['delta_from'], **self.scraper_options)
+        try:
+            success = scraper.resume() if resume_dir else None
+            if success is None and self.scrape_type == Scraper.SCRAPE_ALL:
+                success = scraper.scrape_all_categories(self.scrape_url)
+            elif success is None:
+                success = scraper.scrape_category(self.scrape_url)
+        except Exception as e:
+            e_type = type(e).__name__
+            logger.error(f"The {kind} run to {output_dir} failed ({e_type}: {e})", exc_info= True)
+            success = False
+        finally:
+            scraper.close()
+        scraper.metrics.write_json(os.path.join(output_dir, self.METRICS_BASENAME))
+        run['ended_at'] = time.time()
+        run['duration_seconds'] = round(run['ended_at'] - run['started_at'], 3)
+        run['success'] = bool(success)
+        run['counters'] = scraper.metrics.report()['counters']
+        if previous_dir and previous_dir != output_dir:
+            try:
+                run['changes'] = write_change_feed(previous_dir, output_dir, fields= self.changes_fields, compression= self.scraper_options.get('compression'))
+            except Exception as e:
+                logger.warning(f"Could not write the change feed of {output_dir} ({type(e).__name__}: {e})")
+        with self._lock:
+            self._current = None
+            self._interrupted = None
+            self._history.append(run)
+            if run['success'] or self._latest_dir is None:
+                self._latest_dir = output_dir
+            self._last_run_end = run['ended_at']
+            if self.check_interval > 0:
+                self._next_check = self._last_run_end + self.check_interval * 60
+        self._save_state()
+        logger.info(f"The {kind} run to {output_dir} {'succeeded' if run['success'] else 'ended with errors'} in {run['duration_seconds']:.1f}s")
+        self._prune_runs()
+        return run
+
+    def _prune_runs(self):
+        """
+        Removes the oldest run directories: keeps the keep_runs latest ones, and the latest successful run.
+        The files hard linked from a removed run stay in the runs that share them.
+        """
+        if not self.keep_runs or not os.path.isdir(self.base_dir):
+            return
+        # latest runs first
+        run_dirs = sorted(
+            (name for name in os.listdir(self.base_dir) if self.RUN_DIR_PATTERN.match(name) and os.path.isdir(os.path.join(self.base_dir, name))),
+            key= lambda name: self.RUN_DIR_PATTERN.match(name).group(2),
+            reverse= True)
+        with self._lock:
+            kept = {os.path.abspath(self._latest_dir)} if self._latest_dir else set()
+        for name in run_dirs[self.keep_runs:]:
+            run_dir = os.path.join(self.base_dir, name)
+            if os.path.abspath(run_dir) in kept:
+                continue
+            logger.info(f"Remove old run directory {run_dir}")
+            shutil.rmtree(run_dir, ignore_errors= True)
+
+    def _next_run(self) -> str:
+        """
+        Waits for the next run: a triggered run, or the next scheduled run (the full crawl first).
+        Returns its kind, or None once stopped.
+        """
+        with self._lock:
+            while not self._stopping:
+                if self._queue:
+                    return self._queue.popleft()
+                now = time.time()
+                if self._next_full is not None and now >= self._next_full:
+                    self._next_full = self._next_full_time(now)
+                    return self.FULL
+                if self._next_check is not None and now >= self._next_check:
+                    return self.CHECK
+                due = [t for t in (self._next_full, self._next_check) if t is not None]
+                self._lock.wait(timeout= min(due) - now if due else None)
+        return None
+
+    def _next_full_time(self, now: float) -> float:
+        if self.full_at is None:
+            return None
+        next_time = datetime.datetime.fromtimestamp(now).replace(hour= self.full_at[0], minute= self.full_at[1], second= 0, microsecond= 0)
+        if next_time.timestamp() <= now:
+            next_time += datetime.timedelta(days= 1)
+        return next_time.timestamp()
+
+    @staticmethod
+    def _format_time(timestamp: float) -> str:
+        return datetime.datetime.fromtimestamp(timestamp).astimezone().isoformat(timespec= "seconds") if timestamp else None
+
+    def _load_state(self) -> dict:
+        state_file = os.path.join(self.base_dir, self.STATE_FILENAME)
+        if not os.path.isfile(state_file):
+            return {}
+        with open(state_file, encoding= "utf-8") as f:
+            return json.load(f)
+
+    def _save_state(self):
+        with self._lock:
+            state = {'latest_dir': self._latest_dir, 'current': self._current, 'history': list(self._history)}
+        os.makedirs(self.base_dir, mode= 0o777, exist_ok= True)
+        state_file = os.path.join(self.base_dir, self.STATE_FILENAME)
+        with open(state_file + ".tmp", "w", encoding= "utf-8") as f:
+            json.dump(state, f, indent= 2)
+        os.replace(state_file + ".tmp", state_file)
+
+    def _make_handler(self) -> type[BaseHTTPRequestHandler]:
+        daemon = self
+
+        class ControlHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.rstrip('/') == "/status":
+                    self._reply(200, daemon.status())
+                else:
+                    self._reply(404, {'error': f"Not found: {self.path}"})
+
+            def do_POST(self):
+                path = self.path.rstrip('/')
+                if path == "/stop":
+                    daemon.stop()
+                    self._reply(202, {'stopping': True})
+                elif path.startswith("/run/") and (kind := path[len("/run/"):]) in ScrapeDaemon.RUN_KINDS:
+                    self._reply(202, {'queued': daemon.trigger(kind), 'kind': kind})
+                else:
+                    self._reply(404, {'error': f"Not found: {self.path}"})
+
+            def _reply(self, status: int, content: dict):
+                body = json.dumps(content, indent= 2).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logger.debug("control: " + format % args)
+
+        return ControlHandler
+
+
+def control_request(command: str, address: tuple[str, int] = DEFAULT_CONTROL_ADDRESS, timeout: float = 5.0) -> dict:
+    """
+    Sends a command to a running daemon: "status", "full", "check" or "stop". Returns the daemon's answer.
+    """
+    url = f"http://{address[0]}:{address[1]}/"
+    if command == "status":
+        request = urllib.request.Request(url + "status")
+    elif command == "stop":
+        request = urllib.request.Request(url + "stop", method= "POST")
+    else:
+        request = urllib.request.Request(url + "run/" + urllib.parse.quote(command), method= "POST")
+    with urllib.request.urlopen(request, timeout= timeout) as response:
+        return json.load(response)
+
+def parse_address(address: str) -> tuple[str, int]:
+    """
+    Parses "host:port" (or just "port", on localhost).
+    """
+    host, _, port = address.rpartition(':')
+    return (host or DEFAULT_CONTROL_ADDRESS[0], int(port))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog="daemon",
+        description="Control a scraper daemon started with scrapebooks.py --daemon:\nquery its status, queue a full crawl or a listing check, or stop it.",
+        formatter_class=argparse.RawTextHelpFormatter
+    )
+    parser.add_argument("command", choices= ["status", "full", "check", "stop"], help="status, full (queue a full crawl), check (queue a listing check) or stop")
+    parser.add_argument("--control", default= "{0}:{1}".format(*DEFAULT_CONTROL_ADDRESS), help="address of the daemon's control endpoint (defaults to {0}:{1})".format(*DEFAULT_CONTROL_ADDRESS))
+    args = parser.parse_args()
+    try:
+        print(json.dumps(control_request(args.command, parse_address(args.control)), indent= 2))
+    except (urllib.error.URLError, ConnectionError) as e:
+        print(f"Could not reach the daemon at {args.control}: {e}", file= sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,132 @@
+"""
+openclassrooms Python - Project 2
+bookscraper package
+@author Christian Debray - christian.debray@gmail.com
+"""
+from collections.abc import Callable
+import json
+import threading
+import time
+import logging
+logger = logging.getLogger(__name__)
+
+class EventBus:
+    """
+    Publishes the scraping events to any number of subscribers.
+
+    Events are dictionaries with a 'type', a 'time' (timestamp) and fields depending on the type:
+     - request_start: url
+     - request_end: url, status (HTTP status code, None on connection errors), bytes, elapsed (seconds),
+       cache_hit, retry (number of previous failed attempts for the same url), error (if the request failed)
+     - scrape: url, scrape_type (see the Scraper.SCRAPE_* constants), sent when the scraper handles a url
+     - parse_done: url, valid, elapsed
+     - record_written: url, output_file, universal_product_code
+     - error: url, context, error_type, message
+
+    Subscribers are called synchronously, from the thread that emitted the event.
+    A subscriber raising an exception is logged and does not interrupt the scraping.
+
+    Usage:
+    ```
+     events = EventBus()
+     events.subscribe(lambda event: print(event['url'], event['elapsed']), [EventBus.REQUEST_END])
+     events.emit(EventBus.REQUEST_END, url= url, elapsed= 0.12)
+    ```
+    """
+    REQUEST_START = "request_start"
+    REQUEST_END = "request_end"
+    SCRAPE = "scrape"
+    PARSE_DONE = "parse_done"
+    RECORD_WRITTEN = "record_written"
+    ERROR = "error"
+
+    EVENT_TYPES = [REQUEST_START, REQUEST_END, SCRAPE, PARSE_DONE, RECORD_WRITTEN, ERROR]
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (subscriber, event types) pairs, replaced on each change so that emit() can iterate without locking
+        self._subscribers: tuple[tuple[Callable[[dict], None], frozenset], ...] = ()
+
+    def subscribe(self, subscriber: Callable[[dict], None], event_types: list[str] = None) -> Callable[[dict], None]:
+        """
+        Calls subscriber(event) on each event of the given types (all events if None).
+        Returns the subscriber, see unsubscribe().
+        """
+        with self._lock:
+            self._subscribers += ((subscriber, frozenset(event_types or self.EVENT_TYPES)),)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Callable[[dict], None]):
+        with self._lock:
+            self._subscribers = tuple(s for s in self._subscribers if s[0] is not subscriber)
+
+    def has_subscribers(self, event_type: str) -> bool:
+        """
+        Returns True if an event type has subscribers. Lets the caller skip building events nobody listens to.
+        """
+        return any(event_type in event_types for _, event_types in self._subscribers)
+
+    def emit(self, event_type: str, **fields):
+        """
+        Sends an event to the subscribers of its type.
+        """
+        subscribers = [s for s, event_types in self._subscribers if event_type in event_types]
+        if not subscribers:
+            return
+        event = {'type': event_type, 'time': time.time(), **fields}
+        for subscriber in subscribers:
+            try:
+                subscriber(event)
+            except Exception as e:
+                e_type = type(e).__name__
+                logger.warning(f"An error ({e_type}) occured in a subscriber to {event_type} events", exc_info= True)
+
+
+class JsonLinesEventLog:
+    """
+    Event subscriber writing the events to a JSON Lines file, one event per line.
+    """
+    def __init__(self, filename: str):
+        self.filename = filename
+        self._lock = threading.Lock()
+        self._stream = open(filename, "a", encoding= "utf-8")
+
+    def __call__(self, event: dict):
+        line = json.dumps(event, ensure_ascii= False, default= str) + "\n"
+        with self._lock:
+            if self._stream is not None:
+                self._stream.write(line)
+                self._stream.flush()
+
+    def close(self):
+        with self._lock:
+            if self._stream is not None:
+                self._stream.close()
+                self._stream = None
+
+if __name__ == "__main__":
+    import os
+    import tempfile
+    events = EventBus()
+    received = []
+    events.subscribe(received.append)
+    ends = events.subscribe(lambda event: received.append("end"), [EventBus.REQUEST_END])
+    def broken(event):
+        raise ValueError("broken subscriber")
+    events.subscribe(broken, [EventBus.ERROR])
+    assert events.has_subscribers(EventBus.REQUEST_END)
+    events.emit(EventBus.REQUEST_START, url= "https://example.com")
+    events.emit(EventBus.REQUEST_END, url= "https://example.com", status= 200, elapsed= 0.1)
+    events.emit(EventBus.ERROR, url= "https://example.com", message= "oops")
+    assert [e if isinstance(e, str) else e['type'] for e in received] == ["request_start", "request_end", "end", "error"], received
+    events.unsubscribe(ends)
+    events.emit(EventBus.REQUEST_END, url= "https://example.com")
+    assert received[-1] != "end"
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        log = JsonLinesEventLog(os.path.join(tmp_dir, "events.jsonl"))
+        events.subscribe(log)
+        events.emit(EventBus.RECORD_WRITTEN, url= "https://example.com", output_file= "books.csv")
+        log.close()
+        with open(log.filename) as f:
+            assert json.loads(f.readline())['output_file'] == "books.csv"
+    print("Test completed")
@@ -0,0 +1,190 @@
+"""
+openclassrooms Python - Project 2
+bookscraper package
+@author Christian Debray - christian.debray@gmail.com
+"""
+from collections import OrderedDict
+import heapq
+import itertools
+import threading
+import logging
+logger = logging.getLogger(__name__)
+
+class CrawlFrontier:
+    """
+    Thread safe scheduler of the urls to crawl, shared by the scraper's workers.
+
+    Urls are scheduled by priority class:
+     - index pages come first, so that the frontier grows as fast as possible,
+     - then product pages, the stalest first (never scraped, then least recently scraped).
+    (images are downloaded apart from the page crawl, see imagepipeline.py)
+
+    Within a priority class, the categories are served in turns (round robin),
+    so that the end of the crawl is not a single long category.
+
+    Tasks are dictionaries: {'class': ..., 'url': ..., 'category': ..., 'staleness': ..., 'payload': {...}}.
+    Workers pop() tasks from a lane (a group of priority classes) and call task_done() once a task is handled,
+    pop() returns None once the lane is drained: no task is pending, and no task being handled may add new ones.
+
+    Usage (in each worker thread):
+    ```
+     while (task := frontier.pop(CrawlFrontier.PAGES)) is not None:
+        try:
+            # handle the task, possibly frontier.push() new tasks...
+        finally:
+            frontier.task_done(task)
+    ```
+    """
+    INDEX = 0
+    PRODUCT = 1
+
+    # lanes: priority classes served to a group of workers
+    PAGES = (INDEX, PRODUCT)
+
+    CLASS_NAMES = {INDEX: "index", PRODUCT: "product"}
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        # priority class -> category -> heap of (staleness, sequence number, task)
+        self._queues: dict[int, OrderedDict[str, list]] = {c: OrderedDict() for c in self.CLASS_NAMES}
+        self._in_flight: dict[int, dict[int, dict]] = {c: {} for c in self.CLASS_NAMES}
+        self._pending_count: dict[int, int] = {c: 0 for c in self.CLASS_NAMES}
+        self._sequence = itertools.count()
+        self._closed = False
+
+    def push(self, priority_class: int, url: str, category: str = '', staleness: float = 0.0, payload: dict = None):
+        """
+        Schedules a url. Within a category, lower staleness values (ex. the timestamp of the last scraping) are served first,
+        tasks with the same staleness are served in order.
+        """
+        task = {'class': priority_class, 'url': url, 'category': category, 'staleness': staleness, 'payload': payload or {}}
+        with self._cond:
+            heapq.heappush(self._queues[priority_class].setdefault(category, []), (staleness, next(self._sequence), task))
+            self._pending_count[priority_class] += 1
+            self._cond.notify_all()
+
+    def pop(self, lane: tuple[int] = PAGES, timeout: float = None) -> dict | None:
+        """
+        Returns the next task of a lane, waits until one is available.
+        Returns None once the lane is drained or the frontier closed (or when the timeout expires).
+        """
+        with self._cond:
+            while True:
+                if self._closed:
+                    return None
+                for priority_class in lane:
+                    if self._pending_count[priority_class]:
+                        return self._pop_class(priority_class)
+                if self._is_drained(lane):
+                    # wake up the other workers of the lane
+                    self._cond.notify_all()
+                    return None
+                if not self._cond.wait(timeout):
+                    return None
+
+    def task_done(self, task: dict):
+        """
+        Marks a task returned by pop() as handled.
+        """
+        with self._cond:
+            self._in_flight[task['class']].pop(id(task), None)
+            self._cond.notify_all()
+
+    def close(self):
+        """
+        Stops serving tasks: pop() returns None from now on. The pending tasks are kept (see snapshot()).
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def snapshot(self) -> list[dict]:
+        """
+        Lists the tasks not handled yet, including the tasks being handled, in scheduling order by class.
+        Used to save the frontier to a checkpoint: the tasks can be pushed again to a new frontier.
+        """
+        with self._cond:
+            tasks = []
+            for priority_class in self.CLASS_NAMES:
+                tasks.extend(self._in_flight[priority_class].values())
+                for heap in self._queues[priority_class].values():
+                    tasks.extend(task for _, _, task in sorted(heap))
+            return [dict(task) for task in tasks]
+
+    def counts(self) -> dict[str, int]:
+        """
+        Returns the number of pending tasks by class name.
+        """
+        with self._cond:
+            return {name: self._pending_count[c] for c, name in self.CLASS_NAMES.items()}
+
+    def __len__(self):
+        with self._cond:
+            return sum(self._pending_count.values()) + sum(len(tasks) for tasks in self._in_flight.values())
+
+    def _pop_class(self, priority_class: int) -> dict:
+        """
+        Pops a task of the first category in turn, then sends this category to the back of the line.
+        """
+        queues = self._queues[priority_class]
+        category, heap = next(iter(queues.items()))
+        _, _, task = heapq.heappop(heap)
+        if heap:
+            queues.move_to_end(category)
+        else:
+            del queues[category]
+        self._pending_count[priority_class] -= 1
+        self._in_flight[priority_class][id(task)] = task
+        return task
+
+    def _is_drained(self, lane: tuple[int]) -> bool:
+        """
+        A lane is drained when no task of its classes or of a higher priority class is pending or being handled:
+        index pages add index and product pages.
+        """
+        last_class = max(lane)
+        return all(
+            self._pending_count[c] == 0 and not self._in_flight[c]
+            for c in self.CLASS_NAMES if c <= last_class)
+
+if __name__ == "__main__":
+    frontier = CrawlFrontier()
+    frontier.push(CrawlFrontier.PRODUCT, "a1", "a", staleness= 2.0)
+    frontier.push(CrawlFrontier.PRODUCT, "a2", "a", staleness= 0.0)
+    frontier.push(CrawlFrontier.PRODUCT, "a3", "a", staleness= 1.0)
+    frontier.push(CrawlFrontier.PRODUCT, "b1", "b")
+    frontier.push(CrawlFrontier.INDEX, "b-index", "b")
+    order = []
+    while (task := frontier.pop(CrawlFrontier.PAGES)) is not None:
+        order.append(task['url'])
+        if task['url'] == "a3":
+            assert [t['url'] for t in frontier.snapshot()] == ["a3", "a1"]
+        frontier.task_done(task)
+    # index first, then products alternating categories, stalest first
+    assert order == ["b-index", "a2", "b1", "a3", "a1"], order
+    assert len(frontier) == 0
+
+    # workers: index pages add more index pages and products
+    frontier = CrawlFrontier()
+    handled = []
+    lock = threading.Lock()
+    def page_worker():
+        while (task := frontier.pop(CrawlFrontier.PAGES)) is not None:
+            if task['class'] == CrawlFrontier.INDEX and task['payload']['page'] < 5:
+                page = task['payload']['page']
+                frontier.push(CrawlFrontier.INDEX, f"{task['category']}-index-{page + 1}", task['category'], payload= {'page': page + 1})
+                for i in range(10):
+                    frontier.push(CrawlFrontier.PRODUCT, f"{task['category']}-{page}-{i}", task['category'])
+            with lock:
+                handled.append(task['url'])
+            frontier.task_done(task)
+    for category in "abc":
+        frontier.push(CrawlFrontier.INDEX, f"{category}-index-1", category, payload= {'page': 1})
+    threads = [threading.Thread(target= page_worker) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    # 3 categories x (5 index pages + 4 x 10 products)
+    assert len(handled) == 3 * (5 + 40) == len(set(handled)), len(handled)
+    print("Test completed")
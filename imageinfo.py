@@ -0,0 +1,113 @@
+"""
+openclassrooms Python - Project 2
+bookscraper package
+@author Christian Debray - christian.debray@gmail.com
+"""
+from typing import BinaryIO
+import struct
+
+# extension (as written by the scraper) -> image format
+IMAGE_FORMATS = {'jpeg': "jpeg", 'jpg': "jpeg", 'png': "png", 'gif': "gif"}
+
+# JPEG start of frame markers (baseline, progressive...), holding the image dimensions. 0xC4 (DHT), 0xC8 and 0xCC are not frames.
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+def read_image_info(path: str) -> dict:
+    """
+    Reads the format and dimensions of a JPEG, PNG or GIF image from its header, without decoding the image:
+    only the first bytes are read (JPEG segments before the frame header are skipped, not read).
+    Returns {'format': ..., 'width': ..., 'height': ...}.
+    Raises a ValueError if the file is not a supported image or if its header is truncated or corrupt.
+    """
+    with open(path, "rb") as f:
+        head = f.read(26)
+        if head.startswith(b"\x89PNG\r\n\x1a\n"):
+            # the IHDR chunk comes first
+            if len(head) < 24 or head[12:16] != b"IHDR":
+                raise ValueError("Truncated or corrupt PNG header")
+            width, height = struct.unpack(">II", head[16:24])
+            return _image_info("png", width, height)
+        if head[:6] in (b"GIF87a", b"GIF89a"):
+            if len(head) < 10:
+                raise ValueError("Truncated GIF header")
+            width, height = struct.unpack("<HH", head[6:10])
+            return _image_info("gif", width, height)
+        if head.startswith(b"\xff\xd8"):
+            f.seek(2)
+            return _read_jpeg_frame(f)
+    raise ValueError("Unknown image format (bad magic bytes)")
+
+def _read_jpeg_frame(f: BinaryIO) -> dict:
+    """
+    Walks the JPEG segments up to the start of frame.
+    """
+    while True:
+        marker = f.read(2)
+        if len(marker) < 2:
+            raise ValueError("Truncated JPEG: no frame header found")
+        if marker[0] != 0xFF:
+            raise ValueError("Corrupt JPEG: bad segment marker")
+        marker_type = marker[1]
+        # padding bytes before a marker
+        while marker_type == 0xFF:
+            if not (next_byte := f.read(1)):
+                raise ValueError("Truncated JPEG: no frame header found")
+            marker_type = next_byte[0]
+        if marker_type == 0xD9 or marker_type == 0xDA:
+            raise ValueError("Corrupt JPEG: no frame header before the image data")
+        if 0xD0 <= marker_type <= 0xD7 or marker_type == 0x01:
+            # markers without payload
+            continue
+        length_bytes = f.read(2)
+        if len(length_bytes) < 2:
+            raise ValueError("Truncated JPEG segment")
+        length = struct.unpack(">H", length_bytes)[0]
+        if length < 2:
+            raise ValueError("Corrupt JPEG: bad segment length")
+        if marker_type in JPEG_SOF_MARKERS:
+            frame = f.read(5)
+            if len(frame) < 5:
+                raise ValueError("Truncated JPEG frame header")
+            # sample precision, then height and width
+            height, width = struct.unpack(">HH", frame[1:5])
+            return _image_info("jpeg", width, height)
+        f.seek(length - 2, 1)
+
+def _image_info(image_format: str, width: int, height: int) -> dict:
+    if width == 0 or height == 0:
+        raise ValueError(f"Invalid {image_format.upper()} dimensions {width}x{height}")
+    return {'format': image_format, 'width': width, 'height': height}
+
+if __name__ == "__main__":
+    import os
+    import tempfile
+    import zlib
+    samples = {
+        # SOI, APP0 segment, SOF0 (height 300, width 200), EOI
+        'ok.jpeg': b"\xff\xd8\xff\xe0\x00\x10JFIF\x00\x01\x01\x00\x00\x01\x00\x01\x00\x00"
+                   b"\xff\xc0\x00\x11\x08\x01\x2c\x00\xc8\x03\x01\x22\x00\x02\x11\x01\x03\x11\x01\xff\xd9",
+        'ok.png': b"\x89PNG\r\n\x1a\n" + struct.pack(">I", 13) + b"IHDR" + struct.pack(">IIBBBBB", 64, 32, 8, 2, 0, 0, 0)
+                  + struct.pack(">I", zlib.crc32(b"IHDR")),
+        'ok.gif': b"GIF89a" + struct.pack("<HH", 10, 20) + b"\x00\x00\x00",
+        'truncated.jpeg': b"\xff\xd8\xff\xe0\x00\x10JFIF",
+        'html.jpeg': b"<html><body>Not found</body></html>",
+        'zero.gif': b"GIF89a\x00\x00\x10\x00\x00\x00\x00",
+    }
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        results = {}
+        for name, data in samples.items():
+            path = os.path.join(tmp_dir, name)
+            with open(path, "wb") as f:
+                f.write(data)
+            try:
+                results[name] = read_image_info(path)
+            except ValueError as e:
+                results[name] = str(e)
+        print(results)
+        assert results['ok.jpeg'] == {'format': "jpeg", 'width': 200, 'height': 300}
+        assert results['ok.png'] == {'format': "png", 'width': 64, 'height': 32}
+        assert results['ok.gif'] == {'format': "gif", 'width': 10, 'height': 20}
+        assert results['truncated.jpeg'].startswith("Truncated")
+        assert results['html.jpeg'].startswith("Unknown image format")
+        assert results['zero.gif'].startswith("Invalid")
+    print("Test completed")
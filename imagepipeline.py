@@ -0,0 +1,181 @@
+"""
+openclassrooms Python - Project 2
+bookscraper package
+@author Christian Debray - christian.debray@gmail.com
+"""
+from workqueue import SqliteWorkQueue, default_worker_id
+from collections.abc import Callable
+import threading
+import logging
+logger = logging.getLogger(__name__)
+
+# how the scraper downloads the book images (see Scraper and scrapebooks.py --images)
+IMAGES_INLINE = "inline"
+IMAGES_BACKGROUND = "background"
+IMAGES_DEFER = "defer"
+IMAGES_SKIP = "skip"
+IMAGE_MODES = [IMAGES_INLINE, IMAGES_BACKGROUND, IMAGES_DEFER, IMAGES_SKIP]
+
+class ImagePipeline:
+    """
+    Downloads the book images in the background, apart from the page crawl.
+
+    The images to download are kept in a persistent queue (see SqliteWorkQueue), stored in the output directory:
+    images left over by an interrupted run, or deferred, are downloaded by the next pipeline started on the same queue.
+    The pipeline runs its own download threads, so that the page crawl never waits for an image.
+
+    Usage:
+    ```
+     pipeline = ImagePipeline('path/to/.pending_images.sqlite', download= fetch_image_function, workers= 2)
+     pipeline.start()
+     pipeline.add(image_url, universal_product_code, image_dir)
+     (...)
+     pipeline.join()  # wait for the pending images
+     pipeline.close()
+    ```
+    """
+    DEFAULT_FILENAME = ".pending_images.sqlite"
+    TASK_IMAGE = "image"
+
+    def __init__(self, queue_path: str, download: Callable[[str, str, str], str], workers: int = 2, max_attempts: int = 3, poll_interval: float = 0.2):
+        """
+        queue_path -- path to the persistent queue of pending images, created if needed
+        download -- downloads an image: download(image_url, universal_product_code, image_dir)
+        workers -- number of download threads
+        max_attempts -- give up an image after max_attempts failed downloads (see retry_failed())
+        """
+        self.queue = SqliteWorkQueue(queue_path, lease_timeout= 60.0, max_attempts= max_attempts)
+        self._download = download
+        self._workers_count = max(1, workers)
+        self._poll_interval = poll_interval
+        self._threads: list[threading.Thread] = []
+        self._new_image = threading.Event()
+        self._stopping = threading.Event()
+        # set once no image will be added anymore: the threads stop when the queue is finished
+        self._draining = threading.Event()
+        self.downloaded = 0
+        self.failed = 0
+        self._lock = threading.Lock()
+
+    def add(self, image_url: str, universal_product_code: str, image_dir: str) -> bool:
+        """
+        Adds an image to the pending images. Returns False if the image was already queued (or downloaded).
+        """
+        added = self.queue.put(self.TASK_IMAGE, image_url, {'universal_product_code': universal_product_code, 'image_dir': image_dir})
+        self._new_image.set()
+        return added
+
+    def start(self):
+        """
+        Starts the download threads. They download the pending images, including the ones left by a previous run.
+        """
+        if self._threads:
+            return
+        self._stopping.clear()
+        self._draining.clear()
+        for n in range(self._workers_count):
+            thread = threading.Thread(target= self._run, name= f"image-{n}", args= (f"{default_worker_id()}-image-{n}",), daemon= True)
+            thread.start()
+            self._threads.append(thread)
+
+    def join(self):
+        """
+        Waits for all pending images to be downloaded (or given up), then stops the download threads.
+        """
+        self._draining.set()
+        self._new_image.set()
+        self._join_threads()
+
+    def stop(self):
+        """
+        Stops the download threads once their current download is done. The pending images stay in the queue.
+        """
+        self._stopping.set()
+        self._new_image.set()
+        self._join_threads()
+
+    def pending_count(self) -> int:
+        """
+        Returns the number of images not downloaded yet.
+        """
+        counts = self.queue.counts()
+        return counts[SqliteWorkQueue.PENDING] + counts[SqliteWorkQueue.LEASED]
+
+    def retry_failed(self) -> int:
+        """
+        Gives another chance to the images given up after max_attempts failed downloads.
+        Returns the number of images to retry.
+        """
+        return self.queue.retry_failed()
+
+    def close(self):
+        self.stop()
+        self.queue.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _join_threads(self):
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def _run(self, worker_id: str):
+        """
+        Download thread: leases the pending images until stopped, or until the queue is drained.
+        """
+        while not self._stopping.is_set():
+            task = self.queue.lease(worker_id)
+            if task is None:
+                if self._draining.is_set() and self.queue.is_finished():
+                    return
+                self._new_image.wait(self._poll_interval)
+                self._new_image.clear()
+                continue
+            payload = task['payload']
+            try:
+                self._download(task['url'], payload.get('universal_product_code', ''), payload.get('image_dir', ''))
+            except Exception as e:
+                e_type = type(e).__name__
+                logger.warning(f"An error ({e_type}) occured while downloading image from URL {task['url']}", exc_info= True)
+                self.queue.fail(task['id'], worker_id, f"{e_type}: {e}")
+                with self._lock:
+                    self.failed += 1
+                continue
+            self.queue.complete(task['id'], worker_id)
+            with self._lock:
+                self.downloaded += 1
+
+if __name__ == "__main__":
+    import os
+    import tempfile
+    import time
+    downloads = []
+    def fake_download(image_url, universal_product_code, image_dir):
+        if image_url.endswith("broken.jpg"):
+            raise IOError("broken image")
+        time.sleep(0.01)
+        downloads.append(image_url)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        queue_path = os.path.join(tmp_dir, ImagePipeline.DEFAULT_FILENAME)
+        # deferred images: queued, not downloaded
+        with ImagePipeline(queue_path, fake_download) as pipeline:
+            for i in range(20):
+                pipeline.add(f"https://example.com/{i}.jpg", str(i), tmp_dir)
+            assert not pipeline.add("https://example.com/0.jpg", "0", tmp_dir)
+            pipeline.add("https://example.com/broken.jpg", "broken", tmp_dir)
+            assert pipeline.pending_count() == 21
+        # next run: the pending images are downloaded along with the new ones
+        with ImagePipeline(queue_path, fake_download, workers= 4) as pipeline:
+            pipeline.start()
+            for i in range(20, 40):
+                pipeline.add(f"https://example.com/{i}.jpg", str(i), tmp_dir)
+            pipeline.join()
+            assert pipeline.pending_count() == 0
+            assert len(downloads) == len(set(downloads)) == 40, len(downloads)
+            assert pipeline.failed == 3 and pipeline.queue.counts()[SqliteWorkQueue.FAILED] == 1
+            assert pipeline.retry_failed() == 1
+    print("Test completed")
@@ -0,0 +1,82 @@
+"""
+openclassrooms Python - Project 2
+bookscraper package
+@author Christian Debray - christian.debray@gmail.com
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+import logging
+logger = logging.getLogger(__name__)
+
+# modules that the trivial invocations of the CLI (--help, argument errors) should never import
+HEAVY_MODULES = ["bs4", "soupsieve", "requests", "urllib3", "scraper", "bookdatareader", "books_to_scrape_generators", "cProfile", "tracemalloc"]
+
+# trivial invocations of scrapebooks.py
+DEFAULT_INVOCATIONS = [["-h"], ["--no-such-option"]]
+
+IMPORTTIME_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)$")
+
+def measure_imports(script: str, script_args: list[str], runs: int = 5) -> dict[str, int]:
+    """
+    Runs a script with python -X importtime, returns the cumulative import time (in microseconds) of each top level import,
+    the best of several runs. The interpreter startup imports (site) are left out.
+    """
+    best: dict[str, int] = None
+    for _ in range(runs):
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", script, *script_args],
+            capture_output= True, text= True, cwd= os.path.dirname(os.path.abspath(script)))
+        imports = {}
+        for line in result.stderr.splitlines():
+            if (m := IMPORTTIME_LINE.match(line)) and not m.group(3):
+                imports[m.group(4)] = int(m.group(2))
+        imports.pop("site", None)
+        if best is None or sum(imports.values()) < sum(best.values()):
+            best = imports
+    return best
+
+def imported_modules(script: str, script_args: list[str]) -> set[str]:
+    """
+    Returns the names of all the modules imported by a script run.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", script, *script_args],
+        capture_output= True, text= True, cwd= os.path.dirname(os.path.abspath(script)))
+    return {m.group(4) for line in result.stderr.splitlines() if (m := IMPORTTIME_LINE.match(line))}
+
+def check_budget(script: str, invocations: list[list[str]], budget_ms: float, heavy_modules: list[str] = HEAVY_MODULES, runs: int = 5, top: int = 10) -> list[str]:
+    """
+    Checks the import time of trivial invocations of a script against a budget, and that they don't import heavy modules.
+    Returns the list of the failures (empty if within budget).
+    """
+    failures = []
+    for script_args in invocations:
+        command = " ".join([os.path.basename(script), *script_args])
+        imports = measure_imports(script, script_args, runs= runs)
+        total_ms = sum(imports.values()) / 1000
+        print(f"{command}: {total_ms:.1f}ms of imports (budget {budget_ms:.0f}ms)")
+        for name, us in sorted(imports.items(), key= lambda item: -item[1])[:top]:
+            print(f"    {us / 1000:>7.1f}ms  {name}")
+        if total_ms > budget_ms:
+            failures.append(f"{command}: imports take {total_ms:.1f}ms, over the {budget_ms:.0f}ms budget")
+        if heavy := sorted(imported_modules(script, script_args).intersection(heavy_modules)):
+            failures.append(f"{command}: imports heavy modules {', '.join(heavy)}")
+    return failures
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog="importbudget",
+        description="Check the import time of the trivial invocations of scrapebooks.py (--help, argument errors) against a budget.\nExits with status 1 if over budget, or if a heavy module (bs4, requests...) is imported.",
+        formatter_class=argparse.RawTextHelpFormatter
+    )
+    parser.add_argument("--budget", type= float, default= 80.0, help="import time budget of each invocation, in milliseconds (defaults to 80)")
+    parser.add_argument("--runs", type= int, default= 5, help="runs of each invocation, the best one is kept (defaults to 5)")
+    parser.add_argument("--script", default= os.path.join(os.path.dirname(os.path.abspath(__file__)), "scrapebooks.py"), help="script to check (defaults to scrapebooks.py)")
+    args = parser.parse_args()
+    if failures := check_budget(args.script, DEFAULT_INVOCATIONS, args.budget, runs= args.runs):
+        print("\n".join(failures))
+        sys.exit(1)
+    print("Import time within budget")
@@ -0,0 +1,186 @@
+"""
+openclassrooms Python - Project 2
+bookscraper package
+@author Christian Debray - christian.debray@gmail.com
+"""
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+import os
+import logging
+logger = logging.getLogger(__name__)
+
+class FileManifest:
+    """
+    Persistent manifest of the files of an output directory: the size, modification time and SHA-256 hash
+    of each output file and image, as recorded by the scraper when writing them.
+
+    The manifest also keeps the result of the last validation of each file (see validate.py),
+    so that a file is only validated again once it has changed (different size or modification time).
+
+    Files are identified by their path relative to the output directory, with '/' separators.
+    The manifest is backed by a SQLite database in the output directory, shared by the scraper threads and processes.
+
+    Usage:
+    ```
+     manifest = FileManifest('path/to/output_dir')
+     manifest.record_data('path/to/output_dir/images/Travel/a2b4.jpeg', img_data)
+     manifest.record_file('path/to/output_dir/Travel.csv')
+     manifest.close()
+    ```
+    """
+    DEFAULT_FILENAME = ".manifest.sqlite"
+
+    FIELDS = ("path", "size", "mtime_ns", "sha256", "recorded_at")
+    VALIDATION_FIELDS = ("path", "size", "mtime_ns", "result", "validated_at")
+
+    # read size when hashing files
+    CHUNK_SIZE = 1 << 16
+
+    def __init__(self, root_dir: str, read_only: bool = False, db_path: str = None):
+        """
+        root_dir -- the output directory
+        read_only -- open an existing manifest in read only mode (ex. in the validation worker processes)
+        db_path -- path to the SQLite database (defaults to .manifest.sqlite in root_dir), created if needed
+        """
+        self.root_dir = root_dir
+        self.db_path = db_path or os.path.join(root_dir, self.DEFAULT_FILENAME)
+        self._lock = threading.RLock()
+        if read_only:
+            self._db = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri= True, check_same_thread= False, isolation_level= None)
+            return
+        self._db = sqlite3.connect(self.db_path, check_same_thread= False, isolation_level= None, timeout= 30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                sha256 TEXT NOT NULL,
+                recorded_at REAL NOT NULL
+            )""")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS validations (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                result TEXT NOT NULL,
+                validated_at REAL NOT NULL
+            )""")
+
+    @classmethod
+    def exists(cls, root_dir: str) -> bool:
+        return os.path.isfile(os.path.join(root_dir, cls.DEFAULT_FILENAME))
+
+    def key(self, path: str) -> str:
+        """
+        Returns the manifest key of a file: its path relative to the output directory.
+        """
+        return os.path.relpath(os.path.abspath(path), os.path.abspath(self.root_dir)).replace(os.sep, "/")
+
+    def record_data(self, path: str, data: bytes):
+        """
+        Records a file just written with the given content (no need to read it again to hash it).
+        """
+        st = os.stat(path)
+        self._record(self.key(path), st.st_size, st.st_mtime_ns, hashlib.sha256(data).hexdigest())
+
+    def record_file(self, path: str):
+        """
+        Records a file, reading it to compute its hash.
+        """
+        st = os.stat(path)
+        self._record(self.key(path), st.st_size, st.st_mtime_ns, self.file_sha256(path))
+
+    def get(self, key: str) -> dict | None:
+        """
+        Returns the manifest entry of a file, or None if the file is not recorded.
+        """
+        with self._lock:
+            row = self._db.execute(f"SELECT {', '.join(self.FIELDS)} FROM files WHERE path = ?", (key,)).fetchone()
+        return dict(zip(self.FIELDS, row)) if row else None
+
+    def entries(self, prefix: str = "") -> dict[str, dict]:
+        """
+        Returns the manifest entries of the files whose key starts with prefix (ex. 'images/Travel/'), by key.
+        """
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT {', '.join(self.FIELDS)} FROM files WHERE substr(path, 1, ?) = ?", (len(prefix), prefix)).fetchall()
+        return {row[0]: dict(zip(self.FIELDS, row)) for row in rows}
+
+    def validations(self, prefix: str = "") -> dict[str, dict]:
+        """
+        Returns the last validation results of the files whose key starts with prefix, by key.
+        """
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT {', '.join(self.VALIDATION_FIELDS)} FROM validations WHERE substr(path, 1, ?) = ?", (len(prefix), prefix)).fetchall()
+        return {row[0]: dict(zip(self.VALIDATION_FIELDS, row[:3]), result= json.loads(row[3]), validated_at= row[4]) for row in rows}
+
+    def set_validations(self, validations: list[dict]):
+        """
+        Records validation results in a single transaction: [{'path', 'size', 'mtime_ns', 'result'}, ...]
+        """
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN")
+            try:
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO validations (path, size, mtime_ns, result, validated_at) VALUES (?, ?, ?, ?, ?)",
+                    [(v['path'], v['size'], v['mtime_ns'], json.dumps(v['result']), now) for v in validations])
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @classmethod
+    def file_sha256(cls, path: str) -> str:
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            while chunk := f.read(cls.CHUNK_SIZE):
+                h.update(chunk)
+        return h.hexdigest()
+
+    def _record(self, key: str, size: int, mtime_ns: int, sha256: str):
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO files (path, size, mtime_ns, sha256, recorded_at) VALUES (?, ?, ?, ?, ?)",
+                (key, size, mtime_ns, sha256, time.time()))
+
+if __name__ == "__main__":
+    import tempfile
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        os.makedirs(os.path.join(tmp_dir, "images", "Travel"))
+        img_file = os.path.join(tmp_dir, "images", "Travel", "a2b4.jpeg")
+        with open(img_file, "wb") as f:
+            f.write(b"\xff\xd8image")
+        csv_file = os.path.join(tmp_dir, "Travel.csv")
+        with open(csv_file, "w") as f:
+            f.write("title\nfoo\n")
+        with FileManifest(tmp_dir) as manifest:
+            manifest.record_data(img_file, b"\xff\xd8image")
+            manifest.record_file(csv_file)
+            assert manifest.get("images/Travel/a2b4.jpeg")['sha256'] == hashlib.sha256(b"\xff\xd8image").hexdigest()
+            assert manifest.get("Travel.csv")['size'] == 10
+            assert list(manifest.entries("images/")) == ["images/Travel/a2b4.jpeg"]
+            manifest.set_validations([{'path': "Travel.csv", 'size': 10, 'mtime_ns': 1, 'result': {'errors': []}}])
+        with FileManifest(tmp_dir, read_only= True) as manifest:
+            assert manifest.validations()["Travel.csv"]['result'] == {'errors': []}
+            assert manifest.validations("images/") == {}
+    print("Test completed")
@@ -0,0 +1,253 @@
+"""
+openclassrooms Python - Project 2
+bookscraper package
+@author Christian Debray - christian.debray@gmail.com
+"""
+from collections.abc import Generator
+from contextlib import contextmanager
+import bisect
+import datetime
+import json
+import os
+import threading
+import time
+import logging
+logger = logging.getLogger(__name__)
+
+class StageTimer:
+    """
+    Measure of a single stage run, see Metrics.measure(). Set bytes to record the size of the data handled.
+    """
+    def __init__(self):
+        self.bytes: int = 0
+
+
+class Metrics:
+    """
+    Thread safe instrumentation of the scraping stages: counts, bytes and latency histograms,
+    plus event counters (ex. books written, invalid books).
+
+    Latencies are recorded in fixed exponential buckets, so that the memory used does not depend
+    on the size of the crawl. Percentiles are interpolated within the buckets.
+
+    Usage:
+    ```
+     metrics = Metrics()
+     with metrics.measure("product_fetch") as m:
+        html = fetch(url)
+        m.bytes = len(html)
+     metrics.count("books_written")
+     metrics.write_json("path/to/scrape_metrics.json")
+     metrics.write_prometheus("path/to/bookscraper.prom")
+    ```
+    """
+    # the stages measured by the scraper, in pipeline order
+    STAGES = ["index_fetch", "product_fetch", "image_fetch", "parse", "validate", "write"]
+
+    # upper bounds of the latency buckets, in seconds: 0.25ms to ~3mn, in steps of sqrt(2)
+    BUCKETS = [0.00025 * 2 ** (i / 2) for i in range(40)]
+
+    PERCENTILES = [50, 95, 99]
+
+    PROMETHEUS_PREFIX = "bookscraper"
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started_at = time.time()
+        self._stages: dict[str, dict] = {}
+        self._counters: dict[str, int] = {}
+
+    @contextmanager
+    def measure(self, stage: str) -> Generator[StageTimer]:
+        """
+        Measures the duration of a stage. Failed runs (the stage raised an exception) are counted as errors.
+        """
+        timer = StageTimer()
+        start = time.perf_counter()
+        try:
+            yield timer
+        except BaseException:
+            self.observe(stage, time.perf_counter() - start, timer.bytes, error= True)
+            raise
+        self.observe(stage, time.perf_counter() - start, timer.bytes)
+
+    def observe(self, stage: str, seconds: float, nbytes: int = 0, error: bool = False):
+        """
+        Records a run of a stage.
+        """
+        bucket = bisect.bisect_left(self.BUCKETS, seconds)
+        with self._lock:
+            stats = self._stages.get(stage)
+            if stats is None:
+                stats = self._stages[stage] = {
+                    'count': 0, 'errors': 0, 'bytes': 0, 'seconds': 0.0, 'max': 0.0,
+                    'buckets': [0] * (len(self.BUCKETS) + 1)}
+            stats['count'] += 1
+            stats['errors'] += int(error)
+            stats['bytes'] += nbytes
+            stats['seconds'] += seconds
+            stats['max'] = max(stats['max'], seconds)
+            stats['buckets'][bucket] += 1
+
+    def count(self, counter: str, n: int = 1):
+        """
+        Increments an event counter.
+        """
+        with self._lock:
+            self._counters[counter] = self._counters.get(counter, 0) + n
+
+    def percentile(self, stage: str, p: float) -> float:
+        """
+        Returns an estimate of the p-th percentile of a stage's latency, in seconds (0 if the stage never ran).
+        """
+        with self._lock:
+            stats = self._stages.get(stage)
+            if stats is None or stats['count'] == 0:
+                return 0.0
+            return self._percentile(stats, p)
+
+    def report(self) -> dict:
+        """
+        Returns the metrics as a dictionary, with the throughput and latency percentiles of each stage.
+        """
+        now = time.time()
+        with self._lock:
+            stages = {}
+            for stage in sorted(self._stages, key= self._stage_order):
+                stats = self._stages[stage]
+                stages[stage] = {
+                    'count': stats['count'],
+                    'errors': stats['errors'],
+                    'bytes': stats['bytes'],
+                    'total_seconds': round(stats['seconds'], 6),
+                    'mean_seconds': round(stats['seconds'] / stats['count'], 6),
+                    'max_seconds': round(stats['max'], 6),
+                    'bytes_per_second': round(stats['bytes'] / stats['seconds'], 1) if stats['seconds'] > 0 else 0.0
+                }
+                for p in self.PERCENTILES:
+                    stages[stage][f"p{p}_seconds"] = round(self._percentile(stats, p), 6)
+            return {
+                'started_at': datetime.datetime.fromtimestamp(self.started_at, datetime.timezone.utc).isoformat(),
+                'duration_seconds': round(now - self.started_at, 3),
+                'stages': stages,
+                'counters': dict(sorted(self._counters.items()))
+            }
+
+    def summary(self) -> str:
+        """
+        Returns a one line per stage, human readable summary of the metrics.
+        """
+        lines = []
+        for stage, stats in self.report()['stages'].items():
+            lines.append(
+                f"{stage}: {stats['count']} runs, {stats['errors']} errors, {stats['bytes']} bytes, "
+                f"total {stats['total_seconds']:.2f}s, p50 {stats['p50_seconds'] * 1000:.1f}ms, "
+                f"p95 {stats['p95_seconds'] * 1000:.1f}ms, p99 {stats['p99_seconds'] * 1000:.1f}ms")
+        return "\n".join(lines)
+
+    def write_json(self, filename: str):
+        """
+        Writes the report (see report()) to a JSON file.
+        """
+        self._write_atomic(filename, json.dumps(self.report(), indent= 2))
+        logger.info(f"Wrote metrics report to {filename}")
+
+    def write_prometheus(self, filename: str):
+        """
+        Writes the metrics to a file in the Prometheus text format, ex. for the textfile collector of the node exporter.
+        """
+        prefix = self.PROMETHEUS_PREFIX
+        lines = [
+            f"# HELP {prefix}_stage_duration_seconds Duration of the scraping stages.",
+            f"# TYPE {prefix}_stage_duration_seconds histogram"]
+        with self._lock:
+            for stage in sorted(self._stages, key= self._stage_order):
+                stats = self._stages[stage]
+                cumulated = 0
+                for bound, bucket_count in zip(self.BUCKETS, stats['buckets']):
+                    cumulated += bucket_count
+                    lines.append(f'{prefix}_stage_duration_seconds_bucket{{stage="{stage}",le="{bound:g}"}} {cumulated}')
+                lines.append(f'{prefix}_stage_duration_seconds_bucket{{stage="{stage}",le="+Inf"}} {stats["count"]}')
+                lines.append(f'{prefix}_stage_duration_seconds_sum{{stage="{stage}"}} {stats["seconds"]:.6f}')
+                lines.append(f'{prefix}_stage_duration_seconds_count{{stage="{stage}"}} {stats["count"]}')
+            lines += [
+                f"# HELP {prefix}_stage_bytes_total Bytes handled by the scraping stages.",
+                f"# TYPE {prefix}_stage_bytes_total counter"]
+            lines += [f'{prefix}_stage_bytes_total{{stage="{stage}"}} {stats["bytes"]}' for stage, stats in self._stages.items()]
+            lines += [
+                f"# HELP {prefix}_stage_errors_total Failed runs of the scraping stages.",
+                f"# TYPE {prefix}_stage_errors_total counter"]
+            lines += [f'{prefix}_stage_errors_total{{stage="{stage}"}} {stats["errors"]}' for stage, stats in self._stages.items()]
+            lines += [
+                f"# HELP {prefix}_events_total Scraping events.",
+                f"# TYPE {prefix}_events_total counter"]
+            lines += [f'{prefix}_events_total{{event="{counter}"}} {n}' for counter, n in sorted(self._counters.items())]
+        lines += [
+            f"# HELP {prefix}_run_start_time_seconds Start time of the run.",
+            f"# TYPE {prefix}_run_start_time_seconds gauge",
+            f"{prefix}_run_start_time_seconds {self.started_at:.3f}"]
+        self._write_atomic(filename, "\n".join(lines) + "\n")
+        logger.info(f"Wrote Prometheus metrics to {filename}")
+
+    def _percentile(self, stats: dict, p: float) -> float:
+        """
+        Interpolates a percentile within the latency buckets. The last bucket is bounded by the max latency.
+        """
+        rank = stats['count'] * p / 100
+        cumulated = 0
+        for i, bucket_count in enumerate(stats['buckets']):
+            if bucket_count and cumulated + bucket_count >= rank:
+                lower = self.BUCKETS[i - 1] if i > 0 else 0.0
+                upper = min(self.BUCKETS[i], stats['max']) if i < len(self.BUCKETS) else stats['max']
+                return lower + (upper - lower) * max(0.0, rank - cumulated) / bucket_count
+            cumulated += bucket_count
+        return stats['max']
+
+    def _stage_order(self, stage: str) -> tuple[int, str]:
+        return (self.STAGES.index(stage) if stage in self.STAGES else len(self.STAGES), stage)
+
+    def _write_atomic(self, filename: str, content: str):
+        path = os.path.dirname(filename)
+        if path and not os.path.exists(path):
+            os.makedirs(path, mode = 0o777)
+        tmp_filename = filename + ".tmp"
+        with open(tmp_filename, "w", encoding= "utf-8") as f:
+            f.write(content)
+        os.replace(tmp_filename, filename)
+
+if __name__ == "__main__":
+    import random
+    import tempfile
+    metrics = Metrics()
+    rnd = random.Random(1)
+    latencies = sorted(rnd.uniform(0.010, 0.020) for _ in range(1000))
+    for latency in latencies:
+        metrics.observe("product_fetch", latency, 5000)
+    metrics.observe("parse", 0.002)
+    with metrics.measure("write") as m:
+        m.bytes = 120
+    try:
+        with metrics.measure("image_fetch"):
+            raise IOError("connection lost")
+    except IOError:
+        pass
+    metrics.count("books_written", 2)
+    report = metrics.report()
+    stats = report['stages']['product_fetch']
+    assert list(report['stages'].keys()) == ["product_fetch", "image_fetch", "parse", "write"]
+    assert stats['count'] == 1000 and stats['bytes'] == 5_000_000
+    # the estimates stay within the bucket of the exact percentile
+    for p in Metrics.PERCENTILES:
+        exact = latencies[int(len(latencies) * p / 100) - 1]
+        assert abs(stats[f"p{p}_seconds"] - exact) < 0.005, (p, stats[f"p{p}_seconds"], exact)
+    assert report['stages']['image_fetch']['errors'] == 1
+    assert report['counters'] == {'books_written': 2}
+    print(metrics.summary())
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        metrics.write_json(os.path.join(tmp_dir, "metrics.json"))
+        metrics.write_prometheus(os.path.join(tmp_dir, "metrics.prom"))
+        with open(os.path.join(tmp_dir, "metrics.prom")) as f:
+            prom = f.read()
+        assert 'bookscraper_stage_duration_seconds_count{stage="product_fetch"} 1000' in prom
+        assert 'bookscraper_events_total{event="books_written"} 2' in prom
+    print("Test completed")
@@ -0,0 +1,365 @@
+"""
+openclassrooms Python - Project 2
+bookscraper package
+@author Christian Debray - christian.debray@gmail.com
+"""
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import argparse
+import threading
+import random
+import hashlib
+import html
+import math
+import time
+import re
+import logging
+logger = logging.getLogger(__name__)
+
+class MockCatalog:
+    """
+    Deterministic, generated books catalog mimicking the structure of https://books.toscrape.com:
+    the same seed always generates the same books, pages and images.
+
+    categories -- number of categories
+    books_per_category -- number of books in each category
+    page_size -- number of books listed on each index page
+    description_size -- approximate size (in characters) of the book descriptions
+    """
+    RATINGS = ["One", "Two", "Three", "Four", "Five"]
+
+    def __init__(self, categories: int = 5, books_per_category: int = 30, page_size: int = 20, seed: int = 42, description_size: int = 800):
+        self.page_size = page_size
+        self.seed = seed
+        self.description_size = description_size
+        self.categories: list[dict] = []
+        self.books: dict[str, dict] = {}
+        rnd = random.Random(seed)
+        book_id = 0
+        for cat_id in range(categories):
+            cat_name = f"Category {cat_id + 1}"
+            cat = {'id': cat_id + 2, 'name': cat_name, 'slug': f"category-{cat_id + 1}_{cat_id + 2}", 'books': []}
+            for i in range(books_per_category):
+                book_id += 1
+                slug = f"book-{book_id}_{book_id}"
+                book = {
+                    'id': book_id,
+                    'slug': slug,
+                    'title': f"Book {book_id}",
+                    'upc': hashlib.md5(f"{seed}-{book_id}".encode()).hexdigest()[:16],
+                    'price': round(rnd.uniform(10, 60), 2),
+                    'available': rnd.randint(1, 22),
+                    'rating': rnd.randint(1, 5),
+                    'category': cat
+                }
+                cat['books'].append(book)
+                self.books[slug] = book
+            self.categories.append(cat)
+
+    def page_count(self, cat: dict) -> int:
+        return max(1, math.ceil(len(cat['books']) / self.page_size))
+
+    def image_bytes(self, book_id: int) -> bytes:
+        """
+        A small valid JPEG-like payload (SOI, SOF0 with dimensions, EOI), padded to a realistic size
+        """
+        sof = b'\xff\xc0\x00\x11\x08\x01\x2c\x00\xc8\x03\x01\x22\x00\x02\x11\x01\x03\x11\x01'
+        padding = hashlib.sha256(str(book_id).encode()).digest() * 300
+        return b'\xff\xd8' + sof + b'\xff\xfe' + len(padding[:2000]).to_bytes(2, 'big') + padding[:1998] + b'\xff\xd9'
+
+    def _layout(self, title: str, content: str, categories_menu: bool = True) -> str:
+        menu = ""
+        if categories_menu:
+            items = "\n".join(
+                f'<li><a href="/catalogue/category/books/{c["slug"]}/index.html">\n    {html.escape(c["name"])}\n</a></li>'
+                for c in self.categories)
+            menu = f"""
+<aside class="sidebar col-sm-4 col-md-3">
+  <div class="side_categories">
+    <ul class="nav nav-list">
+      <li><a href="/catalogue/category/books_1/index.html">Books</a>
+        <ul>
+{items}
+        </ul>
+      </li>
+    </ul>
+  </div>
+</aside>"""
+        return f"""<!DOCTYPE html>
+<html lang="en-us"><head><title>{html.escape(title)} | Books to Scrape - Sandbox</title></head>
+<body id="default" class="default">
+<div class="container-fluid page"><div class="page_inner"><div class="row">
+{menu}
+<div class="col-sm-8 col-md-9">
+{content}
+</div></div></div></div>
+</body></html>"""
+
+    def listing_page(self, cat: dict | None, page: int) -> str | None:
+        books = cat['books'] if cat else [b for c in self.categories for b in c['books']]
+        pages = max(1, math.ceil(len(books) / self.page_size))
+        if page < 1 or page > pages:
+            return None
+        items = []
+        for b in books[(page - 1) * self.page_size: page * self.page_size]:
+            items.append(f"""
+<li class="col-xs-6 col-sm-4 col-md-3 col-lg-3">
+  <article class="product_pod">
+    <div class="image_container"><a href="../../../{b['slug']}/index.html"><img src="../../../../media/cache/{b['id']}.jpg" alt="{html.escape(b['title'])}" class="thumbnail"></a></div>
+    <p class="star-rating {self.RATINGS[b['rating'] - 1]}"></p>
+    <h3><a href="../../../{b['slug']}/index.html" title="{html.escape(b['title'])}">{html.escape(b['title'])}</a></h3>
+    <div class="product_price">
+      <p class="price_color">£{b['price']:.2f}</p>
+      <p class="instock availability"><i class="icon-ok"></i> In stock</p>
+    </div>
+  </article>
+</li>""")
+        pager = ""
+        if page > 1:
+            pager += f'<li class="previous"><a href="page-{page - 1}.html">previous</a></li>'
+        pager += f'<li class="current">Page {page} of {pages}</li>'
+        if page < pages:
+            pager += f'<li class="next"><a href="page-{page + 1}.html">next</a></li>'
+        name = cat['name'] if cat else "All products"
+        content = f"""
+<div class="page-header action"><h1>{html.escape(name)}</h1></div>
+<form method="get" class="form-horizontal">
+  <div style="display:none"><input type="hidden" name="sort" value="default"></div>
+  <strong>{len(books)}</strong> results - showing <strong>{(page - 1) * self.page_size + 1}</strong> to <strong>{min(page * self.page_size, len(books))}</strong>.
+</form>
+<section>
+  <div>
+    <ol class="row">{"".join(items)}
+    </ol>
+    <div><ul class="pager">{pager}</ul></div>
+  </div>
+</section>"""
+        return self._layout(name, content)
+
+    def product_page(self, slug: str) -> str | None:
+        b = self.books.get(slug)
+        if b is None:
+            return None
+        rnd = random.Random(f"{self.seed}-{b['id']}")
+        words = ["lorem", "ipsum", "dolor", "sit", "amet", "consectetur", "adipiscing", "elit", "sed", "do"]
+        description = ""
+        while len(description) < self.description_size:
+            description += rnd.choice(words) + " "
+        cat = b['category']
+        content = f"""
+<ul class="breadcrumb">
+  <li><a href="../../index.html">Home</a></li>
+  <li><a href="../category/books_1/index.html">Books</a></li>
+  <li><a href="../category/books/{cat['slug']}/index.html">{html.escape(cat['name'])}</a></li>
+  <li class="active">{html.escape(b['title'])}</li>
+</ul>
+<div id="content_inner">
+<article class="product_page">
+  <div class="row">
+    <div class="col-sm-6">
+      <div id="product_gallery" class="carousel"><div class="thumbnail"><div class="carousel-inner"><div class="item active">
+        <img src="../../media/cache/{b['id']}.jpg" alt="{html.escape(b['title'])}">
+      </div></div></div></div>
+    </div>
+    <div class="col-sm-6 product_main">
+      <h1>{html.escape(b['title'])}</h1>
+      <p class="price_color">£{b['price']:.2f}</p>
+      <p class="instock availability">
+        <i class="icon-ok"></i>
+        In stock ({b['available']} available)
+      </p>
+      <p class="star-rating {self.RATINGS[b['rating'] - 1]}"><i class="icon-star"></i></p>
+    </div>
+  </div>
+  <div id="product_description" class="sub-header"><h2>Product Description</h2></div>
+  <p>{html.escape(description.strip())}</p>
+  <div class="sub-header"><h2>Product Information</h2></div>
+  <table class="table table-striped">
+    <tr><th>UPC</th><td>{b['upc']}</td></tr>
+    <tr><th>Product Type</th><td>Books</td></tr>
+    <tr><th>Price (excl. tax)</th><td>£{b['price']:.2f}</td></tr>
+    <tr><th>Price (incl. tax)</th><td>£{b['price']:.2f}</td></tr>
+    <tr><th>Tax</th><td>£0.00</td></tr>
+    <tr><th>Availability</th><td>In stock ({b['available']} available)</td></tr>
+    <tr><th>Number of reviews</th><td>0</td></tr>
+  </table>
+</article>
+</div>"""
+        return self._layout(b['title'], content, categories_menu= False)
+
+
+class MockBooksServer:
+    """
+    Local stand-in for https://books.toscrape.com, serving a MockCatalog over HTTP.
+    Used to test and benchmark the scraper offline and reproducibly.
+
+    latency, jitter -- delay (in seconds) added to each response: latency + uniform(0, jitter)
+    error_rate -- probability of answering with an injected error (see error_kinds)
+    error_kinds -- errors to inject: "timeout" (hang for hang_time seconds), "429", "500", "503"
+
+    Usage:
+    ```
+     with MockBooksServer(MockCatalog(categories= 10, books_per_category= 50), latency= 0.05) as server:
+        scraper.scrape_all_categories(server.base_url)
+     print(server.requests_count, server.bytes_sent)
+    ```
+    """
+    ERROR_KINDS = ["timeout", "429", "500", "503"]
+
+    def __init__(self, catalog: MockCatalog = None, host: str = "127.0.0.1", port: int = 0,
+                 latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0,
+                 error_kinds: list[str] = None, hang_time: float = 10.0, seed: int = 42):
+        self.catalog = catalog or MockCatalog()
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_kinds = error_kinds or ["500"]
+        self.hang_time = hang_time
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.requests_count = 0
+        self.bytes_sent = 0
+        self.errors_injected = 0
+        self._httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self._httpd.daemon_threads = True
+        self._thread: threading.Thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def start(self) -> "MockBooksServer":
+        self._thread = threading.Thread(target= self._httpd.serve_forever, daemon= True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def route(self, path: str) -> tuple[int, str, bytes]:
+        """
+        Returns the (status, content type, body) answering a request path.
+        """
+        path = path.split('?')[0]
+        text_html = "text/html; charset=utf-8"
+        if path in ("/", "/index.html", "/catalogue/category/books_1/index.html"):
+            return (200, text_html, self.catalog.listing_page(None, 1).encode())
+        if m := re.fullmatch(r"/catalogue/category/books_1/page-(\d+)\.html", path):
+            if page := self.catalog.listing_page(None, int(m.group(1))):
+                return (200, text_html, page.encode())
+        if m := re.fullmatch(r"/catalogue/category/books/([\w\-]+)/(index|page-(\d+))\.html", path):
+            for cat in self.catalog.categories:
+                if cat['slug'] == m.group(1):
+                    if page := self.catalog.listing_page(cat, int(m.group(3) or 1)):
+                        return (200, text_html, page.encode())
+        if m := re.fullmatch(r"/catalogue/([\w\-]+)/index\.html", path):
+            if page := self.catalog.product_page(m.group(1)):
+                return (200, text_html, page.encode())
+        if m := re.fullmatch(r"/media/cache/(\d+)\.jpg", path):
+            return (200, "image/jpeg", self.catalog.image_bytes(int(m.group(1))))
+        return (404, text_html, b"<html><body>Not found</body></html>")
+
+    def _injected_error(self) -> str | None:
+        with self._lock:
+            if self.error_rate > 0 and self._random.random() < self.error_rate:
+                self.errors_injected += 1
+                return self._random.choice(self.error_kinds)
+            return None
+
+    def _delay(self) -> float:
+        with self._lock:
+            return self.latency + (self._random.uniform(0, self.jitter) if self.jitter > 0 else 0)
+
+    def _make_handler(self):
+        server = self
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # headers and body are sent in separate writes: without TCP_NODELAY, keep-alive connections stall on delayed ACKs
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                with server._lock:
+                    server.requests_count += 1
+                if delay := server._delay():
+                    time.sleep(delay)
+                if error := server._injected_error():
+                    if error == "timeout":
+                        time.sleep(server.hang_time)
+                        self.close_connection = True
+                        return
+                    self._send(int(error), "text/plain", f"injected error {error}".encode())
+                    return
+                status, content_type, body = server.route(self.path)
+                self._send(status, content_type, body)
+
+            def do_HEAD(self):
+                # headers only, ex. to open connections (see remotedatasource.warmup_connections())
+                with server._lock:
+                    server.requests_count += 1
+                if delay := server._delay():
+                    time.sleep(delay)
+                status, content_type, body = server.route(self.path)
+                self._send(status, content_type, body, head= True)
+
+            def _send(self, status: int, content_type: str, body: bytes, head: bool = False):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                if status == 429:
+                    self.send_header("Retry-After", "1")
+                if self.close_connection:
+                    # the client asked to close the connection (no keep-alive): confirm it, so that it is not re-used
+                    self.send_header("Connection", "close")
+                self.end_headers()
+                if head:
+                    return
+                self.wfile.write(body)
+                with server._lock:
+                    server.bytes_sent += len(body)
+
+            def log_message(self, format, *args):
+                logger.debug("mockserver: " + format % args)
+        return Handler
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog="mockserver",
+        description="Serve a generated books catalog mimicking https://books.toscrape.com, until interrupted.",
+        formatter_class=argparse.RawTextHelpFormatter
+    )
+    parser.add_argument("--port", type= int, default= 8000, help="port to listen on (defaults to 8000, 0 for any free port)")
+    parser.add_argument("--categories", type= int, default= 5, help="number of categories (defaults to 5)")
+    parser.add_argument("--books-per-category", type= int, default= 30, help="number of books per category (defaults to 30)")
+    parser.add_argument("--page-size", type= int, default= 20, help="number of books per index page (defaults to 20)")
+    parser.add_argument("--latency", type= float, default= 0.0, help="delay added to each response, in seconds")
+    parser.add_argument("--jitter", type= float, default= 0.0, help="random delay (0 to N seconds) added to the latency")
+    parser.add_argument("--error-rate", type= float, default= 0.0, help="probability of answering a request with an injected error")
+    parser.add_argument(
+        "--error-kinds",
+        nargs="+",
+        choices= MockBooksServer.ERROR_KINDS,
+        default= ["500"],
+        help="errors to inject (defaults to 500). timeout: the server hangs for --hang-time seconds, then closes the connection"
+    )
+    parser.add_argument("--hang-time", type= float, default= 10.0, help="duration of the injected timeouts, in seconds (defaults to 10)")
+    parser.add_argument("--seed", type= int, default= 42, help="seed of the generated catalog and of the injected errors")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    catalog = MockCatalog(args.categories, args.books_per_category, page_size= args.page_size, seed= args.seed)
+    server = MockBooksServer(
+        catalog, port= args.port, latency= args.latency, jitter= args.jitter,
+        error_rate= args.error_rate, error_kinds= args.error_kinds, hang_time= args.hang_time, seed= args.seed)
+    logger.info(f"Serving {len(catalog.books)} books in {len(catalog.categories)} categories at {server.base_url}")
+    server.start()
+    try:
+        server._thread.join()
+    except KeyboardInterrupt:
+        server.stop()
+        logger.info(f"Served {server.requests_count} requests ({server.bytes_sent} bytes, {server.errors_injected} injected errors)")
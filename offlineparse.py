@@ -0,0 +1,233 @@
+"""
+openclassrooms Python - Project 2
+bookscraper package
+@author Christian Debray - christian.debray@gmail.com
+"""
+from concurrent.futures import ProcessPoolExecutor
+import glob
+import json
+import os
+import pathlib
+import re
+import urllib.parse
+from bookdatareader import BookDataReader
+from bookdatawriter import AbstractBookDataWriter, create_writer, output_file_suffix
+from books_to_scrape_generators import BooksToScrapeGenerator
+from manifest import FileManifest
+import logging
+logger = logging.getLogger(__name__)
+
+# reader of the current worker process, see _parse_chunk()
+_reader: BookDataReader = None
+
+class OfflineParser:
+    """
+    Offline ingest of saved product pages (ex. a mirror of the catalog): parses local HTML files
+    with the BooksToScrapeGenerator, in a pool of processes, and writes the books to the usual output files,
+    one per category, in the output directory.
+
+    The inputs may be files, directories (searched recursively for .html and .htm files) or glob patterns.
+    Files that can't be read or are not valid product pages are reported to parse_errors.jsonl in the output directory.
+    As with the scraper, the books already found in an existing output file are not written again.
+
+    The product page url of each book is rebuilt from the path of its file relative to the input directory
+    and base_url (ex. https://books.toscrape.com/ for a mirror of the site), or is the file:// url of the file.
+
+    Usage:
+    ```
+     parser = OfflineParser('data/mirror_2024-05-03', base_url= 'https://books.toscrape.com/')
+     summary = parser.parse_files(['mirror/books.toscrape.com/catalogue'])
+     print(summary['books'], summary['errors'])
+    ```
+    """
+    ERRORS_FILENAME = "parse_errors.jsonl"
+    HTML_SUFFIXES = (".html", ".htm")
+
+    # files per task sent to the worker processes
+    CHUNK_SIZE = 64
+
+    def __init__(self, output_dir: str, output_format: str = "csv", compression: str = None, workers: int = None, base_url: str = None):
+        """
+        workers -- number of worker processes, defaults to the number of CPUs. With 1 worker, parses in the current process.
+        base_url -- url of the input directories, to rebuild the product page urls
+        """
+        self.output_dir = output_dir
+        self.output_format = output_format
+        self.compression = compression
+        self.workers = workers
+        self.base_url = base_url
+
+    @classmethod
+    def list_input_files(cls, inputs: list[str]) -> list[tuple[str, str]]:
+        """
+        Expands the inputs (files, directories or glob patterns) to the HTML files to parse.
+        Returns (file path, input directory) pairs, in order and without duplicates.
+        Raises a FileNotFoundError if an input matches no file.
+        """
+        files: dict[str, str] = {}
+        for input_path in inputs:
+            if os.path.isdir(input_path):
+                matches = [(path, input_path) for path in cls._walk_html_files(input_path)]
+            elif os.path.isfile(input_path):
+                matches = [(input_path, os.path.dirname(input_path))]
+            else:
+                # glob pattern: the input directory is the part of the pattern without wildcards
+                root = re.split(r'[*?\[]', input_path, maxsplit= 1)[0]
+                root = root if root.endswith(os.sep) else os.path.dirname(root)
+                matches = []
+                for path in sorted(glob.glob(input_path, recursive= True)):
+                    if os.path.isdir(path):
+                        matches.extend((html_file, root) for html_file in cls._walk_html_files(path))
+                    else:
+                        matches.append((path, root))
+            if not matches:
+                raise FileNotFoundError(f"No HTML file found at {input_path}")
+            for path, root in matches:
+                files.setdefault(os.path.abspath(path), os.path.abspath(root or os.curdir))
+        return list(files.items())
+
+    def parse_files(self, inputs: list[str]) -> dict:
+        """
+        Parses the HTML files found in the inputs (see list_input_files()) and writes the books to the output directory.
+        Returns a summary: {'files', 'books', 'skipped' (already in the output), 'errors', 'output_files'}
+        """
+        files = self.list_input_files(inputs)
+        tasks = [(path, self._page_url(path, root)) for path, root in files]
+        chunks = [tasks[i:i + self.CHUNK_SIZE] for i in range(0, len(tasks), self.CHUNK_SIZE)]
+        logger.info(f"Parse {len(tasks)} HTML files to {self.output_dir}")
+        if not os.path.exists(self.output_dir):
+            os.makedirs(self.output_dir, mode = 0o777)
+        # category name -> (writer, urls already written)
+        outputs: dict[str, tuple[AbstractBookDataWriter, set[str]]] = {}
+        errors = []
+        summary = {'files': len(tasks), 'books': 0, 'skipped': 0, 'errors': 0, 'output_files': []}
+        try:
+            if self.workers == 1:
+                results = map(_parse_chunk, chunks)
+                self._write_results(results, outputs, errors, summary)
+            else:
+                with ProcessPoolExecutor(max_workers= self.workers) as executor:
+                    # the results come in order: the output files don't depend on the number of workers
+                    self._write_results(executor.map(_parse_chunk, chunks), outputs, errors, summary)
+        finally:
+            for writer, _ in outputs.values():
+                writer.close()
+        summary['output_files'] = sorted(writer.full_file_path for writer, _ in outputs.values())
+        self._record_output_files(summary['output_files'])
+        errors_file = os.path.join(self.output_dir, self.ERRORS_FILENAME)
+        if errors:
+            with open(errors_file, "w", encoding= "utf-8") as f:
+                for error in errors:
+                    f.write(json.dumps(error) + "\n")
+        elif os.path.exists(errors_file):
+            os.remove(errors_file)
+        return summary
+
+    def _write_results(self, results, outputs: dict[str, tuple[AbstractBookDataWriter, set[str]]], errors: list[dict], summary: dict):
+        for chunk_results in results:
+            for result in chunk_results:
+                if error := result.get('error'):
+                    logger.warning(f"{result['path']}: {error}")
+                    errors.append({'path': result['path'], 'error': error})
+                    summary['errors'] += 1
+                    continue
+                record = result['record']
+                writer, written_urls = self._get_output(record['category'] or "books", outputs)
+                if record['product_page_url'] in written_urls:
+                    summary['skipped'] += 1
+                    continue
+                writer.append_record(record)
+                written_urls.add(record['product_page_url'])
+                summary['books'] += 1
+
+    def _get_output(self, category_name: str, outputs: dict[str, tuple[AbstractBookDataWriter, set[str]]]) -> tuple[AbstractBookDataWriter, set[str]]:
+        """
+        Opens the output file of a category (named as by the scraper) on its first book,
+        with the urls of the books it already holds.
+        """
+        if category_name not in outputs:
+            basename = re.sub(r'[\s/]+', '_', category_name.strip(" /")) + output_file_suffix(self.output_format, self.compression)
+            writer = create_writer(os.path.join(self.output_dir, basename), output_format= self.output_format, compression= self.compression)
+            outputs[category_name] = (writer, {record.get('product_page_url') for record in writer.read_records()})
+        return outputs[category_name]
+
+    def _record_output_files(self, output_files: list[str]):
+        """
+        Records the output files to the manifest of the output directory (see validate.py).
+        """
+        if not output_files:
+            return
+        with FileManifest(self.output_dir) as manifest:
+            for output_file in output_files:
+                manifest.record_file(output_file)
+
+    def _page_url(self, path: str, root: str) -> str:
+        if self.base_url:
+            return urllib.parse.urljoin(self.base_url, os.path.relpath(path, root).replace(os.sep, "/"))
+        return pathlib.Path(path).as_uri()
+
+    @classmethod
+    def _walk_html_files(cls, dir_path: str) -> list[str]:
+        html_files = []
+        for dir_name, sub_dirs, file_names in os.walk(dir_path):
+            sub_dirs.sort()
+            html_files.extend(os.path.join(dir_name, f) for f in sorted(file_names) if f.lower().endswith(cls.HTML_SUFFIXES))
+        return html_files
+
+
+def _parse_chunk(tasks: list[tuple[str, str]]) -> list[dict]:
+    """
+    Parses a chunk of files in a worker process: [(path, product page url), ...]
+    Returns a result per file: {'path', 'record'} (see BookData.export()) or {'path', 'error'}.
+    """
+    global _reader
+    if _reader is None:
+        _reader = BookDataReader(scraping_generator= BooksToScrapeGenerator())
+    results = []
+    for path, url in tasks:
+        try:
+            with open(path, encoding= "utf-8", errors= "replace") as f:
+                html = f.read()
+            book = _reader.read_from_html(html, url)
+        except Exception as e:
+            results.append({'path': path, 'error': f"{type(e).__name__}: {e}"})
+            continue
+        if book is None or not book.is_valid():
+            results.append({'path': path, 'error': "Not a product page (no universal product code found)"})
+            continue
+        book.product_page_url = url
+        results.append({'path': path, 'record': book.export()})
+    return results
+
+if __name__ == "__main__":
+    import shutil
+    import tempfile
+    from parserbench import FIXTURES_DIR
+    from bookdatawriter import read_output_records
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # a small mirror: the recorded product pages, an index page and a broken file
+        mirror = os.path.join(tmp_dir, "mirror")
+        for i in range(1, 4):
+            os.makedirs(os.path.join(mirror, "catalogue", f"book_{i}"))
+            shutil.copy(os.path.join(FIXTURES_DIR, f"product_{i}.html"), os.path.join(mirror, "catalogue", f"book_{i}", "index.html"))
+        shutil.copy(os.path.join(FIXTURES_DIR, "index_1.html"), os.path.join(mirror, "catalogue", "index.html"))
+        with open(os.path.join(mirror, "catalogue", "broken.htm"), "w") as f:
+            f.write("<html><body>truncated")
+        output_dir = os.path.join(tmp_dir, "output")
+        assert len(OfflineParser.list_input_files([mirror, os.path.join(mirror, "catalogue", "*", "index.html")])) == 5
+        summaries = {}
+        for workers in (1, 2):
+            shutil.rmtree(output_dir, ignore_errors= True)
+            parser = OfflineParser(output_dir, workers= workers, base_url= "https://books.toscrape.com/")
+            summaries[workers] = parser.parse_files([mirror])
+            print(summaries[workers])
+        assert summaries[1] == summaries[2]
+        assert summaries[1]['books'] == 3 and summaries[1]['errors'] == 2
+        records = [r for output_file in summaries[1]['output_files'] for r in read_output_records(output_file)]
+        assert sorted(r['product_page_url'] for r in records) == [f"https://books.toscrape.com/catalogue/book_{i}/index.html" for i in range(1, 4)]
+        with open(os.path.join(output_dir, OfflineParser.ERRORS_FILENAME)) as f:
+            assert len(f.readlines()) == 2
+        # parsing again doesn't duplicate the books
+        summary = OfflineParser(output_dir, workers= 1, base_url= "https://books.toscrape.com/").parse_files([mirror])
+        assert summary['books'] == 0 and summary['skipped'] == 3
+    print("Test completed")
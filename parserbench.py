@@ -0,0 +1,270 @@
+"""
+openclassrooms Python - Project 2
+bookscraper package
+@author Christian Debray - christian.debray@gmail.com
+"""
+from collections.abc import Callable
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import datetime
+from bs4 import BeautifulSoup
+from bookdata import BookData
+from bookdatareader import BookDataReader
+from books_to_scrape_generators import BooksToScrapeGenerator
+from remotedatasource import RemoteDataSource
+import logging
+logger = logging.getLogger(__name__)
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "parser")
+FIXTURES_MANIFEST = "fixtures.json"
+
+PRODUCT = "product"
+INDEX = "index"
+
+# BookData filters called by the scraping generator, benchmarked per field
+FILTERS = [
+    "filter_title", "filter_universal_product_code", "filter_category", "filter_price",
+    "filter_number_available", "filter_review_rating"
+]
+
+class ParserBenchmark:
+    """
+    Micro-benchmarks of the parsing functions over a corpus of recorded product and index pages (fixtures).
+
+    Each benchmark runs a fixed number of iterations per fixture, repeated a few times; the best time per call is kept.
+    Results map benchmark names to {fixture name: seconds per call}, and can be saved as a baseline
+    to compare a parser backend, selector or filter change against numbers.
+
+    Usage:
+    ```
+     bench = ParserBenchmark()
+     results = bench.run()
+     print(ParserBenchmark.compare(results, ParserBenchmark.load_results("baseline.json")))
+    ```
+    """
+    def __init__(self, fixtures_dir: str = FIXTURES_DIR, scale: float = 1.0, repeat: int = 5):
+        """
+        scale -- multiplies the number of iterations of each benchmark
+        repeat -- number of timed runs of each benchmark and fixture, the best one is kept
+        """
+        self.fixtures_dir = fixtures_dir
+        self.scale = scale
+        self.repeat = repeat
+        self.generator = BooksToScrapeGenerator()
+        self.reader = BookDataReader(self.generator)
+        with open(os.path.join(fixtures_dir, FIXTURES_MANIFEST), encoding= "utf-8") as f:
+            # fixture file name -> {'kind': product | index, 'url': source url}
+            self.fixtures: dict[str, dict] = json.load(f)
+        self._html: dict[str, str] = {}
+        for name in self.fixtures:
+            with open(os.path.join(fixtures_dir, name), encoding= "utf-8") as f:
+                self._html[name] = f.read()
+
+    def benchmarks(self) -> dict[str, tuple[str, int, Callable[[str], Callable[[], object]]]]:
+        """
+        Lists the benchmarks: name -> (kind of fixtures, iterations, setup).
+        setup(fixture name) prepares the input (ex. the parsed page) and returns the function to time.
+        """
+        benchmarks = {
+            'soup_product': (PRODUCT, 50, lambda name: lambda: BeautifulSoup(self._html[name], 'html.parser')),
+            'soup_index': (INDEX, 50, lambda name: lambda: BeautifulSoup(self._html[name], 'html.parser')),
+            'read_from_html': (PRODUCT, 50, lambda name: lambda: self.reader.read_from_html(self._html[name], self.fixtures[name]['url'])),
+            'gen_book_data': (PRODUCT, 200, self._setup_gen_book_data),
+            'gen_product_urls_from_index': (INDEX, 200, self._setup_index(self.generator.gen_product_urls_from_index)),
+            'gen_listing_items_from_index': (INDEX, 100, self._setup_index(self.generator.gen_listing_items_from_index)),
+            'gen_category_info': (INDEX, 500, lambda name: (lambda soup: lambda: self.generator.gen_category_info(soup))(self._soup(name))),
+        }
+        for filter_name in FILTERS:
+            benchmarks[filter_name] = (PRODUCT, 5000, self._setup_filter(filter_name))
+        return benchmarks
+
+    def run(self, only: list[str] = None) -> dict:
+        """
+        Runs the benchmarks (all of them, or the names listed in only), returns the results.
+        """
+        results = {
+            'time': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'benchmarks': {}
+        }
+        for bench_name, (kind, iterations, setup) in self.benchmarks().items():
+            if only and bench_name not in only:
+                continue
+            iterations = max(1, int(iterations * self.scale))
+            timings = {}
+            for name, fixture in self.fixtures.items():
+                if fixture['kind'] != kind:
+                    continue
+                func = setup(name)
+                if func is None:
+                    # ex. no field of the page goes through this filter
+                    continue
+                timings[name] = min(self._time(func, iterations) for _ in range(self.repeat))
+                logger.debug(f"{bench_name} {name}: {timings[name] * 1e6:.1f}µs")
+            results['benchmarks'][bench_name] = timings
+        return results
+
+    @staticmethod
+    def compare(results: dict, baseline: dict, threshold: float = 0.1) -> tuple[str, list[str]]:
+        """
+        Compares results with a baseline, per benchmark (mean time per call over the fixtures).
+        Returns a report and the list of the benchmarks slower than the baseline by more than threshold (ex. 0.1 = 10%).
+        """
+        lines = [f"{'benchmark':<32}{'baseline':>12}{'current':>12}{'change':>9}"]
+        regressions = []
+        for bench_name, timings in results['benchmarks'].items():
+            current = ParserBenchmark.mean(timings)
+            before = ParserBenchmark.mean(baseline['benchmarks'].get(bench_name, {}))
+            if not before:
+                lines.append(f"{bench_name:<32}{'-':>12}{current * 1e6:>10.1f}µs{'new':>9}")
+                continue
+            change = current / before - 1
+            flag = ''
+            if change > threshold:
+                regressions.append(bench_name)
+                flag = ' !'
+            lines.append(f"{bench_name:<32}{before * 1e6:>10.1f}µs{current * 1e6:>10.1f}µs{change:>+9.1%}{flag}")
+        return "\n".join(lines), regressions
+
+    @staticmethod
+    def summary(results: dict) -> str:
+        lines = [f"{'benchmark':<32}{'fixtures':>9}{'mean':>12}{'min':>12}{'max':>12}"]
+        for bench_name, timings in results['benchmarks'].items():
+            if timings:
+                lines.append(
+                    f"{bench_name:<32}{len(timings):>9}{ParserBenchmark.mean(timings) * 1e6:>10.1f}µs"
+                    f"{min(timings.values()) * 1e6:>10.1f}µs{max(timings.values()) * 1e6:>10.1f}µs")
+        return "\n".join(lines)
+
+    @staticmethod
+    def mean(timings: dict[str, float]) -> float:
+        return sum(timings.values()) / len(timings) if timings else 0.0
+
+    @staticmethod
+    def save_results(results: dict, filename: str):
+        with open(filename, "w", encoding= "utf-8") as f:
+            json.dump(results, f, indent= 2)
+
+    @staticmethod
+    def load_results(filename: str) -> dict:
+        with open(filename, encoding= "utf-8") as f:
+            return json.load(f)
+
+    def _time(self, func: Callable[[], object], iterations: int) -> float:
+        start = time.perf_counter()
+        for _ in range(iterations):
+            func()
+        return (time.perf_counter() - start) / iterations
+
+    def _soup(self, name: str) -> BeautifulSoup:
+        return BeautifulSoup(self._html[name], 'html.parser')
+
+    def _setup_gen_book_data(self, name: str) -> Callable[[], object]:
+        soup = self._soup(name)
+        url = self.fixtures[name]['url']
+        return lambda: self.generator.gen_book_data(soup, url)
+
+    def _setup_index(self, gen_func: Callable) -> Callable[[str], Callable[[], object]]:
+        def setup(name: str) -> Callable[[], object]:
+            soup = self._soup(name)
+            url = self.fixtures[name]['url']
+            return lambda: gen_func(soup, url)
+        return setup
+
+    def _setup_filter(self, filter_name: str) -> Callable[[str], Callable[[], object]]:
+        """
+        Times a filter on the values the scraping generator passes to it for a page (one or more fields).
+        """
+        def setup(name: str) -> Callable[[], object] | None:
+            inputs = self._filter_inputs(name).get(filter_name)
+            if not inputs:
+                return None
+            filter_func = getattr(BookData, filter_name)
+            def run_filter():
+                for args, kwargs in inputs:
+                    filter_func(*args, **kwargs)
+            return run_filter
+        return setup
+
+    def _filter_inputs(self, name: str) -> dict[str, list[tuple[tuple, dict]]]:
+        """
+        Records the calls to the BookData filters while reading a product page: filter name -> [(args, kwargs), ...]
+        """
+        inputs = {}
+        originals = {filter_name: BookData.__dict__[filter_name] for filter_name in FILTERS}
+        def recorder(filter_name: str, original: classmethod):
+            def record(cls, *args, **kwargs):
+                inputs.setdefault(filter_name, []).append((args, kwargs))
+                return original.__func__(cls, *args, **kwargs)
+            return classmethod(record)
+        try:
+            for filter_name, original in originals.items():
+                setattr(BookData, filter_name, recorder(filter_name, original))
+            self.generator.gen_book_data(self._soup(name), self.fixtures[name]['url'])
+        finally:
+            for filter_name, original in originals.items():
+                setattr(BookData, filter_name, original)
+        return inputs
+
+
+def record_fixtures(urls: list[str], fixtures_dir: str = FIXTURES_DIR) -> dict:
+    """
+    Fetches pages and saves them as fixtures: product pages (the scraping generator reads a book from them) or index pages.
+    Updates and returns the fixtures manifest.
+    """
+    manifest_file = os.path.join(fixtures_dir, FIXTURES_MANIFEST)
+    fixtures = {}
+    if os.path.exists(manifest_file):
+        with open(manifest_file, encoding= "utf-8") as f:
+            fixtures = json.load(f)
+    elif not os.path.exists(fixtures_dir):
+        os.makedirs(fixtures_dir, mode = 0o777)
+    generator = BooksToScrapeGenerator()
+    data_src = RemoteDataSource()
+    for url in urls:
+        html = data_src.read_text(url)
+        kind = PRODUCT if generator.gen_book_data(BeautifulSoup(html, 'html.parser'), url) else INDEX
+        name = f"{kind}_{sum(1 for f in fixtures.values() if f['kind'] == kind) + 1}.html"
+        with open(os.path.join(fixtures_dir, name), "w", encoding= "utf-8") as f:
+            f.write(html)
+        fixtures[name] = {'kind': kind, 'url': url}
+        logger.info(f"Recorded {kind} page {url} to {name}")
+    with open(manifest_file, "w", encoding= "utf-8") as f:
+        json.dump(fixtures, f, indent= 2)
+    return fixtures
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog="parserbench",
+        description="Micro-benchmarks of the page parsing functions over the recorded pages found in fixtures/parser.",
+        formatter_class=argparse.RawTextHelpFormatter
+    )
+    parser.add_argument("benchmarks", nargs="*", default=[], help="names of the benchmarks to run (defaults to all)")
+    parser.add_argument("--fixtures", default= FIXTURES_DIR, help="fixtures directory (defaults to fixtures/parser)")
+    parser.add_argument("--scale", type= float, default= 1.0, help="multiply the number of iterations of each benchmark")
+    parser.add_argument("--repeat", type= int, default= 5, help="timed runs of each benchmark, the best one is kept (defaults to 5)")
+    parser.add_argument("--save", default=None, help="save the results to this JSON file (ex. as a baseline)")
+    parser.add_argument("--baseline", default=None, help="compare the results with a baseline JSON file; exits with status 1 on regressions")
+    parser.add_argument("--threshold", type= float, default= 0.1, help="slowdown reported as a regression (defaults to 0.1: 10%%)")
+    parser.add_argument("--record", nargs="+", default=None, metavar="URL", help="record pages as fixtures instead of running the benchmarks")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    if args.record:
+        record_fixtures(args.record, args.fixtures)
+        sys.exit()
+    bench = ParserBenchmark(args.fixtures, scale= args.scale, repeat= args.repeat)
+    results = bench.run(only= args.benchmarks)
+    print(ParserBenchmark.summary(results))
+    if args.save:
+        ParserBenchmark.save_results(results, args.save)
+    if args.baseline:
+        report, regressions = ParserBenchmark.compare(results, ParserBenchmark.load_results(args.baseline), args.threshold)
+        print(report)
+        if regressions:
+            print(f"Regressions: {', '.join(regressions)}")
+            sys.exit(1)
@@ -0,0 +1,151 @@
+"""
+openclassrooms Python - Project 2
+bookscraper package
+@author Christian Debray - christian.debray@gmail.com
+"""
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import tracemalloc
+import logging
+logger = logging.getLogger(__name__)
+
+class RunProfiler:
+    """
+    Profiles a scraping run, to diagnose performance regressions from a production run without external tools.
+
+    - cpu profile: the run is profiled with cProfile, including the threads started during the run
+      (scraping and image workers, each thread has its own profiler, merged at the end).
+      The stats are saved to a .pstats file (see the pstats module, or snakeviz) and the top N functions are summarized.
+    - memory profile: tracemalloc snapshots are taken at the start and at the end of the run,
+      the memory growth is summarized by allocation site (ex. parsed pages retained by the category indexes).
+
+    Usage:
+    ```
+     with RunProfiler(pstats_file= "scrape.pstats", memory_file= "scrape_memory.txt") as profiler:
+        scraper.scrape_all_categories(url)
+     print(profiler.summary())
+    ```
+    """
+    def __init__(self, pstats_file: str = None, memory_file: str = None, top: int = 25, sort: str = "cumulative"):
+        """
+        pstats_file -- profile the cpu time, save the stats to this file
+        memory_file -- profile the memory growth, save the top allocation sites to this text file
+        top -- number of functions / allocation sites in the summaries
+        sort -- sort key of the functions summary (see pstats.Stats.sort_stats)
+        """
+        self.pstats_file = pstats_file
+        self.memory_file = memory_file
+        self.top = top
+        self.sort = sort
+        self._lock = threading.Lock()
+        self._profiles: list[cProfile.Profile] = []
+        self._start_snapshot: tracemalloc.Snapshot = None
+        self._started_tracemalloc = False
+        self._cpu_summary = ''
+        self._memory_summary = ''
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def start(self):
+        if self.memory_file:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._started_tracemalloc = True
+            self._start_snapshot = tracemalloc.take_snapshot()
+        if self.pstats_file:
+            # threads started from now on enable their own profiler on their first call
+            threading.setprofile(self._profile_thread)
+            self._profile_thread()
+
+    def stop(self):
+        """
+        Stops profiling, writes the output files and the summaries.
+        """
+        # the memory snapshot first, before processing the cpu stats
+        end_snapshot = tracemalloc.take_snapshot() if self.memory_file and self._start_snapshot is not None else None
+        if self.pstats_file and self._profiles:
+            threading.setprofile(None)
+            with self._lock:
+                profiles, self._profiles = self._profiles, []
+            for profile in profiles:
+                # disable() only stops the profiler of the current thread, the others have finished
+                profile.disable()
+            stats = pstats.Stats(profiles[0])
+            for profile in profiles[1:]:
+                stats.add(profile)
+            self._makedirs(self.pstats_file)
+            stats.dump_stats(self.pstats_file)
+            logger.info(f"Wrote cpu profile ({len(profiles)} threads) to {self.pstats_file}")
+            out = io.StringIO()
+            stats.stream = out
+            stats.sort_stats(self.sort).print_stats(self.top)
+            self._cpu_summary = out.getvalue()
+        if end_snapshot is not None:
+            if self._started_tracemalloc:
+                tracemalloc.stop()
+            filters = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, cProfile.__file__)]
+            diff = end_snapshot.filter_traces(filters).compare_to(self._start_snapshot.filter_traces(filters), "lineno")
+            self._start_snapshot = None
+            growth = sum(stat.size_diff for stat in diff)
+            lines = [f"Memory growth: {growth / 1024:.1f} KiB, top {self.top} allocation sites:"]
+            lines += [str(stat) for stat in diff[:self.top]]
+            self._memory_summary = "\n".join(lines)
+            self._makedirs(self.memory_file)
+            with open(self.memory_file, "w", encoding= "utf-8") as f:
+                f.write(self._memory_summary + "\n")
+            logger.info(f"Wrote memory profile to {self.memory_file}")
+
+    def summary(self) -> str:
+        """
+        Returns the top functions (cumulated time) and the top memory allocation sites of the run.
+        """
+        return "\n".join(s for s in [self._cpu_summary, self._memory_summary] if s)
+
+    def _profile_thread(self, *args):
+        """
+        Enables a profiler in the current thread. Used as the threading profile hook: called on the first event of a new thread.
+        """
+        sys.setprofile(None)
+        profile = cProfile.Profile()
+        with self._lock:
+            self._profiles.append(profile)
+        profile.enable()
+
+    def _makedirs(self, filename: str):
+        path = os.path.dirname(filename)
+        if path and not os.path.exists(path):
+            os.makedirs(path, mode = 0o777)
+
+if __name__ == "__main__":
+    import tempfile
+    def busy_worker(n: int):
+        return sum(i * i for i in range(n))
+    retained = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        profiler = RunProfiler(os.path.join(tmp_dir, "run.pstats"), os.path.join(tmp_dir, "memory.txt"), top= 5)
+        with profiler:
+            threads = [threading.Thread(target= busy_worker, args= (200_000,)) for _ in range(3)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            busy_worker(10_000)
+            retained.append([str(i) for i in range(100_000)])
+        stats = pstats.Stats(profiler.pstats_file)
+        calls = [(stat[0], func) for func, stat in stats.stats.items() if func[2] == "busy_worker"]
+        # the main thread and the 3 worker threads
+        assert calls and calls[0][0] == 4, calls
+        with open(profiler.memory_file) as f:
+            memory_report = f.read()
+        assert "profiling.py" in memory_report.splitlines()[1], memory_report
+        print(profiler.summary())
+    print("Test completed")
@@ -4,10 +4,17 @@ bookscraper package
 @author Christian Debray - christian.debray@gmail.com
 """
 import requests
+import requests.adapters
+import urllib3
+import urllib3.connection
 import time
 import functools
 import logging
 import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from events import EventBus
+from resilience import HedgedRequests, CircuitBreaker, AdaptiveTimeouts
 logger = logging.getLogger(__name__)
 
 def max_attempts_decorator(max_attempts):
@@ -31,58 +38,235 @@ def max_attempts_decorator(max_attempts):
     return decorate_max_attempts
 
 
+class PooledHTTPAdapter(requests.adapters.HTTPAdapter):
+    """
+    HTTPAdapter counting the requests sent and the connections opened to send them (TCP connections and TLS handshakes),
+    see connection_stats().
+    """
+    def __init__(self, **kwargs):
+        self._stats_lock = threading.Lock()
+        self.stats = {'requests': 0, 'new_connections': 0, 'tls_handshakes': 0}
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        adapter = self
+        class CountingHTTPConnection(urllib3.connection.HTTPConnection):
+            def connect(self):
+                super().connect()
+                adapter._count('new_connections')
+        class CountingHTTPSConnection(urllib3.connection.HTTPSConnection):
+            def connect(self):
+                super().connect()
+                adapter._count('new_connections', 'tls_handshakes')
+        class CountingHTTPConnectionPool(urllib3.HTTPConnectionPool):
+            ConnectionCls = CountingHTTPConnection
+        class CountingHTTPSConnectionPool(urllib3.HTTPSConnectionPool):
+            ConnectionCls = CountingHTTPSConnection
+        self.poolmanager.pool_classes_by_scheme = {'http': CountingHTTPConnectionPool, 'https': CountingHTTPSConnectionPool}
+
+    def send(self, request, **kwargs):
+        self._count('requests')
+        return super().send(request, **kwargs)
+
+    def _count(self, *counters: str):
+        with self._stats_lock:
+            for counter in counters:
+                self.stats[counter] += 1
+
+
+def create_session(pool_size: int = 10, keep_alive: bool = True) -> requests.Session:
+    """
+    Returns a session to share between threads, keeping up to pool_size connections open per host.
+    keep_alive -- keep the connections open between requests (HTTP keep-alive), otherwise each request opens a new connection
+    """
+    session = requests.Session()
+    adapter = PooledHTTPAdapter(pool_maxsize= max(1, pool_size))
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    if not keep_alive:
+        session.headers['Connection'] = "close"
+    return session
+
+def connection_stats(session: requests.Session) -> dict[str, int]:
+    """
+    Counts the requests sent by a session and the connections opened to send them:
+    {'requests', 'new_connections', 'reused_connections', 'tls_handshakes' (new https connections)}
+    Only the requests sent through a PooledHTTPAdapter are counted (see create_session()).
+    """
+    stats = {'requests': 0, 'new_connections': 0, 'reused_connections': 0, 'tls_handshakes': 0}
+    adapters = {id(adapter): adapter for adapter in session.adapters.values() if isinstance(adapter, PooledHTTPAdapter)}
+    for adapter in adapters.values():
+        with adapter._stats_lock:
+            for counter, n in adapter.stats.items():
+                stats[counter] += n
+    stats['reused_connections'] = max(0, stats['requests'] - stats['new_connections'])
+    return stats
+
+def warmup_connections(session: requests.Session, url: str, connections: int, timeout = (3.05, 6.05)) -> int:
+    """
+    Opens connections to the host of url ahead of the crawl (TCP and TLS handshakes), with simultaneous HEAD requests,
+    and leaves them in the pool of the session. Connections beyond the pool size are closed right away.
+    Returns the number of connections opened.
+    """
+    if connections < 1:
+        return 0
+    opened = connection_stats(session)['new_connections']
+    # the requests wait for each other, and hold their connection (streamed response) until all of them got one,
+    # so that none of them re-uses the connection of another
+    barrier = threading.Barrier(connections)
+    def head():
+        try:
+            barrier.wait(timeout= timeout[0])
+        except threading.BrokenBarrierError:
+            pass
+        response = session.head(url, timeout= timeout, stream= True)
+        try:
+            barrier.wait(timeout= timeout[1])
+        except threading.BrokenBarrierError:
+            pass
+        finally:
+            # read the (empty) body: the connection goes back to the pool instead of being closed
+            response.content
+            response.close()
+    with ThreadPoolExecutor(max_workers= connections, thread_name_prefix= "warmup") as executor:
+        futures = [executor.submit(head) for _ in range(connections)]
+    errors = [e for f in futures if (e := f.exception()) is not None]
+    if errors:
+        logger.warning(f"Connection warmup: {len(errors)} of {connections} requests to {url} failed ({type(errors[0]).__name__}: {errors[0]})")
+    opened = connection_stats(session)['new_connections'] - opened
+    logger.info(f"Connection warmup: opened {opened} connections to {url}")
+    return opened
+
+
 class RemoteDataSource:
     """
     wrap remote connection utility
     """
+    # classes of urls, with their own response times (see AdaptiveTimeouts)
+    INDEX = "index"
+    PRODUCT = "product"
+    IMAGE = "image"
 
-    def __init__(self, url: str = None, requests_delay: float = 0, timeout = (3.05, 6.05)):
+    def __init__(self, url: str = None, requests_delay: float = 0, timeout = (3.05, 6.05), events: EventBus = None, session: requests.Session = None,
+                 hedging: HedgedRequests = None, circuit_breaker: CircuitBreaker = None, timeouts: AdaptiveTimeouts = None):
+        """
+        events -- optionally publish a request_start and a request_end event for each request (see EventBus)
+        session -- share a session (and its connection pool) with other data sources, defaults to a new session
+        hedging -- optionally send a duplicate of the slowest requests and take the first response (see resilience.py)
+        circuit_breaker -- optionally stop sending requests to a host after consecutive failures (see resilience.py)
+        timeouts -- optionally derive the timeouts of each class of url from its response times, instead of timeout (see resilience.py)
+        """
         self.url:str
         self.response: requests.Response
-        self.session: requests.Session = requests.session()
+        self.session: requests.Session = session or requests.session()
         self.requests_delay: float = requests_delay
         self._timeout = timeout
+        self.events: EventBus = events
+        self.hedging: HedgedRequests = hedging
+        self.circuit_breaker: CircuitBreaker = circuit_breaker
+        self.timeouts: AdaptiveTimeouts = timeouts
+        # failed attempts to fetch the last url, reported as retries when fetching it again
+        self._failed_url: str = None
+        self._failed_attempts: int = 0
         if url:
             self.set_source(url)
 
-    def set_source(self, url: str) -> requests.Response:
+    def set_source(self, url: str, url_class: str = None) -> requests.Response:
         """
         Connects to a remote data source and stores the response.
+        url_class -- INDEX, PRODUCT or IMAGE, to use the timeouts of the class with adaptive timeouts
         raises an HTTPError if connection error occured.
         """
         if self.requests_delay > 0:
             time.sleep(self.requests_delay)
         self.url = url
-        self.response = self.session.get(self.url, timeout= self._timeout)
+        retry = self._failed_attempts if url == self._failed_url else 0
+        if self.events is None:
+            self.response = self._get(self.url, url_class)
+        else:
+            self.response = self._get_with_events(url, retry, url_class)
         self.final_url = self.response.url
         if self.response.status_code != requests.codes.ok:
+            self._failed_url, self._failed_attempts = url, retry + 1
             self.response.raise_for_status()
+        self._failed_url, self._failed_attempts = None, 0
         return self.response
 
+    def _get_with_events(self, url: str, retry: int, url_class: str = None) -> requests.Response:
+        """
+        Sends a GET request, publishes the request_start and request_end events.
+        """
+        self.events.emit(EventBus.REQUEST_START, url= url, retry= retry)
+        start = time.perf_counter()
+        try:
+            response = self._get(url, url_class)
+        except Exception as e:
+            self._failed_url, self._failed_attempts = url, retry + 1
+            self.events.emit(
+                EventBus.REQUEST_END,
+                url= url, status= None, bytes= 0, elapsed= time.perf_counter() - start,
+                cache_hit= False, retry= retry, error= f"{type(e).__name__}: {e}")
+            raise
+        self.events.emit(
+            EventBus.REQUEST_END,
+            url= url, status= response.status_code, bytes= len(response.content), elapsed= time.perf_counter() - start,
+            # set by caching sessions (ex. requests-cache)
+            cache_hit= bool(getattr(response, 'from_cache', False)), retry= retry)
+        return response
+
+    def _get(self, url: str, url_class: str = None) -> requests.Response:
+        """
+        Sends a GET request, through the circuit breaker, hedged and with adaptive timeouts if set.
+        Raises a CircuitOpenError if the circuit of the url's host is open.
+        """
+        if self.circuit_breaker is not None:
+            self.circuit_breaker.before_request(url)
+        adaptive = self.timeouts is not None and url_class is not None
+        timeout = self.timeouts.timeout(url_class) if adaptive else self._timeout
+        start = time.perf_counter()
+        try:
+            if self.hedging is not None:
+                response = self.hedging.get(self.session, url, timeout, url_class)
+            else:
+                response = self.session.get(url, timeout= timeout)
+        except Exception as e:
+            if self.circuit_breaker is not None:
+                self.circuit_breaker.record(url, failure= CircuitBreaker.is_failure(error= e))
+            if adaptive and isinstance(e, requests.Timeout):
+                logger.debug(f"{url_class} request to {url} timed out after {timeout[1]:.2f}s")
+                self.timeouts.timed_out(url_class)
+            raise
+        if self.circuit_breaker is not None:
+            self.circuit_breaker.record(url, failure= CircuitBreaker.is_failure(response= response))
+        if adaptive and response.status_code == requests.codes.ok:
+            self.timeouts.observe(url_class, time.perf_counter() - start)
+        return response
+
     def source_url(self) -> str:
         """
         Returns the URL of the current data source
         """
         return self.response.url if self.response else None
 
-    def read_text(self, url: str = None) -> str:
+    def read_text(self, url: str = None, url_class: str = None) -> str:
         """
         Reads text content from a source URL.
         Returns the content as a string.
         """
         if url:
-            self.set_source(url)
+            self.set_source(url, url_class)
         #
         # TODO: handle encoding
         #
         return self.response.text
 
-    def fetch_binary(self, url: str = None) -> bytes:
+    def fetch_binary(self, url: str = None, url_class: str = IMAGE) -> bytes:
         """
         fetches binary content
         """
         if url:
-            self.set_source(url)
+            self.set_source(url, url_class)
         return self.response.content
 
     def mime_type(self) -> tuple[str, str]:
@@ -96,26 +280,70 @@ class RemoteDataSource:
         return None
 
 if __name__ == "__main__":
-    ds = RemoteDataSource('https://books.toscrape.com/catalogue/a-light-in-the-attic_1000/index.html')
-    assert(isinstance(ds.response, requests.Response))
-    assert(ds.response.status_code == requests.codes.ok)
-    content = ds.read_text()
-    assert(len(content) > 0)
-    print("extracted {0} characters. First 100:\n{1}\n{2}".format(len(content), content[:100], '(...)' if len(content) > 100 else ''))
-
-    print(ds.mime_type())
-
-    ds.set_source("https://books.toscrape.com/media/cache/fe/72/fe72f0532301ec28892ae79a629a293c.jpg")
-    print(ds.mime_type())
-
-    err: Exception = None
-    try:
-        ds.set_source('https://books.toscrape.com/not/found/foo/bar')
-    except requests.HTTPError as e:
-        err = e
-        print("Request failed (HTTP error): ", err)
-    except Exception as e:
-        err = e
-        print("Request failed: ", err)
-    assert(err is not None)
+    from mockserver import MockBooksServer
+    with MockBooksServer() as server:
+        ds = RemoteDataSource(server.base_url + 'catalogue/book-1_1/index.html')
+        assert(isinstance(ds.response, requests.Response))
+        assert(ds.response.status_code == requests.codes.ok)
+        content = ds.read_text()
+        assert(len(content) > 0)
+        print("extracted {0} characters. First 100:\n{1}\n{2}".format(len(content), content[:100], '(...)' if len(content) > 100 else ''))
+
+        print(ds.mime_type())
+        assert(ds.mime_type() == ('text', 'html'))
+
+        ds.set_source(server.base_url + "media/cache/1.jpg")
+        print(ds.mime_type())
+        assert(ds.mime_type() == ('image', 'jpeg'))
+
+        err: Exception = None
+        try:
+            ds.set_source(server.base_url + 'not/found/foo/bar')
+        except requests.HTTPError as e:
+            err = e
+            print("Request failed (HTTP error): ", err)
+        except Exception as e:
+            err = e
+            print("Request failed: ", err)
+        assert(err is not None)
+
+        # request events: the failed url is reported as a retry when fetched again
+        events = EventBus()
+        received = []
+        events.subscribe(received.append, [EventBus.REQUEST_END])
+        ds = RemoteDataSource(events= events)
+        for url in ['catalogue/book-1_1/index.html', 'not/found', 'not/found']:
+            try:
+                ds.set_source(server.base_url + url)
+            except requests.HTTPError:
+                pass
+        assert [(e['status'], e['retry']) for e in received] == [(200, 0), (404, 0), (404, 1)], received
+
+    # circuit breaker: stop sending requests to a failing host
+    with MockBooksServer(error_rate= 1.0, error_kinds= ["503"]) as server:
+        ds = RemoteDataSource(circuit_breaker= CircuitBreaker(failure_threshold= 2, recovery_time= 60))
+        errors = []
+        for _ in range(4):
+            try:
+                ds.set_source(server.base_url + 'index.html')
+            except requests.RequestException as e:
+                errors.append(type(e).__name__)
+        assert errors == ['HTTPError', 'HTTPError', 'CircuitOpenError', 'CircuitOpenError'], errors
+        assert server.requests_count == 2
 
+    # connection pool: warm connections are re-used
+    with MockBooksServer() as server:
+        session = create_session(pool_size= 4)
+        assert warmup_connections(session, server.base_url + 'index.html', 4) == 4
+        ds = RemoteDataSource(session= session)
+        for _ in range(8):
+            ds.set_source(server.base_url + 'index.html')
+        stats = connection_stats(session)
+        print(stats)
+        assert stats == {'requests': 12, 'new_connections': 4, 'reused_connections': 8, 'tls_handshakes': 0}, stats
+        session = create_session(keep_alive= False)
+        ds = RemoteDataSource(session= session)
+        for _ in range(3):
+            ds.set_source(server.base_url + 'index.html')
+        assert connection_stats(session)['new_connections'] == 3
+    print("Test completed")
@@ -0,0 +1,358 @@
+"""
+openclassrooms Python - Project 2
+bookscraper package
+@author Christian Debray - christian.debray@gmail.com
+"""
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
+import math
+import threading
+import time
+import urllib.parse
+import requests
+from metrics import Metrics
+import logging
+logger = logging.getLogger(__name__)
+
+class CircuitOpenError(requests.ConnectionError):
+    """
+    Raised instead of sending a request to a host whose circuit is open (see CircuitBreaker).
+    A subclass of ConnectionError, handled as a connection failure by the scraper.
+    """
+    pass
+
+
+class LatencyTracker:
+    """
+    Thread safe record of the latest response times, per key (ex. per host), to compute percentiles.
+    Only the last window responses of each key are kept, so that the percentiles follow the host's current state.
+    """
+    def __init__(self, window: int = 200):
+        self.window = window
+        self._lock = threading.Lock()
+        self._samples: dict[str, deque[float]] = {}
+
+    def observe(self, key: str, seconds: float):
+        with self._lock:
+            if (samples := self._samples.get(key)) is None:
+                samples = self._samples[key] = deque(maxlen= self.window)
+            samples.append(seconds)
+
+    def percentile(self, key: str, p: float, min_samples: int = 1) -> float | None:
+        """
+        Returns the p-th percentile (nearest rank) of the response times of a key,
+        or None if less than min_samples responses were observed.
+        """
+        with self._lock:
+            samples = sorted(self._samples.get(key, ()))
+        if not samples or len(samples) < min_samples:
+            return None
+        return samples[min(len(samples) - 1, max(0, math.ceil(p / 100 * len(samples)) - 1))]
+
+    def count(self, key: str) -> int:
+        with self._lock:
+            return len(self._samples.get(key, ()))
+
+    def keys(self) -> list[str]:
+        with self._lock:
+            return sorted(self._samples)
+
+
+class HedgedRequests:
+    """
+    Hedged requests, against tail latency: once the usual response time of a host is known, a request
+    still waiting for its response after the p-th percentile of the host's response times (p95 by default)
+    is sent again, and the first response wins. The slower request is left to finish in the background.
+
+    Only a few percent of the requests are hedged, so that the extra load on the host stays low.
+    Shared by the data sources of all the scraper threads (see RemoteDataSource).
+    """
+    def __init__(self, percentile: float = 95.0, min_samples: int = 20, max_workers: int = 16, metrics: Metrics = None):
+        """
+        percentile -- hedge the requests slower than this percentile of the host's response times
+        min_samples -- responses to observe from a host before hedging its requests
+        max_workers -- threads sending the hedged requests and their duplicates
+        metrics -- count the hedged requests ("requests_hedged") and the duplicates answering first ("hedges_won")
+        """
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.latencies = LatencyTracker()
+        self.max_workers = max_workers
+        self.metrics = metrics or Metrics()
+        # started on the first hedged request, see close()
+        self._executor: ThreadPoolExecutor = None
+        self._lock = threading.Lock()
+
+    def hedge_delay(self, host: str) -> float | None:
+        """
+        Returns the time to wait for a response before sending a duplicate request, None if not known yet.
+        """
+        return self.latencies.percentile(host, self.percentile, self.min_samples)
+
+    def get(self, session: requests.Session, url: str, timeout, url_class: str = None) -> requests.Response:
+        """
+        Sends a GET request, hedged if the host's response times are known.
+        url_class -- kind of resource (ex. "image"), to track its response times apart from the other requests to the host
+        Raises the exception of the last request to fail if none succeeds.
+        """
+        host = urllib.parse.urlsplit(url).netloc
+        if url_class:
+            host = f"{host} {url_class}"
+        if (delay := self.hedge_delay(host)) is None:
+            response, elapsed = self._timed_get(session, url, timeout)
+            self.latencies.observe(host, elapsed)
+            return response
+        executor = self._get_executor()
+        primary = executor.submit(self._timed_get, session, url, timeout)
+        done, _ = wait([primary], timeout= delay)
+        if done:
+            winner = primary
+        else:
+            self.metrics.count("requests_hedged")
+            hedge = executor.submit(self._timed_get, session, url, timeout)
+            winner = self._first_success([primary, hedge])
+            if winner is hedge and winner.exception() is None:
+                self.metrics.count("hedges_won")
+            logger.debug(f"Hedged request to {url} after {delay * 1000:.0f}ms, {'duplicate' if winner is hedge else 'first request'} answered first")
+        response, elapsed = winner.result()
+        self.latencies.observe(host, elapsed)
+        return response
+
+    def close(self):
+        """
+        Stops the threads sending the hedged requests, without waiting for the slower duplicates.
+        The latencies are kept: the next hedged request starts new threads.
+        """
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait= False, cancel_futures= True)
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers= self.max_workers, thread_name_prefix= "hedge")
+            return self._executor
+
+    @staticmethod
+    def _first_success(futures: list[Future]) -> Future:
+        """
+        Waits for the first request to succeed. If all fail, returns the last one to fail.
+        """
+        pending = set(futures)
+        while True:
+            done, pending = wait(pending, return_when= FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None or not pending:
+                    return future
+
+    @staticmethod
+    def _timed_get(session: requests.Session, url: str, timeout) -> tuple[requests.Response, float]:
+        start = time.perf_counter()
+        response = session.get(url, timeout= timeout)
+        return response, time.perf_counter() - start
+
+
+class AdaptiveTimeouts:
+    """
+    Read timeouts derived from the observed response times, per class of url (ex. index pages, product pages, images):
+    multiplier times the percentile of the class's recent response times (p99 by default), within floor and ceiling.
+    The default timeout applies until min_samples responses of the class were observed. The connect timeout doesn't change.
+
+    A fast host gets short timeouts, so that hung connections are cut quickly. When a request times out anyway,
+    the timeout of its class is doubled (up to the ceiling), then goes back down with each response,
+    so that a host slowing down doesn't make the requests fail before its new response times are observed.
+
+    Shared by the data sources of all the scraper threads (see RemoteDataSource).
+    """
+    def __init__(self, default: tuple[float, float] = (3.05, 7.0), floor: float = 1.0, ceiling: float = 30.0,
+                 percentile: float = 99.0, multiplier: float = 3.0, min_samples: int = 20):
+        """
+        default -- (connect, read) timeout until the response times of a class are known
+        floor, ceiling -- bounds of the read timeouts, in seconds
+        """
+        self.default = default
+        self.floor = floor
+        self.ceiling = max(floor, ceiling)
+        self.percentile = percentile
+        self.multiplier = multiplier
+        self.min_samples = min_samples
+        self.latencies = LatencyTracker()
+        self._lock = threading.Lock()
+        # class -> factor applied to the read timeout after timeouts
+        self._backoff: dict[str, float] = {}
+
+    def timeout(self, url_class: str) -> tuple[float, float]:
+        """
+        Returns the (connect, read) timeout of a class of url.
+        """
+        connect, read = self.default
+        if (p := self.latencies.percentile(url_class, self.percentile, self.min_samples)) is not None:
+            read = min(max(p * self.multiplier, self.floor), self.ceiling)
+        with self._lock:
+            backoff = self._backoff.get(url_class, 1.0)
+        return connect, min(read * backoff, max(read, self.ceiling))
+
+    def observe(self, url_class: str, seconds: float):
+        """
+        Records the response time of a request.
+        """
+        self.latencies.observe(url_class, seconds)
+        with self._lock:
+            if url_class in self._backoff:
+                self._backoff[url_class] *= 0.8
+                if self._backoff[url_class] <= 1.0:
+                    del self._backoff[url_class]
+
+    def timed_out(self, url_class: str):
+        """
+        Records a request that timed out.
+        """
+        with self._lock:
+            self._backoff[url_class] = min(self._backoff.get(url_class, 1.0) * 2, self.ceiling / self.floor)
+
+    def summary(self) -> dict[str, dict]:
+        """
+        Returns the current read timeout of each class observed: {class: {'samples', 'read_timeout'}}
+        """
+        return {c: {'samples': self.latencies.count(c), 'read_timeout': round(self.timeout(c)[1], 3)} for c in self.latencies.keys()}
+
+
+class CircuitBreaker:
+    """
+    Per host circuit breaker: after failure_threshold consecutive failures (connection errors, timeouts,
+    server errors and 429 Too Many Requests), the circuit of the host opens and its requests fail right away
+    (CircuitOpenError) instead of loading a struggling host.
+    After recovery_time seconds, a single probe request is let through (half-open): the circuit closes if it succeeds,
+    otherwise it opens again, for twice as long (up to max_recovery_time).
+
+    Shared by the data sources of all the scraper threads (see RemoteDataSource).
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, recovery_time: float = 30.0, max_recovery_time: float = 300.0, metrics: Metrics = None):
+        """
+        metrics -- count the circuit openings ("circuit_opened") and the requests rejected while open ("circuit_rejected")
+        """
+        self.failure_threshold = max(1, failure_threshold)
+        self.recovery_time = recovery_time
+        self.max_recovery_time = max_recovery_time
+        self.metrics = metrics or Metrics()
+        self._lock = threading.Lock()
+        # host -> {'state', 'failures' (consecutive), 'opened_at', 'recovery_time'}
+        self._hosts: dict[str, dict] = {}
+
+    @staticmethod
+    def is_failure(response: requests.Response = None, error: Exception = None) -> bool:
+        """
+        Returns True if a response (or the exception raised instead) means the host is struggling.
+        """
+        if error is not None:
+            return isinstance(error, (requests.ConnectionError, requests.Timeout)) and not isinstance(error, CircuitOpenError)
+        return response.status_code >= 500 or response.status_code == 429
+
+    def before_request(self, url: str):
+        """
+        Raises a CircuitOpenError if the circuit of the url's host is open.
+        """
+        host = urllib.parse.urlsplit(url).netloc
+        with self._lock:
+            circuit = self._hosts.get(host)
+            if circuit is None or circuit['state'] == self.CLOSED:
+                return
+            if circuit['state'] == self.OPEN and time.monotonic() - circuit['opened_at'] >= circuit['recovery_time']:
+                # let a probe request through
+                circuit['state'] = self.HALF_OPEN
+                logger.info(f"Circuit of {host} half-open: probe the host")
+                return
+        self.metrics.count("circuit_rejected")
+        raise CircuitOpenError(f"Circuit open for host {host}: request to {url} not sent")
+
+    def record(self, url: str, failure: bool):
+        """
+        Records the outcome of a request.
+        """
+        host = urllib.parse.urlsplit(url).netloc
+        with self._lock:
+            circuit = self._hosts.setdefault(host, {'state': self.CLOSED, 'failures': 0, 'opened_at': 0.0, 'recovery_time': self.recovery_time})
+            if not failure:
+                if circuit['state'] != self.CLOSED:
+                    logger.info(f"Circuit of {host} closed: the host answers again")
+                circuit.update(state= self.CLOSED, failures= 0, recovery_time= self.recovery_time)
+                return
+            circuit['failures'] += 1
+            if circuit['state'] == self.HALF_OPEN:
+                # the probe failed: wait longer
+                circuit.update(state= self.OPEN, opened_at= time.monotonic(), recovery_time= min(circuit['recovery_time'] * 2, self.max_recovery_time))
+            elif circuit['state'] == self.CLOSED and circuit['failures'] >= self.failure_threshold:
+                circuit.update(state= self.OPEN, opened_at= time.monotonic())
+            else:
+                return
+        self.metrics.count("circuit_opened")
+        logger.warning(f"Circuit of {host} open after {circuit['failures']} consecutive failures: no request for {circuit['recovery_time']:.1f}s")
+
+    def state(self, host: str) -> str:
+        with self._lock:
+            return self._hosts.get(host, {}).get('state', self.CLOSED)
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    from mockserver import MockBooksServer, MockCatalog
+    # hedging: a few very slow responses
+    with MockBooksServer(MockCatalog(categories= 1, books_per_category= 5), latency= 0.01, error_rate= 0.1, error_kinds= ["timeout"], hang_time= 1.0) as server:
+        hedging = HedgedRequests(min_samples= 10)
+        session = requests.Session()
+        start = time.perf_counter()
+        slowest = 0.0
+        for i in range(100):
+            request_start = time.perf_counter()
+            try:
+                hedging.get(session, server.base_url, timeout= (3.05, 7.0))
+            except requests.RequestException:
+                pass
+            slowest = max(slowest, time.perf_counter() - request_start)
+        report = hedging.metrics.report()['counters']
+        print(f"100 requests in {time.perf_counter() - start:.2f}s, slowest {slowest:.2f}s, {report}")
+        assert report.get('requests_hedged', 0) > 0 and report.get('hedges_won', 0) > 0
+        hedging.close()
+    # adaptive timeouts
+    timeouts = AdaptiveTimeouts(default= (3.05, 7.0), floor= 0.5, ceiling= 20.0, min_samples= 10)
+    assert timeouts.timeout("image") == (3.05, 7.0)
+    for i in range(100):
+        timeouts.observe("index", 0.05 + i / 10000)
+        timeouts.observe("image", 7.0 + i / 100)
+    assert timeouts.timeout("index") == (3.05, 0.5), timeouts.timeout("index")
+    assert timeouts.timeout("image")[1] == 20.0
+    timeouts.timed_out("index")
+    assert timeouts.timeout("index") == (3.05, 1.0)
+    timeouts.observe("index", 0.05)
+    assert timeouts.timeout("index")[1] == 0.8
+    for _ in range(3):
+        timeouts.observe("index", 0.05)
+    assert timeouts.timeout("index")[1] == 0.5
+    print(timeouts.summary())
+    # circuit breaker
+    breaker = CircuitBreaker(failure_threshold= 3, recovery_time= 0.2)
+    url = "https://books.toscrape.com/index.html"
+    for _ in range(3):
+        breaker.before_request(url)
+        breaker.record(url, failure= True)
+    assert breaker.state("books.toscrape.com") == CircuitBreaker.OPEN
+    try:
+        breaker.before_request(url)
+        assert False, "the circuit should be open"
+    except CircuitOpenError:
+        pass
+    time.sleep(0.25)
+    breaker.before_request(url)
+    assert breaker.state("books.toscrape.com") == CircuitBreaker.HALF_OPEN
+    breaker.record(url, failure= True)
+    assert breaker.state("books.toscrape.com") == CircuitBreaker.OPEN
+    time.sleep(0.45)
+    breaker.before_request(url)
+    breaker.record(url, failure= False)
+    assert breaker.state("books.toscrape.com") == CircuitBreaker.CLOSED
+    assert breaker.metrics.report()['counters'] == {'circuit_opened': 2, 'circuit_rejected': 1}
+    print("Test completed")
@@ -8,26 +8,41 @@ import urllib.parse
 import datetime
 import os
 import re
+import sys
 from collections.abc import Callable
 import functools
-from bookdatareader import BookDataReader
-from bookdatawriter import BookDataWriter
-from scraper import Scraper
-from books_to_scrape_generators import BooksToScrapeGenerator
+import contextlib
+# light modules only: the scraper, the parsers (bs4) and requests are imported on the code paths that need them,
+# so that --help and argument errors start fast (see importbudget.py)
+from bookdatawriter import WRITER_FORMATS, COMPRESSION_SUFFIXES, output_file_suffix
+from imagepipeline import IMAGE_MODES, IMAGES_INLINE
+import scrapetypes
+from urlsets import URL_SET_KINDS
+from changefeed import write_change_feed, list_output_files, DEFAULT_FIELDS
 import logging
 logger = logging.getLogger(__name__)
 
+METRICS_BASENAME = "scrape_metrics.json"
+
 def create_arg_parser() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser(
         prog="scrapbooks",
-        usage="scrapbooks [options] scrape_url",
+        usage="scrapbooks [options] scrape_url | --url-list FILE | --merge | --fetch-images",
         description="Scrap book catalog data found at the given URL.",
         formatter_class=argparse.RawTextHelpFormatter
     )
     parser.add_argument(
         "scrape_url",
+        nargs="?",
+        default="",
         help= "URL to scrape. May be a single product page or a category page, or the URL of the full catalog index."
         )
+    parser.add_argument(
+        "--url-list",
+        dest="url_list",
+        default="",
+        help="Scrape a list of URLs instead of scrape_url: path to a file listing product, category or catalog URLs,\none per line (empty lines and lines starting with # are skipped), or - to read the list from stdin.\nDuplicates are scraped once, each book is written to the output file of its category."
+        )
     parser.add_argument(
         "-o", "--output",
         required=False,
@@ -37,8 +52,15 @@ def create_arg_parser() -> argparse.ArgumentParser:
     parser.add_argument(
         "--file",
         "-f",
-        default="",
-        help="for debugging purposes: sets a local HTML file as input, handled as a single scraping. This setting will ignore all others and output the data to stdout."
+        action="extend",
+        nargs="+",
+        default=[],
+        help="Offline mode: parse saved product pages instead of scraping a URL. Accepts HTML files, directories (searched recursively)\nand glob patterns. The pages are parsed by a pool of processes (see --workers, defaults to the number of CPUs)\nand the books are written to the output files of their categories in the output directory.\nThe files that could not be parsed are listed in parse_errors.jsonl."
+    )
+    parser.add_argument(
+        "--file-base-url",
+        default=None,
+        help="Offline mode: URL of the parsed directories (ex. https://books.toscrape.com/ for a mirror of the site),\nto rebuild the product page URLs from the file paths. Defaults to the file:// URLs of the files."
     )
     parser.add_argument(
         "--outputdir",
@@ -123,6 +145,262 @@ Supports Python's date and time format codes.
         default="{scrape_type}: {url}",
         help="Specify the format to use when printing urls. Accepts two fields in brackets: '{scrape_type}' and '{url}'."
     )
+    parser.add_argument(
+        "--event-log",
+        dest="event_log",
+        default="",
+        help="Append the scraping events (requests, parsed pages, records written, errors) to this file, in JSON Lines format."
+    )
+    parser.add_argument(
+        "--format",
+        dest="output_format",
+        choices= list(WRITER_FORMATS.keys()),
+        default="csv",
+        help="Output format of the scraped book data: csv (default) or jsonl (JSON Lines, one record per line)."
+    )
+    parser.add_argument(
+        "--compress",
+        dest="compression",
+        choices= [c for c in COMPRESSION_SUFFIXES if c],
+        default=None,
+        help="Compress the output files on the fly. zstd requires the optional zstandard package."
+    )
+    parser.add_argument(
+        "--seen-urls",
+        dest="seen_urls",
+        choices= URL_SET_KINDS,
+        default="digest",
+        help="How to keep track of the urls seen during the run: digest (compact set of url hashes, default)\nor bloom (fixed size Bloom filter, may skip a few urls, see --bloom-error-rate)."
+    )
+    parser.add_argument(
+        "--bloom-capacity",
+        type= int,
+        default= 100_000,
+        help="Expected number of urls per category when using --seen-urls bloom (defaults to 100000)."
+    )
+    parser.add_argument(
+        "--bloom-error-rate",
+        type= float,
+        default= 0.001,
+        help="False positive rate of the Bloom filters (defaults to 0.001)."
+    )
+    parser.add_argument(
+        "--category-cache-size",
+        type= int,
+        default= 4,
+        help="Max number of category indexes kept in memory (defaults to 4)."
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        default=False,
+        help="Resume an interrupted crawl from the checkpoint found in the output directory (same -d / -T options as the interrupted run).\nStarts a new crawl of scrape_url if no checkpoint is found."
+    )
+    parser.add_argument(
+        "--checkpoint-interval",
+        type= float,
+        default= 30.0,
+        help="Save the crawl frontier to the output directory every N seconds (defaults to 30). Set to 0 to save after each book."
+    )
+    parser.add_argument(
+        "--delta-from",
+        dest="delta_from",
+        default=None,
+        help="Incremental recrawl: path to the output directory of a previous run. Only scrape the books that are new\nor whose price or availability changed on the category listings since that run, copy the unchanged books from the previous output."
+    )
+    parser.add_argument(
+        "--changes-from",
+        dest="changes_from",
+        default=None,
+        help="Path to the output directory of a previous run: once the scraping is done, write the books added, removed\nor modified since that run to changefeed.jsonl in the output directory. Defaults to the --delta-from directory."
+    )
+    parser.add_argument(
+        "--changes-fields",
+        action="extend",
+        nargs="+",
+        default=[],
+        help="Fields compared in the change feed. Defaults to {0}.".format(" ".join(DEFAULT_FIELDS))
+    )
+    parser.add_argument(
+        "--workers",
+        type= int,
+        default= None,
+        help="Number of threads scraping index and product pages (defaults to 1). With several workers, the categories are crawled\nat once: index pages first, then the product pages of all categories in turns. The -i delay applies to each worker.\nWith --file: number of parsing processes (defaults to the number of CPUs)."
+    )
+    parser.add_argument(
+        "--images",
+        choices= IMAGE_MODES,
+        default= IMAGES_INLINE,
+        help="""How to download the book images:
+  inline: right after each book (default)
+  background: apart from the page crawl, see --image-workers. The output files are complete before all images land.
+  defer: only list the images to download in the output directory, download them later with --fetch-images
+  skip: don't download the images"""
+    )
+    parser.add_argument(
+        "--image-workers",
+        type= int,
+        default= 2,
+        help="Number of threads downloading the images with --images background or --fetch-images (defaults to 2)."
+    )
+    parser.add_argument(
+        "--hedge",
+        dest="hedge_percentile",
+        type= float,
+        nargs="?",
+        const= 95.0,
+        default= None,
+        help="Hedged requests: send a duplicate of the requests still waiting for a response after the Nth percentile\nof the host's response times (defaults to 95 when set), and take the first response. Cuts the tail latency\nfor a few percent of extra requests."
+    )
+    parser.add_argument(
+        "--circuit-breaker",
+        dest="circuit_breaker_failures",
+        type= int,
+        default= 0,
+        help="Stop sending requests to a host after N consecutive failures (connection errors, timeouts, 5xx, 429),\nthen probe it until it answers again (see --circuit-recovery). Disabled by default."
+    )
+    parser.add_argument(
+        "--circuit-recovery",
+        dest="circuit_recovery_time",
+        type= float,
+        default= 30.0,
+        help="Seconds before probing a host whose circuit is open, doubled after each failed probe (defaults to 30)."
+    )
+    parser.add_argument(
+        "--adaptive-timeouts",
+        action="store_true",
+        default=False,
+        help="Derive the read timeouts of the index pages, product pages and images from their own response times\n(3 times the p99, see --timeout-floor and --timeout-ceiling), instead of a fixed 7s timeout."
+    )
+    parser.add_argument(
+        "--timeout-floor",
+        type= float,
+        default= 1.0,
+        help="Shortest read timeout with --adaptive-timeouts, in seconds (defaults to 1)."
+    )
+    parser.add_argument(
+        "--timeout-ceiling",
+        type= float,
+        default= 30.0,
+        help="Longest read timeout with --adaptive-timeouts, in seconds (defaults to 30)."
+    )
+    parser.add_argument(
+        "--pool-size",
+        type= int,
+        default= None,
+        help="Connections kept open to the host, shared by all the threads. Defaults to one per worker and image worker\n(twice as many with --hedge)."
+    )
+    parser.add_argument(
+        "--no-keep-alive",
+        dest="keep_alive",
+        action="store_false",
+        default=True,
+        help="Open a new connection for each request, instead of re-using the connections (HTTP keep-alive)."
+    )
+    parser.add_argument(
+        "--warmup",
+        type= int,
+        default= 0,
+        help="Open N connections to the host before the crawl, so that the workers don't wait for the TCP and TLS handshakes.\nThe connections opened and re-used during the run are counted in the metrics."
+    )
+    parser.add_argument(
+        "--fetch-images",
+        action="store_true",
+        default=False,
+        help="Only download the pending images of the output directory (deferred, or left by an interrupted run), then exit."
+    )
+    parser.add_argument(
+        "--queue",
+        default=None,
+        help="Worker mode: path to a work queue shared by several scrapebooks workers (SQLite database, created if needed).\nStart the same command in several processes or on several hosts sharing the output directory:\neach worker leases index and product pages from the queue and writes its own partition, merged when the queue is finished."
+    )
+    parser.add_argument(
+        "--worker-id",
+        default=None,
+        help="Worker mode: identifier of the worker, unique across hosts (defaults to <hostname>-<pid>)."
+    )
+    parser.add_argument(
+        "--lease-timeout",
+        type= float,
+        default= 300.0,
+        help="Worker mode: a task leased by a worker is handed to another worker after N seconds (defaults to 300)."
+    )
+    parser.add_argument(
+        "--reset-queue",
+        action="store_true",
+        default=False,
+        help="Worker mode: if the queue was finished by a previous run, reset it and start a new run.\nOtherwise the workers refuse a finished queue."
+    )
+    parser.add_argument(
+        "--merge",
+        action="store_true",
+        default=False,
+        help="Only merge the partitions left by the workers in the output directory (ex. after an interrupted worker crawl).\nWith --queue, the partitions of the workers still holding a task are left for later."
+    )
+    parser.add_argument(
+        "--metrics",
+        dest="metrics_file",
+        default=None,
+        help="Path to the JSON report of the run: count, bytes, latency percentiles (p50/p95/p99) of each stage\n(index, product and image fetch, parse, validate, write) and event counters.\nDefaults to scrape_metrics.json in the output directory\n(scrape_metrics_<worker id>.json for the --queue workers, scrape_metrics_merge.json and scrape_metrics_fetch_images.json\nfor the --merge and --fetch-images runs)."
+    )
+    parser.add_argument(
+        "--prometheus",
+        dest="prometheus_file",
+        default=None,
+        help="Also write the metrics of the run to a file in the Prometheus text format (ex. for the node exporter textfile collector)."
+    )
+    parser.add_argument(
+        "--daemon",
+        action="store_true",
+        default=False,
+        help="Daemon mode: keep running, crawl scrape_url every night (see --full-at) and check the category listings\nevery N minutes (see --check-interval), each run to its own directory in the output directory.\nThe HTTP session stays warm across runs. Control the daemon with daemon.py (see --control)."
+    )
+    parser.add_argument(
+        "--full-at",
+        default="02:00",
+        help="Daemon mode: time of the nightly full crawl, HH:MM in local time (defaults to 02:00). Set to an empty string to disable."
+    )
+    parser.add_argument(
+        "--check-interval",
+        type= float,
+        default= 60.0,
+        help="Daemon mode: minutes between 2 listing checks, incremental recrawls from the latest run (defaults to 60). Set to 0 to disable."
+    )
+    parser.add_argument(
+        "--control",
+        default="127.0.0.1:8700",
+        help="Daemon mode: address of the local control endpoint, host:port (defaults to 127.0.0.1:8700). Set to an empty string to disable."
+    )
+    parser.add_argument(
+        "--keep-runs",
+        type= int,
+        default= None,
+        help="Daemon mode: only keep the N latest run directories (and the latest successful run), remove the older ones.\nDefaults to keeping all the runs. The runs share the images of the unchanged books (hard links)."
+    )
+    parser.add_argument(
+        "--plan",
+        action="store_true",
+        default=False,
+        help="Dry run: only read the home page and the category headers (plus a sample product page and image),\nthen print the number of index, product and image requests and the expected bytes per category,\nand an estimate of the duration of the crawl with the -i, --workers and --images settings. Nothing is scraped."
+    )
+    parser.add_argument(
+        "--profile",
+        dest="profile_file",
+        default=None,
+        help="Profile the run with cProfile (including the worker threads): save the stats to this .pstats file\nand print the top functions (see --profile-top) to stderr."
+    )
+    parser.add_argument(
+        "--profile-memory",
+        dest="profile_memory_file",
+        default=None,
+        help="Trace the memory allocations with tracemalloc: write the memory growth of the run by allocation site to this text file\nand print the top sites to stderr. Slows the run down noticeably."
+    )
+    parser.add_argument(
+        "--profile-top",
+        type= int,
+        default= 25,
+        help="Number of functions and allocation sites printed by --profile and --profile-memory (defaults to 25)."
+    )
     parser.add_argument(
         '-i',
         dest="request_delay",
@@ -146,11 +424,49 @@ def append_timestamp(in_str: str):
     now = datetime.datetime.now(datetime.timezone.utc)
     return in_str + '_' + now.strftime("%Y-%m-%d_%H-%M-%S")
 
+def default_metrics_file(output_dir: str, scrape_type: str, worker_id: str = None) -> str:
+    """
+    Default path to the metrics report of a run: scrape_metrics.json in the output directory.
+    The workers sharing an output directory, and the merge and fetch images runs, write their own report
+    (ex. scrape_metrics_<worker id>.json, scrape_metrics_merge.json) instead of overwriting the report of the crawl.
+    """
+    name, extension = os.path.splitext(METRICS_BASENAME)
+    if scrape_type in ("merge", "fetch_images"):
+        name += "_" + scrape_type
+    elif worker_id:
+        name += "_" + re.sub(r'[\s/]+', '_', worker_id.strip(" /"))
+    return os.path.join(output_dir, name + extension)
+
+def guess_scrape_type(scrape_url: str) -> tuple[str, str]:
+    """
+    Guess the scraping type from the path: entire catalog, category or single page.
+    Returns the scrape type (see the scrapetypes.SCRAPE_* constants) and the normalized url.
+    """
+    scrape_url = re.sub(r'/(index.[a-z]{2,4})?$', '', scrape_url) + '/'
+    if scrape_url in ['https://books.toscrape.com/catalogue/category/books_1/', 'https://books.toscrape.com/']:
+        return scrapetypes.SCRAPE_ALL, scrape_url
+    if re.match(r'^https://books.toscrape.com/catalogue/category/books/[a-zA-Z0-9\-_]+/$', scrape_url):
+        return scrapetypes.SCRAPE_CATEGORY, scrape_url
+    return scrapetypes.SCRAPE_PRODUCT, scrape_url
+
+def read_url_list(source: str) -> list[tuple[str, str]]:
+    """
+    Reads a list of urls from a file (or from stdin if source is '-'), one per line.
+    Returns the (scrape type, url) pairs of the distinct urls (see guess_scrape_type()), in order.
+    """
+    if source == '-':
+        lines = sys.stdin.read().splitlines()
+    else:
+        with open(source, encoding= "utf-8") as f:
+            lines = f.read().splitlines()
+    urls = [line.strip() for line in lines if line.strip() and not line.strip().startswith('#')]
+    return list(dict.fromkeys(guess_scrape_type(url) for url in urls))
+
 def print_scraped_url(url: str = '', scrape_type: str = '', o_format= "{scrape_type}: {url}"):
     """
     Outputs the scrape type and the scraped url in specified format to stdout.
     Defaults to scrape_type: url.
-    Typically called as a custom_url_handler by the Scraper object.
+    Typically called by a subscriber to the Scraper's scrape events.
     See gen_scraped_url_formater for a convenient way to 'pre-compile' the ouptut format.
     """
     o_fields = {
@@ -218,12 +534,8 @@ if __name__ == "__main__":
     # scrape_url argument
     if not args.file:
         scrape_url = args.scrape_url
-        input_file = ''
     else:
         scrape_url = ''
-        input_file = args.file
-        if not csv_output_file:
-            csv_output_file = os.path.join(output_base_dir, append_timestamp(os.path.basename(args.file)) + ".csv")
 
     #
     # configure logger
@@ -249,24 +561,55 @@ if __name__ == "__main__":
         logger_config['level'] = lvls.get(args.verbosity, logging.NOTSET)
     logging.basicConfig(**logger_config)
 
-    if input_file:
-        # debugging with a local file...
-        logger.info(f"debugging with local file {input_file}:")
-        with open(input_file) as f:
-            book_html = f.read()
-        reader = BookDataReader()
-        book = reader.read_from_html(book_html)
-        print(book)
+    if args.file:
+        # offline mode: parse saved pages
+        from offlineparse import OfflineParser
+        offline_parser = OfflineParser(
+            output_base_dir,
+            output_format= args.output_format,
+            compression= args.compression,
+            workers= args.workers,
+            base_url= args.file_base_url)
+        try:
+            summary = offline_parser.parse_files(args.file)
+        except FileNotFoundError as e:
+            parser.error(str(e))
+        print(f"Parsed {summary['files']} files: {summary['books']} books written to {output_base_dir}, {summary['skipped']} already there, {summary['errors']} errors"
+              + (f" (see {OfflineParser.ERRORS_FILENAME})" if summary['errors'] else ""))
         exit()
-    elif len(scrape_url) == 0:
+    elif len(scrape_url) == 0 and not (args.url_list or args.merge or args.fetch_images):
         # woops...
         raise Exception("Missing data source. Please specify URL to scrape or input HTML file.")
 
+    from scraper import Scraper
+    from books_to_scrape_generators import BooksToScrapeGenerator
+    from workqueue import SqliteWorkQueue, default_worker_id
+    from events import EventBus, JsonLinesEventLog
+
     scraper_options = {
         'timeout': (3.5, 7),
         'requests_delay': args.request_delay,
         'output_dir': output_base_dir,
-        'scraping_generator': BooksToScrapeGenerator()
+        'scraping_generator': BooksToScrapeGenerator(),
+        'output_format': args.output_format,
+        'compression': args.compression,
+        'seen_urls': args.seen_urls,
+        'bloom_capacity': args.bloom_capacity,
+        'bloom_error_rate': args.bloom_error_rate,
+        'category_cache_size': args.category_cache_size,
+        'checkpoint_interval': args.checkpoint_interval,
+        'delta_from': args.delta_from,
+        'workers': args.workers or 1,
+        'images': args.images,
+        'image_workers': args.image_workers,
+        'hedge_percentile': args.hedge_percentile,
+        'circuit_breaker_failures': args.circuit_breaker_failures,
+        'circuit_recovery_time': args.circuit_recovery_time,
+        'adaptive_timeouts': args.adaptive_timeouts,
+        'timeout_floor': args.timeout_floor,
+        'timeout_ceiling': args.timeout_ceiling,
+        'pool_size': args.pool_size,
+        'keep_alive': args.keep_alive
     }
 
     #
@@ -275,31 +618,154 @@ if __name__ == "__main__":
     if args.nocontent:
         scraper_options['mode'] = "scrape_urls"
 
+    #
+    # daemon mode
+    #
+    if args.daemon:
+        from daemon import ScrapeDaemon, parse_address
+        guessed_type, scrape_url = guess_scrape_type(scrape_url)
+        if guessed_type == Scraper.SCRAPE_PRODUCT:
+            parser.error("daemon mode: scrape_url should be the catalog or a category")
+        daemon = ScrapeDaemon(
+            scrape_url,
+            output_base_dir,
+            {k: v for k, v in scraper_options.items() if k not in ('output_dir', 'delta_from')},
+            scrape_type= guessed_type,
+            full_at= args.full_at or None,
+            check_interval= args.check_interval,
+            control_address= parse_address(args.control) if args.control else None,
+            changes_fields= args.changes_fields or None,
+            keep_runs= args.keep_runs)
+        daemon.run_forever()
+        exit()
+
+    scraper = Scraper(**scraper_options)
+
     #
     # output scraped urls
     #
     if args.print_urls:
-        print_urls_format = args.print_urls_format or "{url}"
-        scraper_options['custom_url_handler'] = gen_scraped_url_formater(print_scraped_url, print_urls_format)
+        print_url = gen_scraped_url_formater(print_scraped_url, args.print_urls_format or "{url}")
+        scraper.events.subscribe(lambda event: print_url(url= event['url'], scrape_type= event['scrape_type']), [EventBus.SCRAPE])
 
-    scraper = Scraper(**scraper_options)
+    #
+    # event log
+    #
+    event_log = None
+    if args.event_log:
+        event_log = scraper.events.subscribe(JsonLinesEventLog(args.event_log))
 
     #
-    # Guess the scraping type from the path: entire catalog, category or single page
+    # profiling (--profile or --profile-memory)
     #
-    scrape_url = re.sub(r'/(index.[a-z]{2,4})?$', '', scrape_url) + '/'
-    if scrape_url in ['https://books.toscrape.com/catalogue/category/books_1/', 'https://books.toscrape.com/']:
-        logger.info(f"Scrape the entire catalog, export to {output_base_dir}")
-        scraper.scrape_all_categories(scrape_url)
-    elif re.match(r'^https://books.toscrape.com/catalogue/category/books/[a-zA-Z0-9\-_]+/$', scrape_url):
-        # we need an output file... but for categories the scraper will generate the filename, if needed.
-        logger.info(f"Scrape a category, export to {csv_output_file}")
-        scraper.scrape_category(scrape_url, csv_output_file)
-    else:
-        # we need an output file...
-        if not csv_output_file:
-            csv_output_file = os.path.join(output_base_dir, gen_output_file_name(scrape_url, '.csv'))
-        logger.info(f"Scrape a single page, export to {csv_output_file}")
-        scraper.scrape_book(scrape_url, BookDataWriter(csv_output_file))
-    
+    profiler = None
+    if args.profile_file or args.profile_memory_file:
+        from profiling import RunProfiler
+        profiler = RunProfiler(args.profile_file, args.profile_memory_file, top= args.profile_top)
+
+    guessed_type, scrape_url = guess_scrape_type(scrape_url)
+
+    #
+    # dry run
+    #
+    if args.plan:
+        if args.url_list:
+            parser.error("--plan doesn't support --url-list")
+        from crawlplan import CrawlPlanner
+        print(CrawlPlanner.summary(scraper.plan(scrape_url, guessed_type)))
+        scraper.close()
+        exit()
+
+    #
+    # open the connections before the crawl
+    #
+    if args.warmup > 0 and scrape_url and not (args.fetch_images or args.merge or args.url_list):
+        scraper.warmup(scrape_url, args.warmup)
+
+    # the same worker id names the partition, the merge lock holder and the metrics report of a worker
+    worker_id = (args.worker_id or default_worker_id()) if args.queue else None
+    with profiler or contextlib.nullcontext():
+        if args.fetch_images:
+            scrape_type = "fetch_images"
+            if pending_images := scraper.fetch_pending_images():
+                logger.warning(f"{pending_images} images could not be downloaded.")
+        elif args.merge:
+            scrape_type = "merge"
+            if args.queue:
+                # leave the partitions of the workers still running, and don't merge along with a worker
+                with SqliteWorkQueue(args.queue, lease_timeout= args.lease_timeout) as queue:
+                    if queue.try_acquire("merge", worker_id):
+                        with queue.holding("merge", worker_id):
+                            merged_count = scraper.merge_partitions(queue)
+                    else:
+                        logger.warning("A worker is merging the partitions, try again later.")
+                        merged_count = 0
+            else:
+                merged_count = scraper.merge_partitions()
+            logger.info(f"Merged {merged_count} books to {output_base_dir}")
+        elif args.resume and scraper.resume() is not None:
+            scrape_type = "resume"
+        elif args.url_list:
+            scrape_type = "url_list"
+            targets = read_url_list(args.url_list)
+            if args.warmup > 0 and targets:
+                scraper.warmup(targets[0][1], args.warmup)
+            logger.info(f"Scrape a list of {len(targets)} urls, export to {output_base_dir}")
+            scraper.scrape_url_list(targets)
+        elif guessed_type == Scraper.SCRAPE_ALL:
+            scrape_type = Scraper.SCRAPE_ALL
+            if args.queue:
+                logger.info(f"Worker: scrape the entire catalog from queue {args.queue}, export to {output_base_dir}")
+                with SqliteWorkQueue(args.queue, lease_timeout= args.lease_timeout) as queue:
+                    scraper.work(queue, scrape_url, scrape_type, worker_id= worker_id, reset_queue= args.reset_queue)
+            else:
+                logger.info(f"Scrape the entire catalog, export to {output_base_dir}")
+                scraper.scrape_all_categories(scrape_url)
+        elif guessed_type == Scraper.SCRAPE_CATEGORY:
+            scrape_type = Scraper.SCRAPE_CATEGORY
+            if args.queue:
+                logger.info(f"Worker: scrape a category from queue {args.queue}, export to {output_base_dir}")
+                with SqliteWorkQueue(args.queue, lease_timeout= args.lease_timeout) as queue:
+                    scraper.work(queue, scrape_url, scrape_type, worker_id= worker_id, reset_queue= args.reset_queue)
+            else:
+                # we need an output file... but for categories the scraper will generate the filename, if needed.
+                logger.info(f"Scrape a category, export to {csv_output_file}")
+                scraper.scrape_category(scrape_url, csv_output_file)
+        else:
+            scrape_type = Scraper.SCRAPE_PRODUCT
+            # we need an output file...
+            if not csv_output_file:
+                csv_output_file = os.path.join(output_base_dir, gen_output_file_name(scrape_url, output_file_suffix(args.output_format, args.compression)))
+            logger.info(f"Scrape a single page, export to {csv_output_file}")
+            with scraper.create_writer(csv_output_file) as writer:
+                scraper.scrape_book(scrape_url, writer)
+        # profile the end of the background image downloads as well
+        scraper.close()
+    if event_log:
+        event_log.close()
+    if profiler and (profile_summary := profiler.summary()):
+        print(profile_summary, file= sys.stderr)
+
+    #
+    # metrics
+    #
+    logger.info("Metrics:\n" + scraper.metrics.summary())
+    scraper.metrics.write_json(args.metrics_file or default_metrics_file(output_base_dir, scrape_type, worker_id))
+    if args.prometheus_file:
+        scraper.metrics.write_prometheus(args.prometheus_file)
+
+    #
+    # change feed
+    #
+    if (changes_from := args.changes_from or args.delta_from) and not args.nocontent:
+        if scrape_type == Scraper.SCRAPE_PRODUCT:
+            logger.warning("No change feed when scraping a single product page.")
+        elif args.queue:
+            logger.warning("No change feed in worker mode, run changefeed.py once the partitions are merged.")
+        else:
+            # when scraping the entire catalog, also report the books of categories that disappeared.
+            # Otherwise only compare the output files of the current directory.
+            basenames = None if scrape_type == Scraper.SCRAPE_ALL else [os.path.basename(f) for f in list_output_files(output_base_dir)]
+            write_change_feed(changes_from, output_base_dir, fields= args.changes_fields or None, basenames= basenames, compression= args.compression)
+
     logger.info("Done.")
@@ -8,7 +8,13 @@ import urllib.parse
 from bs4 import BeautifulSoup
 from typing import Generator
 from collections.abc import Generator
+from collections import deque
 from scraping_generators import AbstractScrapingGenerator
+from urlstatestore import UrlStateStore
+from urlsets import DigestUrlSet, BloomUrlSet
+from metrics import Metrics
+import hashlib
+import json
 import logging
 logger = logging.getLogger(__name__)
 
@@ -34,64 +40,159 @@ class ScrapeIndex:
         # do something brilliant with the url string
         (...)
     ```
+
+    When a persistent UrlStateStore is set, URLs scraped during previous runs are skipped as well.
+
+    URLs seen during the current run are kept in a compact set of digests (see urlsets.py),
+    a Bloom filter can be set instead to keep a fixed memory footprint.
     """
 
-    def __init__(self, scraping_generator: AbstractScrapingGenerator, data_src: RemoteDataSource = None):
+    def __init__(self, scraping_generator: AbstractScrapingGenerator, data_src: RemoteDataSource = None, url_store: UrlStateStore = None, seen_urls: DigestUrlSet | BloomUrlSet = None, metrics: Metrics = None):
         self.scraping_generator: AbstractScrapingGenerator = scraping_generator
         self.index_url = ''
-        self._url_map: dict[str, str|bool] = {}
-        self._url_generator = self.load_generator_from_list([])
+        self._seen_urls: DigestUrlSet | BloomUrlSet = seen_urls if seen_urls is not None else DigestUrlSet()
+        self.load_generator_from_list([])
         self.src = data_src or RemoteDataSource()
+        self.url_store: UrlStateStore = url_store
+        # index page fetches are measured as the "index_fetch" stage
+        self.metrics: Metrics = metrics or Metrics()
 
-    def mark_url(self, url, scraped: bool = True):
+    def mark_url(self, url, scraped: bool = True, content_hash: str = None, output_file: str = None):
         """
-        Marks a url as scraped.
+        Marks a url as scraped (or as failed if scraped is False).
+        The state is recorded to the persistent url store, if set.
         """
-        self._url_map[url] = scraped
+        if scraped:
+            self._seen_urls.add(url)
+        else:
+            self._seen_urls.discard(url)
+        if self.url_store is not None:
+            status = UrlStateStore.SCRAPED if scraped else UrlStateStore.FAILED
+            self.url_store.set_state(url, status, content_hash= content_hash, output_file= output_file)
 
     def is_scraped(self, url: str) -> bool:
         """
         Returns True if a URL is already amrked as being scraped,
         False otherwise.
         """
-        return self._url_map.get(url, False)
+        if url in self._seen_urls:
+            return True
+        return self.url_store is not None and self.url_store.is_scraped(url)
 
     def load_generator_from_list(self, url_list: list[str]):
         """
         Loads the list of URLs to scrape from a list.
         """
-        self._url_generator = iter(url_list)
+        self.restore_frontier('', url_list)
 
     def load_generator_from_url(self, index_url: str):
         """
         Loads the list of URLs to scrape from data found at a given URL.
         """
-        self._url_generator = iter(self._read_url_index(index_url))
-    
+        self.restore_frontier(index_url, [])
+
+    def frontier(self) -> tuple[str, list[str]]:
+        """
+        Returns the current state of the index as a tuple: (next index page url to read, pending urls to list).
+        Together with restore_frontier(), this allows to resume the listing after a crash.
+        """
+        return (self._next_index_url, list(self._pending_urls))
+
+    def restore_frontier(self, next_index_url: str, pending_urls: list[str]):
+        """
+        Restarts listing urls from a saved frontier (see frontier()):
+        the pending urls are listed first, then the index pages starting from next_index_url.
+        """
+        self._next_index_url: str = next_index_url
+        self._pending_urls: deque[str] = deque(pending_urls)
+        # hashes of the product data shown on the listing, for the pending urls read from index pages
+        self._listing_hashes: dict[str, str] = {}
+        self._url_generator = self._read_url_index()
+
     def list_urls_to_scrape(self) -> Generator[str]:
         """
         Lazily lists the URLs that have not been scraped yet.
         """
+        for next_url, _ in self.list_items_to_scrape():
+            yield next_url
+
+    def list_items_to_scrape(self) -> Generator[tuple[str, str]]:
+        """
+        Lazily lists the URLs that have not been scraped yet, as tuples (url, listing hash).
+        The listing hash identifies the product data shown on the index page (see listing_hash()),
+        it is None when the url was not read from an index page.
+        """
         for next_url in self._url_generator:
-            if False == self._url_map.get(next_url, False):
-                self.mark_url(next_url)
-                yield next_url
+            listing_hash = self._listing_hashes.pop(next_url, None)
+            if self.claim_url(next_url):
+                yield (next_url, listing_hash)
 
-    def _read_url_index(self, index_url) -> Generator[str]:
+    def claim_url(self, url: str) -> bool:
+        """
+        Returns True if a url has not been scraped yet, and marks it as seen for the current run.
+        Only the seen urls are updated: the scraper records the persistent state once the url has actually been scraped.
         """
-        Reads the contents found at index url and extracts a list of urls to scrape.
+        if self.is_scraped(url):
+            return False
+        self._seen_urls.add(url)
+        return True
+
+    @classmethod
+    def listing_hash(cls, listing_item: dict[str, str]) -> str:
+        """
+        Returns a hash of the product data found on a listing (see AbstractScrapingGenerator.gen_listing_items_from_index()).
+        Returns None if the listing shows no product data besides the url.
+        """
+        listing_data = {k: v for k, v in listing_item.items() if k != 'url'}
+        if not listing_data:
+            return None
+        return hashlib.sha256(json.dumps(listing_data, sort_keys= True).encode()).hexdigest()
+
+    def _read_url_index(self) -> Generator[str]:
+        """
+        Lists the pending urls, then reads the contents found at the next index url and extracts a list of urls to scrape.
         Lazily proceeds to the next page if content is paginated.
         """
-        next_index_url = index_url
-        while next_index_url:
-            index_html = self.src.read_text(next_index_url)
-            index_soup = BeautifulSoup(index_html, 'html.parser')
-            url_list = self.scraping_generator.gen_product_urls_from_index(index_soup=index_soup, base_url=next_index_url)
-            logger.debug("Found {0} links".format(len(url_list)))
-            next_index_url = self.scraping_generator.gen_index_next_page_url(index_soup= index_soup, base_url= next_index_url)
-            for url in url_list:
-                yield url
-            if next_index_url:
-                logger.debug(f"Proceed to next page: {next_index_url}")
-            else:
-                logger.debug("Reached the end of index")
+        while self._pending_urls or self._next_index_url:
+            if self._pending_urls:
+                yield self._pending_urls.popleft()
+                continue
+            listing_items, next_index_url = self.read_index_page(self._next_index_url)
+            for item in listing_items:
+                self._pending_urls.append(item['url'])
+                if listing_hash := self.listing_hash(item):
+                    self._listing_hashes[item['url']] = listing_hash
+            self._next_index_url = next_index_url
+
+    def read_index_page(self, index_url: str, data_src: RemoteDataSource = None) -> tuple[list[dict[str, str]], str]:
+        """
+        Reads a single index page.
+        Returns the products listed on the page (see AbstractScrapingGenerator.gen_listing_items_from_index())
+        and the url of the next index page (or an empty string on the last page).
+        data_src -- read the page from another data source (ex. the data source of the current thread)
+        """
+        index_html = self.fetch_index_html(index_url, data_src)
+        return self.read_index_soup(BeautifulSoup(index_html, 'html.parser'), index_url)
+
+    def fetch_index_html(self, index_url: str, data_src: RemoteDataSource = None) -> str:
+        """
+        Fetches the html content of an index page.
+        """
+        src = data_src or self.src
+        with self.metrics.measure("index_fetch") as m:
+            index_html = src.read_text(index_url, RemoteDataSource.INDEX)
+            m.bytes = len(src.response.content)
+        return index_html
+
+    def read_index_soup(self, index_soup: BeautifulSoup, index_url: str) -> tuple[list[dict[str, str]], str]:
+        """
+        Same as read_index_page(), from an index page already parsed.
+        """
+        listing_items = self.scraping_generator.gen_listing_items_from_index(index_soup=index_soup, base_url=index_url)
+        logger.debug("Found {0} links".format(len(listing_items)))
+        next_index_url = self.scraping_generator.gen_index_next_page_url(index_soup= index_soup, base_url= index_url)
+        if next_index_url:
+            logger.debug(f"Proceed to next page: {next_index_url}")
+        else:
+            logger.debug("Reached the end of index")
+        return (listing_items, next_index_url)
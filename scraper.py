@@ -6,14 +6,34 @@ bookscraper package
 from categoryindex import CategoryIndex
 from scrapeindex import ScrapeIndex
 from bookdata import BookData
-from bookdatawriter import BookDataWriter
+from bookdatawriter import AbstractBookDataWriter, QueueBookDataWriter, StreamClosed, WRITER_FORMATS, create_writer, guess_output_format, output_file_suffix, read_output_records
 from bookdatareader import BookDataReader
-from remotedatasource import RemoteDataSource, max_attempts_decorator
+from remotedatasource import RemoteDataSource, max_attempts_decorator, create_session, connection_stats, warmup_connections
+from urlstatestore import UrlStateStore
+from urlsets import DigestUrlSet, create_url_set
+from checkpoint import CrawlCheckpoint
+from frontier import CrawlFrontier
+from crawlplan import CrawlPlanner
+from imagepipeline import ImagePipeline
+import imagepipeline
+import scrapetypes
+from manifest import FileManifest
+from metrics import Metrics
+from resilience import HedgedRequests, CircuitBreaker, AdaptiveTimeouts
+from events import EventBus
+from workqueue import SqliteWorkQueue, default_worker_id
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 import os
-import csv
+import queue
 import re
+import hashlib
+import shutil
+import time
+import threading
+import requests
 import logging
-from collections.abc import Callable
+from collections.abc import Callable, Generator
 from scraping_generators import AbstractScrapingGenerator
 
 logger = logging.getLogger(__name__)
@@ -23,10 +43,28 @@ class Scraper:
     Main scraper class. Pilots the scraping jobs.
     """
 
-    SCRAPE_ALL = "scrape_all"
-    SCRAPE_CATEGORY = "scrape_category"
-    SCRAPE_PRODUCT = "scrape_product"
-    SCRAPE_IMAGE = "scrape_image"
+    SCRAPE_ALL = scrapetypes.SCRAPE_ALL
+    SCRAPE_CATEGORY = scrapetypes.SCRAPE_CATEGORY
+    SCRAPE_PRODUCT = scrapetypes.SCRAPE_PRODUCT
+    SCRAPE_IMAGE = scrapetypes.SCRAPE_IMAGE
+
+    IMAGE_SUBTYPES = ['jpeg', 'jpg', 'png', 'gif']
+
+    # how to download the book images (see images in __init__())
+    IMAGES_INLINE = imagepipeline.IMAGES_INLINE
+    IMAGES_BACKGROUND = imagepipeline.IMAGES_BACKGROUND
+    IMAGES_DEFER = imagepipeline.IMAGES_DEFER
+    IMAGES_SKIP = imagepipeline.IMAGES_SKIP
+    IMAGE_MODES = imagepipeline.IMAGE_MODES
+
+    # kinds of tasks in the shared work queue (see work())
+    TASK_CATALOG = "catalog"
+    TASK_CATEGORY = "category"
+    TASK_INDEX = "index"
+    TASK_PRODUCT = "product"
+
+    # sub-directory of the output directory where the workers write their partitioned outputs
+    PARTITIONS_DIR = "parts"
 
     def __init__(
             self,
@@ -35,12 +73,33 @@ class Scraper:
             mode: str = "scrape_content",
             custom_url_handler: Callable = None,
             requests_delay: float = 2.0,
-            timeout: tuple[float, float] = (3.05, 7.0)
+            timeout: tuple[float, float] = (3.05, 7.0),
+            output_format: str = "csv",
+            compression: str = None,
+            url_store_path: str = None,
+            seen_urls: str = "digest",
+            bloom_capacity: int = 100_000,
+            bloom_error_rate: float = 0.001,
+            category_cache_size: int = 4,
+            checkpoint_interval: float = 30.0,
+            delta_from: str = None,
+            workers: int = 1,
+            images: str = IMAGES_INLINE,
+            image_workers: int = 2,
+            session: requests.Session = None,
+            hedge_percentile: float = None,
+            circuit_breaker_failures: int = 0,
+            circuit_recovery_time: float = 30.0,
+            adaptive_timeouts: bool = False,
+            timeout_floor: float = 1.0,
+            timeout_ceiling: float = 30.0,
+            pool_size: int = None,
+            keep_alive: bool = True
             ):
         """
         Initialize the scraper.
 
-        output_dir -- path to the directory where the csv files should be stored
+        output_dir -- path to the directory where the output files should be stored
 
         scraping_generator -- A scraping generator object that knows how to retrieve the data from the remote data source.
 
@@ -49,21 +108,160 @@ class Scraper:
 
         custom_url_handler -- An optional handler can be set to add further handling of scraped urls.
         The handler will be called with two keywords parameters: `scrape_url_handler(**{url: str, scrape_type: str})`
+        (a shortcut for a subscriber to the scrape events, see the events attribute and events.py)
 
         requests_delay -- wait between 2 requests, to save distant server's bandwidth
 
         timeout -- set the connect and read timeout parameters (see https://requests.readthedocs.io/en/latest/user/advanced/#timeouts)
+
+        output_format -- format of the output files: "csv" (default) or "jsonl" (see bookdatawriter.WRITER_FORMATS)
+
+        compression -- optionally compress the output files: None (default), "gzip" or "zstd"
+
+        url_store_path -- path to the persistent url state database (see urlstatestore.py).
+        Defaults to a .scrape_state.sqlite file in the output directory. Not used when only listing URLs.
+
+        seen_urls -- how to track the urls seen during the run: "digest" (compact set of url hashes, default)
+        or "bloom" (fixed size Bloom filter, see bloom_capacity and bloom_error_rate)
+
+        bloom_capacity, bloom_error_rate -- expected number of urls per category and false positive rate of the Bloom filters
+
+        category_cache_size -- max number of category indexes kept in memory
+
+        checkpoint_interval -- save the crawl frontier to the output directory every checkpoint_interval seconds,
+        so that an interrupted crawl can be resumed (see resume()). Set to None to disable checkpoints.
+
+        delta_from -- incremental recrawl: path to the output directory of a previous run.
+        Only the books that are new or whose listing data (price, availability) changed since that run are scraped,
+        the unchanged books are copied from the previous output.
+
+        workers -- number of threads scraping index and product pages. With more than one worker,
+        the categories are crawled at once by a priority scheduler (see frontier.py): index pages first,
+        then product pages of all the categories in turns, stalest first. The requests delay applies to each worker.
+
+        images -- how to download the book images:
+        "inline" (default): right after the book,
+        "background": apart from the page crawl, by image_workers threads (see imagepipeline.py),
+        "defer": only add the images to the pending images of the output directory (see fetch_pending_images()),
+        "skip": don't download the images.
+
+        image_workers -- number of threads downloading the images in background mode
+
+        session -- a session shared by the data sources of all the threads, ex. kept warm across runs by a daemon (see daemon.py).
+        Its connection pool should be large enough for the workers and image workers (see remotedatasource.create_session()).
+        By default, the scraper opens its own session, as set by pool_size and keep_alive.
+
+        pool_size -- connections kept open per host by the scraper's session. Defaults to one per worker and image worker
+        (twice as many with hedged requests).
+
+        keep_alive -- keep the connections open between requests (default). If False, each request opens a new connection.
+
+        hedge_percentile -- hedged requests: send a duplicate of the requests still waiting for a response after
+        this percentile of the host's response times (ex. 95), and take the first response. None (default) to disable.
+
+        circuit_breaker_failures -- stop sending requests to a host after this number of consecutive failures
+        (connection errors, timeouts, server errors, 429), then probe it every circuit_recovery_time seconds
+        (doubled after each failed probe) until it answers again. 0 (default) to disable.
+
+        adaptive_timeouts -- derive the read timeouts of the index pages, product pages and images from their own response times
+        (3 times the p99), between timeout_floor and timeout_ceiling seconds. timeout applies until enough responses are observed.
+        See resilience.py.
         """
         self.scraping_generator = scraping_generator
-        self._category_indexes = {}
+        self._category_indexes: OrderedDict[str, CategoryIndex] = OrderedDict()
+        self._category_cache_size: int = max(1, category_cache_size)
+        self._seen_urls_options = {'kind': seen_urls, 'capacity': bloom_capacity, 'error_rate': bloom_error_rate}
         self._book_data_reader = BookDataReader(scraping_generator= self.scraping_generator)
+        # structured events (requests, parsing, records written, errors) published to any number of subscribers
+        self.events = EventBus()
         # limit request speed to preserve bandwidth on the remote server:
-        self._data_source = RemoteDataSource(requests_delay= requests_delay, timeout= timeout)
+        self._data_source_options = {'requests_delay': requests_delay, 'timeout': timeout, 'events': self.events}
+        # one data source per thread, see _data_source
+        self._thread_local = threading.local()
         self._scrape_contents: bool = (mode == "scrape_content")
-        self._custom_url_handler = custom_url_handler
+        if isinstance(custom_url_handler, Callable):
+            self.events.subscribe(
+                lambda event: custom_url_handler(url= event['url'], scrape_type= event['scrape_type']),
+                [EventBus.SCRAPE])
         self._errors = 0
         self._output_path: str = output_dir
-    
+        self._output_format: str = output_format
+        self._compression: str = compression
+        self._url_store_path: str = url_store_path or os.path.join(output_dir, UrlStateStore.DEFAULT_FILENAME)
+        self._url_store: UrlStateStore = None
+        # size, mtime and hash of the output files and images, checked by validate.py
+        self._manifest: FileManifest = None
+        self._written_output_files: set[str] = set()
+        self._checkpoint: CrawlCheckpoint = None
+        if checkpoint_interval is not None and self._scrape_contents:
+            self._checkpoint = CrawlCheckpoint(os.path.join(output_dir, CrawlCheckpoint.DEFAULT_FILENAME), interval= checkpoint_interval)
+        # state of the current run, saved to the checkpoint:
+        self._run_state: dict = None
+        self._remaining_categories: deque[list[str]] = deque()
+        self._current_category: dict = None
+        self._current_url: str = None
+        self._pending_images: dict[str, dict] = {}
+        # incremental recrawl:
+        self._previous_output_path: str = delta_from
+        self._previous_url_store: UrlStateStore = None
+        if delta_from and os.path.abspath(delta_from) == os.path.abspath(output_dir):
+            raise ValueError("Incremental recrawl: the previous output directory should differ from the output directory")
+        # scheduled crawl:
+        self._workers: int = max(1, workers)
+        self._frontier: CrawlFrontier = None
+        self._scheduled_categories: dict[str, dict] = {}
+        # protects the state shared by the workers (errors count, pending images, checkpoint)
+        self._lock = threading.RLock()
+        # images:
+        if images not in self.IMAGE_MODES:
+            raise ValueError(f"Unsupported images mode: {images}")
+        self._images: str = images
+        self._image_workers: int = max(1, image_workers)
+        self._image_pipeline: ImagePipeline = None
+        # streaming (see iter_books()): the queue of scraped books, the flag set once the consumer is gone
+        # and whether the books are also written to the output files
+        self._book_stream: tuple[queue.Queue, threading.Event, bool] | None = None
+        # per stage timings and event counters (see metrics.py)
+        self.metrics = Metrics()
+        # hedged requests and circuit breaker, shared by the data sources of all the threads
+        self._hedging: HedgedRequests = None
+        if hedge_percentile is not None:
+            self._hedging = HedgedRequests(percentile= hedge_percentile, max_workers= 2 * (self._workers + self._image_workers), metrics= self.metrics)
+        if circuit_breaker_failures > 0:
+            self._data_source_options['circuit_breaker'] = CircuitBreaker(
+                failure_threshold= circuit_breaker_failures, recovery_time= circuit_recovery_time, metrics= self.metrics)
+        self._data_source_options['hedging'] = self._hedging
+        self._timeouts: AdaptiveTimeouts = None
+        if adaptive_timeouts:
+            self._timeouts = self._data_source_options['timeouts'] = AdaptiveTimeouts(default= timeout, floor= timeout_floor, ceiling= timeout_ceiling)
+        # a single session (and connection pool) for all the threads
+        self._own_session: bool = session is None
+        if session is None:
+            session = create_session(pool_size= pool_size or (self._workers + self._image_workers) * (2 if self._hedging else 1), keep_alive= keep_alive)
+        self._session: requests.Session = session
+        self._data_source_options['session'] = session
+        # connections opened and re-used before the run, when the session is shared (see close())
+        self._connections_baseline: dict[str, int] = connection_stats(session)
+
+    @property
+    def _data_source(self) -> RemoteDataSource:
+        """
+        The data source of the current thread.
+        """
+        if (data_source := getattr(self._thread_local, 'data_source', None)) is None:
+            data_source = self._thread_local.data_source = RemoteDataSource(**self._data_source_options)
+        return data_source
+
+    def warmup(self, url: str, connections: int = None) -> int:
+        """
+        Opens connections to the host of url before the crawl (one per worker and image worker by default),
+        so that the first requests of the workers don't wait for the TCP and TLS handshakes.
+        Returns the number of connections opened.
+        """
+        if connections is None:
+            connections = self._workers + self._image_workers
+        return warmup_connections(self._session, url, connections, timeout= self._data_source_options['timeout'])
+
     @max_attempts_decorator(max_attempts = 2)
     def scrape_all_categories(self, url: str) -> bool:
         """
@@ -72,93 +270,1039 @@ class Scraper:
         """
         # re-use the same data source to take advantage of sessions.
         # see https://requests.readthedocs.io/en/latest/user/advanced/
-        home_index = CategoryIndex(category_url = url, data_src= self._data_source, scraping_generator= self.scraping_generator)
+        home_index = CategoryIndex(category_url = url, data_src= self._data_source, scraping_generator= self.scraping_generator, metrics= self.metrics)
+        categories = [
+            [cat_url, os.path.join(self._output_path, self._gen_output_filename(cat_name))]
+            for cat_url, cat_name in home_index.list_categories().items()]
+        home_index.release()
 
         self._handle_url_hook(url, self.SCRAPE_ALL)
-        for cat_url, cat_name in home_index.list_categories().items():
-            csv_output_file = os.path.join(self._output_path, self._gen_csv_filename(cat_name))
+        if self._is_scheduled():
+            return self._crawl({'scrape_type': self.SCRAPE_ALL, 'scrape_url': url}, categories)
+        return self._scrape_categories({'scrape_type': self.SCRAPE_ALL, 'scrape_url': url}, categories)
+
+    def plan(self, url: str, scrape_type: str = SCRAPE_ALL) -> dict:
+        """
+        Dry run: returns the plan of the crawl of url with the current settings (workers, requests delay, images mode),
+        computed from the category headers without scraping anything (see crawlplan.py).
+        """
+        planner = CrawlPlanner(
+            self.scraping_generator,
+            workers= self._workers,
+            requests_delay= self._data_source_options['requests_delay'],
+            timeout= self._data_source_options['timeout'],
+            images= self._images,
+            image_workers= self._image_workers,
+            scrape_contents= self._scrape_contents)
+        return planner.plan(url, scrape_type)
+
+    def iter_books(self, url: str, scrape_type: str = SCRAPE_ALL, max_pending: int = 100, write_files: bool = False) -> Generator[BookData]:
+        """
+        Scrapes url (the catalog home page, a category page or a product page) and lazily yields the books as they are scraped.
+
+        write_files -- also write the books to the output files, as a second consumer of the books (see create_writer()).
+        The run then leaves the usual state in the output directory (url states, checkpoint, manifest)
+        and handles the images as set by the images mode.
+        Otherwise (default), the stream leaves nothing on disk: the url states of the run are kept in memory,
+        no checkpoint is saved and the images are not downloaded.
+
+        The crawl runs in a background thread (and its workers, see workers). At most max_pending books wait for the consumer:
+        once they are queued, the crawl waits until the consumer catches up (backpressure).
+        Closing the generator (ex. breaking out of the loop) interrupts the crawl, as a KeyboardInterrupt would.
+        An exception raised by the crawl is raised again once the books scraped before it are consumed.
+
+        Usage:
+        ```
+         for book in scraper.iter_books('https://books.toscrape.com/', max_pending= 50):
+            pipeline.send(book.export())
+        ```
+        """
+        if self._book_stream is not None:
+            raise RuntimeError("The scraper is already streaming books")
+        saved_settings = (self._url_store_path, self._checkpoint, self._images)
+        if write_files:
+            if not os.path.exists(self._output_path):
+                os.makedirs(self._output_path, mode = 0o777)
+        else:
+            self._close_url_store()
+            self._url_store_path, self._checkpoint, self._images = ":memory:", None, self.IMAGES_SKIP
+        books = queue.Queue(maxsize= max(1, max_pending))
+        closed = threading.Event()
+        self._book_stream = (books, closed, write_files)
+        end_of_stream = object()
+        errors = []
+
+        def crawl():
+            try:
+                if scrape_type == self.SCRAPE_ALL:
+                    self.scrape_all_categories(url)
+                elif scrape_type == self.SCRAPE_CATEGORY:
+                    self.scrape_category(url)
+                else:
+                    with self.create_writer(os.path.join(self._output_path, self._gen_output_filename("books"))) as writer:
+                        self.scrape_book(url, writer)
+            except StreamClosed:
+                pass
+            except BaseException as e:
+                errors.append(e)
+            finally:
+                while not closed.is_set():
+                    try:
+                        books.put(end_of_stream, timeout= QueueBookDataWriter.PUT_TIMEOUT)
+                        break
+                    except queue.Full:
+                        continue
+
+        crawl_thread = threading.Thread(target= crawl, name= "scraper-stream", daemon= True)
+        crawl_thread.start()
+        try:
+            while (book := books.get()) is not end_of_stream:
+                yield book
+        finally:
+            closed.set()
+            crawl_thread.join()
+            self._book_stream = None
+            if not write_files:
+                self._close_url_store()
+                self._url_store_path, self._checkpoint, self._images = saved_settings
+        if errors:
+            raise errors[0]
+
+    def scrape_url_list(self, targets: list[tuple[str, str]]) -> bool:
+        """
+        Scrapes a list of urls of any type, given as (scrape type, url) pairs: catalog home pages, category pages and product pages.
+        Duplicates are scraped once: the catalogs are expanded to their categories, and the product pages
+        are scraped first, to the output file of their category, so that the category crawls skip them.
+        The product pages are shared by the workers, the categories are crawled as with scrape_all_categories().
+        Returns True on success, or False if errors occured.
+        """
+        product_urls: dict[str, str] = {}
+        category_urls: dict[str, str] = {}
+        for scrape_type, url in targets:
+            if scrape_type == self.SCRAPE_PRODUCT:
+                product_urls.setdefault(self._url_key(url), url)
+            elif scrape_type == self.SCRAPE_CATEGORY:
+                category_urls.setdefault(self._url_key(url), url)
+            elif scrape_type == self.SCRAPE_ALL:
+                home_index = CategoryIndex(category_url = url, data_src= self._data_source, scraping_generator= self.scraping_generator, metrics= self.metrics)
+                for cat_url in home_index.list_categories():
+                    category_urls.setdefault(self._url_key(cat_url), cat_url)
+                home_index.release()
+            else:
+                raise ValueError(f"Unsupported scrape type: {scrape_type}")
+        logger.info(f"Scrape a list of {len(product_urls)} product pages and {len(category_urls)} categories")
+        errors_before = self._errors
+        if product_urls:
+            self._scrape_product_list(list(product_urls.values()))
+        if category_urls:
+            categories = [[cat_url, None] for cat_url in category_urls.values()]
+            run_state = {'scrape_type': self.SCRAPE_ALL, 'scrape_url': next(iter(category_urls.values()))}
+            if self._is_scheduled():
+                self._crawl(run_state, categories)
+            else:
+                self._scrape_categories(run_state, categories)
+        return self._errors == errors_before
+
+    def _scrape_product_list(self, urls: list[str]):
+        """
+        Scrapes a list of product pages with the page workers, each book to the output file of its category.
+        The urls already scraped to the output directory are skipped.
+        """
+        url_store = self._get_url_store()
+        urls = [url for url in urls if url_store is None or not url_store.is_scraped(url)]
+        # category name -> (writer, images directory), created on the first book of the category
+        outputs: dict[str, tuple[AbstractBookDataWriter, str]] = {}
+
+        def route(book: BookData) -> tuple[AbstractBookDataWriter, str]:
+            category_name = book.category or "books"
+            with self._lock:
+                if category_name not in outputs:
+                    output_file = os.path.join(self._output_path, self._gen_output_filename(category_name))
+                    img_dir = os.path.join(self._output_path, 'images', self._gen_filename(category_name))
+                    outputs[category_name] = (self.create_writer(output_file), img_dir)
+                return outputs[category_name]
+
+        def scrape(url: str):
             try:
-                self.scrape_category(cat_url, csv_output_file)
+                if not self.scrape_book(url, route) and self._scrape_contents:
+                    self._record_url_state(url, UrlStateStore.FAILED)
+                    with self._lock:
+                        self._errors += 1
             except Exception as e:
                 e_type = type(e).__name__
-                logger.warning(f"An error ({e_type}) occured while scraping category from URL {cat_url}, skip to next category", exc_info= True)
-                self._errors += 1
+                logger.warning(f"An error ({e_type}) occured while scraping book from URL {url}, skip record", exc_info= True)
+                self._emit_error(url, self.SCRAPE_PRODUCT, e)
+                self._record_url_state(url, UrlStateStore.FAILED)
+                with self._lock:
+                    self._errors += 1
+
+        try:
+            if self._workers == 1:
+                for url in urls:
+                    scrape(url)
+            else:
+                with ThreadPoolExecutor(max_workers= self._workers, thread_name_prefix= "scraper") as executor:
+                    try:
+                        for _ in executor.map(scrape, urls):
+                            pass
+                    except BaseException:
+                        executor.shutdown(wait= True, cancel_futures= True)
+                        raise
+        finally:
+            for writer, _ in outputs.values():
+                writer.close()
+
+    @staticmethod
+    def _url_key(url: str) -> str:
+        """
+        Identifies the urls of the same page: ".../travel_2/index.html" and ".../travel_2/".
+        """
+        return re.sub(r'/(index\.[a-z]{2,4})?$', '', url)
+
+    def resume(self) -> bool:
+        """
+        Resumes an interrupted crawl from the checkpoint saved in the output directory:
+        retries the pending images, finishes the category being scraped, then scrapes the remaining categories.
+        Returns None if no checkpoint was found, otherwise True on success or False if errors occured.
+        """
+        state = self._checkpoint.load() if self._checkpoint else None
+        if state is None:
+            return None
+        logger.info(f"Resume crawl of {state.get('scrape_url')} from checkpoint {self._checkpoint.path}")
+        for image in state.get('pending_images', []):
+            self._fetch_image(image['image_url'], image['universal_product_code'], image['image_dir'])
+        run_state = {'scrape_type': state.get('scrape_type'), 'scrape_url': state.get('scrape_url')}
+        if state.get('frontier'):
+            # interrupted scheduled crawl
+            return self._crawl(run_state, [], state['frontier'])
+        return self._scrape_categories(run_state, state.get('remaining_categories', []), state.get('current_category'))
+
+    def _scrape_categories(self, run_state: dict, categories: list[list[str]], current_category: dict = None) -> bool:
+        """
+        Scrape a list of categories, given as [category url, output file] pairs.
+        current_category -- a partially scraped category to finish first, as saved in a checkpoint.
+        """
+        self._start_run(run_state, categories)
+        if current_category:
+            frontier = (current_category.get('next_index_url', ''), current_category.get('pending_urls', []))
+            self._scrape_category_or_skip(current_category['url'], current_category['output_file'], frontier)
+        while self._remaining_categories:
+            cat_url, output_file = self._remaining_categories.popleft()
+            self._scrape_category_or_skip(cat_url, output_file)
+        self._end_run()
         return self._errors == 0
 
+    def _scrape_category_or_skip(self, cat_url: str, output_file: str, frontier: tuple[str, list[str]] = None):
+        """
+        Scrape a category, log errors and skip to the next category on failure.
+        """
+        try:
+            self.scrape_category(cat_url, output_file, frontier)
+        except Exception as e:
+            e_type = type(e).__name__
+            logger.warning(f"An error ({e_type}) occured while scraping category from URL {cat_url}, skip to next category", exc_info= True)
+            self._emit_error(cat_url, self.SCRAPE_CATEGORY, e)
+            self._errors += 1
+
     @max_attempts_decorator(max_attempts = 2)
-    def scrape_category(self, category_index_url: str, csv_output_file: str = None) -> bool:
+    def scrape_category(self, category_index_url: str, output_file: str = None, frontier: tuple[str, list[str]] = None) -> bool:
         """
         Scrape all books found in a category. The first parameter should point to the category index page.
-        csv_output_file should be a valid path to a csv output file.
-        Appends book data to the output csv file if the url has not been scraped yet.
+        output_file should be a valid path to an output file.
+        Appends book data to the output file if the url has not been scraped yet.
+
+        frontier -- optionally restart from a saved frontier (see ScrapeIndex.frontier()) instead of the first index page.
 
         Returns True on success, False if errors occured.
         """
+        own_run = self._run_state is None
+        if own_run and self._is_scheduled() and not frontier:
+            return self._crawl({'scrape_type': self.SCRAPE_CATEGORY, 'scrape_url': category_index_url}, [[category_index_url, output_file]])
+        if own_run:
+            self._start_run({'scrape_type': self.SCRAPE_CATEGORY, 'scrape_url': category_index_url})
         category_index = self._get_category_index(category_index_url)
-        if not csv_output_file:
-            csv_output_file = os.path.join(self._output_path, self._gen_csv_filename(category_index.category_name))
-        logger.info(f"Scrape category {category_index.category_name} to {csv_output_file}")
+        if frontier:
+            category_index.restore_frontier(*frontier)
+        if not output_file:
+            output_file = os.path.join(self._output_path, self._gen_output_filename(category_index.category_name))
+        logger.info(f"Scrape category {category_index.category_name} to {output_file}")
         self._handle_url_hook(category_index_url, self.SCRAPE_CATEGORY)
-        self._mark_scraped_urls_from_csv(csv_output_file, category_index)
-        writer = BookDataWriter(csv_output_file)
+        writer = self.create_writer(output_file)
+        self._sync_url_state_with_output(writer, category_index)
         img_dir_path = os.path.join(self._output_path, 'images', self._gen_filename(category_index.category_name))
 
         cat_errors = 0
-        for url in category_index.list_urls_to_scrape():
-            try:
-                if not self.scrape_book(url, writer, img_dir_path):
+        self._current_category = {'url': category_index_url, 'output_file': output_file, 'index': category_index}
+        try:
+            for url, listing_hash in category_index.list_items_to_scrape():
+                self._current_url = url
+                try:
+                    if self._is_unchanged(url, listing_hash):
+                        # copied from the previous output at the end of the category
+                        self._record_url_state(url, UrlStateStore.CARRIED, listing_hash= listing_hash, writer= writer)
+                    elif not self.scrape_book(url, writer, img_dir_path, listing_hash):
+                        cat_errors += 1
+                        self._record_url_state(url, UrlStateStore.FAILED, writer= writer)
+                except Exception as e:
+                    e_type = type(e).__name__
+                    logger.warning(f"An error ({e_type}) occured while scraping book from URL {url}, skip record", exc_info= True)
+                    self._emit_error(url, self.SCRAPE_PRODUCT, e)
+                    self._errors += 1
                     cat_errors += 1
-            except Exception as e:
-                e_type = type(e).__name__
-                logger.warning(f"An error ({e_type}) occured while scraping book from URL {url}, skip record", exc_info= True)
-                self._errors += 1
-                cat_errors += 1
+                    self._record_url_state(url, UrlStateStore.FAILED, writer= writer)
+                self._current_url = None
+                self._save_checkpoint()
+            self._carry_forward_books(writer, img_dir_path)
+        except BaseException:
+            # interrupted (or unexpected error): save the frontier before giving up
+            self._save_checkpoint(force= True)
+            if own_run:
+                self._run_state = None
+            raise
+        finally:
+            self._current_category = None
+            self._current_url = None
+            writer.close()
+            # the category is done: don't keep its index (and parsed page) in memory
+            self._release_category_index(category_index_url)
+        if own_run:
+            self._end_run()
         return cat_errors == 0
 
 
     @max_attempts_decorator(max_attempts = 2)
-    def scrape_book(self, product_page_url: str, writer: BookDataWriter, img_dir_path: str = None):
+    def scrape_book(self, product_page_url: str, writer: AbstractBookDataWriter | Callable[[BookData], tuple[AbstractBookDataWriter, str]], img_dir_path: str = None, listing_hash: str = None):
         """
         Scrape book data found on a product page, appends the result to the output file.
+        writer -- the output writer, or a function returning the writer and the images directory of a book once parsed
+        (ex. to write each book to the output file of its category, see scrape_url_list())
+        listing_hash -- hash of the book data shown on the category index, recorded with the url state for incremental recrawls.
         Returns True if successful.
         """
         logger.debug(f"Scrape book: {product_page_url}")
         self._handle_url_hook(product_page_url, self.SCRAPE_PRODUCT)
         if not self._scrape_contents:
             return
-        self._data_source.set_source(product_page_url)
-        book_html = self._data_source.read_text()
+        with self.metrics.measure("product_fetch") as m:
+            self._data_source.set_source(product_page_url, RemoteDataSource.PRODUCT)
+            book_html = self._data_source.read_text()
+            m.bytes = len(self._data_source.response.content)
         success = False
-        if book := self._book_data_reader.read_from_html(book_html, product_page_url):
+        parse_start = time.perf_counter()
+        with self.metrics.measure("parse"):
+            book = self._book_data_reader.read_from_html(book_html, product_page_url)
+        is_valid = False
+        if book:
             book.product_page_url = product_page_url
-            if (book.is_valid()):
-                if writer.append_data(book):
+            with self.metrics.measure("validate"):
+                is_valid = book.is_valid()
+        self.events.emit(EventBus.PARSE_DONE, url= product_page_url, valid= is_valid, elapsed= time.perf_counter() - parse_start)
+        if book:
+            if is_valid:
+                if not isinstance(writer, AbstractBookDataWriter):
+                    writer, img_dir_path = writer(book)
+                with self.metrics.measure("write"):
+                    written = writer.append_data(book)
+                if written:
                     success = True
-                    logger.debug(f"Exported book data to csv file")
+                    self.metrics.count("books_written")
+                    self.events.emit(
+                        EventBus.RECORD_WRITTEN,
+                        url= product_page_url, output_file= writer.full_file_path, universal_product_code= book.universal_product_code)
+                    logger.debug(f"Exported book data to output file")
+                    content_hash = hashlib.sha256(book_html.encode()).hexdigest()
+                    self._record_url_state(product_page_url, UrlStateStore.SCRAPED, content_hash= content_hash, listing_hash= listing_hash, writer= writer)
                     # download the image as well
                     if not img_dir_path:
                         img_dir_path = os.path.join(self._output_path, 'images')
                     self._fetch_book_image(book, img_dir_path)
             else:
+                self.metrics.count("books_invalid")
                 logger.warning(f"Scraping produced invalid book data at {product_page_url}, skip record.")
         return success
 
+    def _is_scheduled(self) -> bool:
+        """
+        Returns True if the categories are crawled by the scheduler and its workers (see _crawl()).
+        """
+        return self._workers > 1
+
+    def _crawl(self, run_state: dict, categories: list[list[str]], saved_frontier: dict = None) -> bool:
+        """
+        Scheduled crawl of a list of categories, given as [category url, output file] pairs (the output file may be None).
+        Page workers scrape the index and product pages of all the categories at once, in the order set by the frontier
+        (see CrawlFrontier).
+
+        saved_frontier -- restart from a frontier saved to a checkpoint (see _save_checkpoint())
+        Returns True on success, or False if errors occured.
+        """
+        self._frontier = CrawlFrontier()
+        self._scheduled_categories = {}
+        for cat_url, output_file in categories:
+            self._scheduled_categories[cat_url] = {'output_file': output_file, 'lock': threading.Lock()}
+            self._frontier.push(CrawlFrontier.INDEX, cat_url, cat_url, payload= {'first_page': True})
+        if saved_frontier:
+            for cat_url, output_file in saved_frontier.get('categories', []):
+                self._scheduled_categories[cat_url] = {'output_file': output_file, 'lock': threading.Lock()}
+            url_store = self._get_url_store()
+            for task in saved_frontier.get('tasks', []):
+                if task['class'] == CrawlFrontier.PRODUCT and url_store is not None and url_store.is_scraped(task['url']):
+                    continue
+                self._frontier.push(task['class'], task['url'], task['category'], task['staleness'], task['payload'])
+        self._start_run(run_state)
+        logger.info(f"Crawl {len(self._scheduled_categories)} categories with {self._workers} workers")
+        executor = ThreadPoolExecutor(max_workers= self._workers, thread_name_prefix= "scraper")
+        try:
+            try:
+                futures = [executor.submit(self._page_worker) for _ in range(self._workers)]
+                for future in futures:
+                    future.result()
+            except BaseException:
+                # interrupted: let the workers finish their current task, then save the frontier
+                self._frontier.close()
+                executor.shutdown(wait= True)
+                self._save_checkpoint(force= True)
+                self._run_state = None
+                raise
+            executor.shutdown(wait= True)
+            # the scheduler is done, finish the categories in the calling thread
+            self._frontier = None
+            for category in self._scheduled_categories.values():
+                if writer := category.get('writer'):
+                    self._carry_forward_books(writer, category['img_dir'])
+        finally:
+            self._frontier = None
+            for category in self._scheduled_categories.values():
+                if writer := category.get('writer'):
+                    writer.close()
+            self._scheduled_categories = {}
+        self._end_run()
+        return self._errors == 0
+
+    def _page_worker(self):
+        """
+        Scheduled crawl: scrapes the index and product pages served by the frontier, until it is drained.
+        """
+        while (task := self._frontier.pop(CrawlFrontier.PAGES)) is not None:
+            try:
+                if task['class'] == CrawlFrontier.INDEX:
+                    self._crawl_index_page(task)
+                else:
+                    self._crawl_product_page(task)
+            except Exception as e:
+                e_type = type(e).__name__
+                logger.warning(f"An error ({e_type}) occured while scraping URL {task['url']}, skip", exc_info= True)
+                self._emit_error(task['url'], self.SCRAPE_PRODUCT if task['class'] == CrawlFrontier.PRODUCT else self.SCRAPE_CATEGORY, e)
+                with self._lock:
+                    self._errors += 1
+                if task['class'] == CrawlFrontier.PRODUCT:
+                    category = self._scheduled_categories.get(task['category'], {})
+                    self._record_url_state(task['url'], UrlStateStore.FAILED, writer= category.get('writer'))
+            except BaseException:
+                # interrupted: stop all the workers, the task stays in the frontier
+                self._frontier.close()
+                raise
+            self._frontier.task_done(task)
+            self._save_checkpoint()
+
+    def _get_scheduled_category(self, category_url: str) -> dict:
+        """
+        Scheduled crawl: returns the state of a category (index, writer, images directory),
+        the category page is read the first time the category is needed.
+        """
+        with self._lock:
+            category = self._scheduled_categories.setdefault(category_url, {'output_file': None, 'lock': threading.Lock()})
+        with category['lock']:
+            if 'index' not in category:
+                category_index = CategoryIndex(
+                    category_url= category_url,
+                    data_src= self._data_source,
+                    scraping_generator= self.scraping_generator,
+                    url_store= self._get_url_store(),
+                    seen_urls= create_url_set(**self._seen_urls_options),
+                    metrics= self.metrics)
+                output_file = category['output_file'] or os.path.join(self._output_path, self._gen_output_filename(category_index.category_name))
+                logger.info(f"Scrape category {category_index.category_name} to {output_file}")
+                self._handle_url_hook(category_url, self.SCRAPE_CATEGORY)
+                writer = self.create_writer(output_file)
+                self._sync_url_state_with_output(writer, category_index)
+                category.update({
+                    'index': category_index,
+                    'output_file': output_file,
+                    'writer': writer,
+                    'img_dir': os.path.join(self._output_path, 'images', self._gen_filename(category_index.category_name))
+                })
+        return category
+
+    def _crawl_index_page(self, task: dict):
+        """
+        Scheduled crawl: reads an index page, schedules the products not scraped yet and the next index page.
+        """
+        category = self._get_scheduled_category(task['category'])
+        category_index: CategoryIndex = category['index']
+        with category['lock']:
+            category_soup = category_index.category_soup if task['payload'].get('first_page') else None
+            category_index.release()
+        if category_soup is not None:
+            # the first index page is the category page
+            listing_items, next_index_url = category_index.read_index_soup(category_soup, task['url'])
+        else:
+            listing_items, next_index_url = category_index.read_index_page(task['url'], data_src= self._data_source)
+        for item in listing_items:
+            url = item['url']
+            if not category_index.claim_url(url):
+                continue
+            listing_hash = ScrapeIndex.listing_hash(item)
+            if self._is_unchanged(url, listing_hash):
+                # copied from the previous output once the crawl is done
+                self._record_url_state(url, UrlStateStore.CARRIED, listing_hash= listing_hash, writer= category['writer'])
+            else:
+                self._frontier.push(CrawlFrontier.PRODUCT, url, task['category'], self._staleness(url), {'listing_hash': listing_hash})
+        if next_index_url:
+            self._frontier.push(CrawlFrontier.INDEX, next_index_url, task['category'])
+
+    def _crawl_product_page(self, task: dict):
+        """
+        Scheduled crawl: scrapes a product page to the output file of its category.
+        """
+        category = self._get_scheduled_category(task['category'])
+        with category['lock']:
+            # the category was read again to resume a crawl: its page is not needed
+            category['index'].release()
+        if not self.scrape_book(task['url'], category['writer'], category['img_dir'], task['payload'].get('listing_hash')):
+            self._record_url_state(task['url'], UrlStateStore.FAILED, writer= category['writer'])
+
+    def _staleness(self, url: str) -> float:
+        """
+        Scheduled crawl: returns the timestamp of the last update of a url (0 if never seen),
+        from the state of the previous run in incremental mode.
+        """
+        url_store = self._get_previous_url_store() or self._get_url_store()
+        state = url_store.get_state(url) if url_store is not None else None
+        return state['updated_at'] if state else 0.0
+
+    def work(self, queue: SqliteWorkQueue, scrape_url: str, scrape_type: str = SCRAPE_ALL, worker_id: str = None, poll_interval: float = 1.0, merge: bool = True, reset_queue: bool = False) -> bool:
+        """
+        Worker mode: scrape the tasks leased from a work queue shared with other workers,
+        in other processes or on other hosts sharing the output directory.
+
+        Every worker seeds the queue with the scrape url (the full catalog or a category index), which is a no-op
+        once the queue is seeded. A queue already finished by a previous run is refused, unless reset_queue is set:
+        the first worker then restarts the queue for a new run (see SqliteWorkQueue.restart()). Index pages and product pages are then leased one at a time: index pages add the
+        products they list and their next page to the queue. The task of a worker that died is handed to another
+        worker once its lease expires.
+
+        Each worker writes its books to its own partition in the output directory (parts/<worker_id>/),
+        images are written to the shared images directory.
+        Once the queue is finished, the first worker to get there merges the partitions (see merge_partitions()).
+        The merge lock is renewed while merging and released once the merge is done or failed (see SqliteWorkQueue.holding()):
+        it only expires if the elected worker dies, so that another worker merges the partitions.
+
+        Returns True if this worker completed all its tasks.
+        """
+        if self._previous_output_path:
+            logger.warning("Incremental recrawl is not supported in worker mode, all books will be scraped.")
+            self._previous_output_path = None
+        worker_id = worker_id or default_worker_id()
+        if scrape_type == self.SCRAPE_ALL:
+            seed_kind = self.TASK_CATALOG
+        elif scrape_type == self.SCRAPE_CATEGORY:
+            seed_kind = self.TASK_CATEGORY
+        else:
+            raise ValueError(f"Unsupported scrape type in worker mode: {scrape_type}")
+        if not queue.put(seed_kind, scrape_url) and queue.is_finished():
+            if not reset_queue:
+                logger.error(f"The work queue {queue.db_path} was finished by a previous run: use a new queue, or reset it.")
+                return False
+            if queue.restart(seed_kind, scrape_url):
+                logger.info(f"Work queue {queue.db_path} reset for a new run")
+
+        # the url states of the worker are kept in its partition, the shared store is only read
+        partition_dir = os.path.join(self._output_path, self.PARTITIONS_DIR, self._gen_filename(worker_id))
+        shared_url_store_path = self._url_store_path
+        shared_url_store = None
+        if self._scrape_contents and os.path.isfile(shared_url_store_path):
+            shared_url_store = UrlStateStore(shared_url_store_path, read_only= True)
+        self.close()
+        self._url_store_path = os.path.join(partition_dir, UrlStateStore.DEFAULT_FILENAME)
+        writers: dict[str, AbstractBookDataWriter] = {}
+        worker_errors = 0
+        logger.info(f"Worker {worker_id} started, writing to {partition_dir}")
+        try:
+            while not queue.is_finished():
+                task = queue.lease(worker_id)
+                if task is None:
+                    time.sleep(poll_interval)
+                    continue
+                try:
+                    if self._handle_task(queue, task, partition_dir, writers, shared_url_store):
+                        queue.complete(task['id'], worker_id)
+                    else:
+                        worker_errors += 1
+                        queue.fail(task['id'], worker_id, "scraping failed")
+                except Exception as e:
+                    e_type = type(e).__name__
+                    logger.warning(f"An error ({e_type}) occured on {task['kind']} task {task['url']}, release task", exc_info= True)
+                    self._emit_error(task['url'], task['kind'], e)
+                    worker_errors += 1
+                    queue.fail(task['id'], worker_id, f"{e_type}: {e}")
+        finally:
+            for writer in writers.values():
+                writer.close()
+            if shared_url_store is not None:
+                shared_url_store.close()
+            self.close()
+            self._url_store_path = shared_url_store_path
+        logger.info(f"Worker {worker_id} done, queue: {queue.counts()}")
+        if merge and self._scrape_contents and queue.try_acquire("merge", worker_id):
+            with queue.holding("merge", worker_id):
+                self.merge_partitions(queue)
+        return worker_errors == 0
+
+    def _handle_task(self, queue: SqliteWorkQueue, task: dict, partition_dir: str, writers: dict[str, AbstractBookDataWriter], shared_url_store: UrlStateStore = None) -> bool:
+        """
+        Handles a task leased from the work queue (see work()). Returns True on success.
+        """
+        kind, url, payload = task['kind'], task['url'], task['payload']
+        if kind == self.TASK_CATALOG:
+            self._handle_url_hook(url, self.SCRAPE_ALL)
+            home_index = CategoryIndex(category_url= url, data_src= self._data_source, scraping_generator= self.scraping_generator, metrics= self.metrics)
+            queue.put_many([
+                (self.TASK_INDEX, cat_url, {'category_name': cat_name}, 0)
+                for cat_url, cat_name in home_index.list_categories().items()])
+            return True
+        if kind == self.TASK_CATEGORY:
+            category_index = CategoryIndex(category_url= url, data_src= self._data_source, scraping_generator= self.scraping_generator, metrics= self.metrics)
+            queue.put(self.TASK_INDEX, url, {'category_name': category_index.category_name}, 0)
+            return True
+        if kind == self.TASK_INDEX:
+            if not payload.get('next_page'):
+                self._handle_url_hook(url, self.SCRAPE_CATEGORY)
+            urls_index = ScrapeIndex(data_src= self._data_source, scraping_generator= self.scraping_generator, metrics= self.metrics)
+            listing_items, next_index_url = urls_index.read_index_page(url)
+            queue.put_many([
+                (self.TASK_PRODUCT, item['url'], {'category_name': payload.get('category_name', ''), 'listing_hash': ScrapeIndex.listing_hash(item)}, 1)
+                for item in listing_items
+                if shared_url_store is None or not shared_url_store.is_scraped(item['url'])])
+            if next_index_url:
+                queue.put(self.TASK_INDEX, next_index_url, dict(payload, next_page= True), 0)
+            return True
+        if kind == self.TASK_PRODUCT:
+            category_name = payload.get('category_name') or 'books'
+            if category_name not in writers:
+                if not os.path.exists(partition_dir):
+                    os.makedirs(partition_dir, mode = 0o777)
+                # partitions are never compressed: plain files are flushed row by row, and can be merged at any time
+                partition_file = os.path.join(partition_dir, self._gen_filename(category_name, WRITER_FORMATS[self._output_format].file_extension))
+                writers[category_name] = create_writer(partition_file, output_format= self._output_format)
+            img_dir_path = os.path.join(self._output_path, 'images', self._gen_filename(category_name))
+            success = self.scrape_book(url, writers[category_name], img_dir_path, payload.get('listing_hash'))
+            return success or not self._scrape_contents
+        raise ValueError(f"Unknown task kind: {kind}")
+
+    def merge_partitions(self, queue: SqliteWorkQueue = None) -> int:
+        """
+        Merges the partitioned outputs of the workers (see work()) into the output files of the output directory,
+        with the configured format and compression. Books already found in an output file are skipped.
+        The partition files are removed once merged, and the partition of a worker once all its files are merged.
+        With the work queue, the partitions of the workers still holding a task lease are left for a later merge.
+        Returns the number of books merged.
+        """
+        parts_dir = os.path.join(self._output_path, self.PARTITIONS_DIR)
+        if not os.path.isdir(parts_dir):
+            return 0
+        active_dirs = {self._gen_filename(worker_id) for worker_id in queue.active_workers()} if queue is not None else set()
+        # group the partition files by output file
+        partitions: dict[str, list[str]] = {}
+        merged_dirs: list[str] = []
+        with os.scandir(parts_dir) as worker_dirs:
+            for worker_dir in worker_dirs:
+                if not worker_dir.is_dir():
+                    continue
+                if worker_dir.name in active_dirs:
+                    logger.info(f"Worker partition {worker_dir.path} is still in use, not merged")
+                    continue
+                merged_dirs.append(worker_dir.path)
+                with os.scandir(worker_dir.path) as entries:
+                    for entry in entries:
+                        if not entry.is_file() or entry.name.startswith("."):
+                            continue
+                        try:
+                            output_format, _ = guess_output_format(entry.name)
+                        except ValueError:
+                            continue
+                        name = entry.name[:-len(WRITER_FORMATS[output_format].file_extension)]
+                        output_file = os.path.join(self._output_path, self._gen_output_filename(name))
+                        partitions.setdefault(output_file, []).append(entry.path)
+        merged_count = 0
+        url_store = self._get_url_store()
+        for output_file, partition_files in sorted(partitions.items()):
+            with self.create_writer(output_file) as writer:
+                merged_urls = DigestUrlSet()
+                for record in writer.read_records():
+                    merged_urls.add(record.get('product_page_url', ''))
+                new_urls = []
+                for partition_file in sorted(partition_files):
+                    for record in read_output_records(partition_file):
+                        url = record.get('product_page_url', '')
+                        if url in merged_urls:
+                            continue
+                        merged_urls.add(url)
+                        writer.append_record(record)
+                        new_urls.append(url)
+            if url_store is not None and new_urls:
+                url_store.set_many_scraped(new_urls, output_file= self._output_key(output_file))
+            merged_count += len(new_urls)
+            logger.info(f"Merged {len(new_urls)} books from {len(partition_files)} partitions to {output_file}")
+            for partition_file in partition_files:
+                os.remove(partition_file)
+        # the partitions left with only the url states of their worker are done
+        for worker_dir in merged_dirs:
+            if all(name.startswith(".") for name in os.listdir(worker_dir)):
+                shutil.rmtree(worker_dir, ignore_errors= True)
+        if not os.listdir(parts_dir):
+            os.rmdir(parts_dir)
+        return merged_count
+
+    def _start_run(self, run_state: dict, categories: list[list[str]] = None):
+        """
+        Initialize the state of a new run, as saved to the checkpoint.
+        """
+        self._run_state = run_state
+        self._remaining_categories = deque(categories or [])
+        self._save_checkpoint(force= True)
+        if self._images == self.IMAGES_BACKGROUND and self._scrape_contents \
+                and os.path.isfile(os.path.join(self._output_path, ImagePipeline.DEFAULT_FILENAME)):
+            # download the images left by a previous run along with the crawl
+            self._get_image_pipeline()
+
+    def _end_run(self):
+        """
+        Called once a run is completed: the checkpoint is removed,
+        unless some images could not be downloaded and should be retried on resume.
+        """
+        if self._checkpoint:
+            if self._pending_images:
+                logger.warning(f"{len(self._pending_images)} images could not be downloaded, use resume to retry.")
+                self._save_checkpoint(force= True)
+            else:
+                self._checkpoint.clear()
+        self._run_state = None
+
+    def _save_checkpoint(self, force: bool = False):
+        """
+        Saves the crawl frontier: remaining categories, position in the current category and pending images.
+        Unless forced, the checkpoint is only written once per checkpoint interval.
+        """
+        if self._checkpoint is None or self._run_state is None:
+            return
+        if not force and not self._checkpoint.is_due():
+            return
+        with self._lock:
+            self._checkpoint.save(self._checkpoint_state(), force= True)
+
+    def _checkpoint_state(self) -> dict:
+        """
+        Returns the state of the current run, as saved to the checkpoint.
+        """
+        state = dict(self._run_state)
+        state['remaining_categories'] = list(self._remaining_categories)
+        state['current_category'] = None
+        if self._current_category:
+            next_index_url, pending_urls = self._current_category['index'].frontier()
+            if self._current_url:
+                # the url being scraped is not done yet
+                pending_urls.insert(0, self._current_url)
+            state['current_category'] = {
+                'url': self._current_category['url'],
+                'output_file': self._current_category['output_file'],
+                'next_index_url': next_index_url,
+                'pending_urls': pending_urls
+            }
+        if self._frontier is not None:
+            state['frontier'] = {
+                'categories': [[cat_url, category['output_file']] for cat_url, category in self._scheduled_categories.items()],
+                'tasks': self._frontier.snapshot()
+            }
+        state['pending_images'] = list(self._pending_images.values())
+        return state
+
     def _get_category_index(self, category_index_url) -> CategoryIndex:
         """
         Cache category indexes and find them by the category URL.
+        The cache is bounded: the least recently used indexes are evicted.
         """
-        if category_index_url not in self._category_indexes:
+        if category_index_url in self._category_indexes:
+            self._category_indexes.move_to_end(category_index_url)
+        else:
+            while len(self._category_indexes) >= self._category_cache_size:
+                evicted_url, _ = self._category_indexes.popitem(last= False)
+                logger.debug(f"Evict category index {evicted_url} from cache")
+                self._release_category_index(evicted_url)
             self._category_indexes[category_index_url] = CategoryIndex(
                 category_url= category_index_url,
                 data_src= self._data_source,
-                scraping_generator= self.scraping_generator)
+                scraping_generator= self.scraping_generator,
+                url_store= self._get_url_store(),
+                seen_urls= create_url_set(**self._seen_urls_options),
+                metrics= self.metrics)
         return self._category_indexes[category_index_url]
 
-    def _gen_csv_filename(self, name: str) -> str:
+    def _release_category_index(self, category_index_url):
+        """
+        Removes a category index from the cache and drops its parsed page.
+        """
+        if category_index := self._category_indexes.pop(category_index_url, None):
+            category_index.release()
+
+    def _get_url_store(self) -> UrlStateStore:
+        """
+        Lazily opens the persistent url state store. Returns None when only listing URLs.
+        """
+        if self._url_store is None and self._scrape_contents:
+            store_dir = os.path.dirname(self._url_store_path)
+            if store_dir and not os.path.exists(store_dir):
+                os.makedirs(store_dir, mode = 0o777)
+            self._url_store = UrlStateStore(self._url_store_path)
+        return self._url_store
+
+    def _close_url_store(self):
+        if self._url_store is not None:
+            self._url_store.close()
+            self._url_store = None
+
+    def _get_manifest(self) -> FileManifest:
+        """
+        Lazily opens the manifest of the output directory.
+        """
+        with self._lock:
+            if self._manifest is None:
+                if not os.path.exists(self._output_path):
+                    os.makedirs(self._output_path, mode = 0o777)
+                self._manifest = FileManifest(self._output_path)
+            return self._manifest
+
+    def _output_key(self, output_file: str) -> str:
+        """
+        Identifies an output file in the url state store, by its path relative to the output directory.
+        """
+        return os.path.relpath(os.path.abspath(output_file), os.path.abspath(self._output_path))
+
+    def _record_url_state(self, url: str, status: str, content_hash: str = None, listing_hash: str = None, writer: AbstractBookDataWriter = None):
+        """
+        Records the outcome of a scraping to the persistent url state store (see UrlStateStore statuses).
+        """
+        if status == UrlStateStore.FAILED:
+            self.metrics.count("books_failed")
+        if url_store := self._get_url_store():
+            url_store.set_state(
+                url,
+                status,
+                content_hash= content_hash,
+                listing_hash= listing_hash,
+                output_file= self._output_key(writer.full_file_path) if writer else None)
+
+    def _get_previous_url_store(self) -> UrlStateStore:
+        """
+        Lazily opens the url state store of the previous run (read only), in incremental recrawl mode.
+        Returns None if not in incremental mode or if the previous run has no url state store.
+        """
+        if self._previous_url_store is None and self._previous_output_path and self._scrape_contents:
+            previous_store_path = os.path.join(self._previous_output_path, UrlStateStore.DEFAULT_FILENAME)
+            if not os.path.isfile(previous_store_path):
+                logger.warning(f"No url state found in {self._previous_output_path}, all books will be scraped.")
+                self._previous_output_path = None
+                return None
+            self._previous_url_store = UrlStateStore(previous_store_path, read_only= True)
+        return self._previous_url_store
+
+    def _is_unchanged(self, url: str, listing_hash: str) -> bool:
+        """
+        Incremental recrawl: returns True if the book was scraped by the previous run,
+        and its data shown on the listing has not changed since.
+        """
+        if listing_hash is None or (previous_store := self._get_previous_url_store()) is None:
+            return False
+        previous_state = previous_store.get_state(url)
+        return previous_state is not None \
+            and previous_state['status'] == UrlStateStore.SCRAPED \
+            and previous_state['listing_hash'] == listing_hash
+
+    def _carry_forward_books(self, writer: AbstractBookDataWriter, img_dir_path: str):
+        """
+        Incremental recrawl: copies the unchanged books of the category (and their images) from the previous output.
+        Streams the previous output files, the books not found there are scraped again.
+        """
+        url_store = self._get_url_store()
+        previous_store = self._get_previous_url_store()
+        if url_store is None or previous_store is None:
+            return
+        output_key = self._output_key(writer.full_file_path)
+        carried_urls = url_store.list_output_urls(output_key, UrlStateStore.CARRIED)
+        if not carried_urls:
+            return
+        # group the urls to carry by previous output file
+        previous_outputs: dict[str, dict[str, dict]] = {}
+        for url in carried_urls:
+            if previous_state := previous_store.get_state(url):
+                previous_outputs.setdefault(previous_state['output_file'], {})[url] = previous_state
+        carried_count = 0
+        for previous_output_key, previous_states in previous_outputs.items():
+            previous_file = os.path.join(self._previous_output_path, previous_output_key or '')
+            if not previous_output_key or not os.path.isfile(previous_file):
+                continue
+            for record in read_output_records(previous_file):
+                if previous_state := previous_states.pop(record.get('product_page_url'), None):
+                    writer.append_record(record)
+                    self.metrics.count("books_carried")
+                    self._carry_forward_image(record, img_dir_path)
+                    self._record_url_state(
+                        previous_state['url'], UrlStateStore.SCRAPED,
+                        content_hash= previous_state['content_hash'], listing_hash= previous_state['listing_hash'], writer= writer)
+                    carried_count += 1
+        logger.info(f"Copied {carried_count} unchanged books from previous output {self._previous_output_path}")
+        # books not found in the previous output: scrape them
+        missing_urls = set(carried_urls).difference(url_store.list_output_urls(output_key, UrlStateStore.SCRAPED))
+        for url in missing_urls:
+            logger.warning(f"Unchanged book {url} not found in previous output, scrape it again")
+            # the listing hash recorded with the carried state, so that the next recrawl finds the book unchanged
+            listing_hash = (url_store.get_state(url) or {}).get('listing_hash')
+            if not self.scrape_book(url, writer, img_dir_path, listing_hash):
+                self._record_url_state(url, UrlStateStore.FAILED, writer= writer)
+
+    def _carry_forward_image(self, record: dict, img_dir_path: str):
+        """
+        Incremental recrawl: links (or copies) the image of an unchanged book from the previous output,
+        or downloads it if not found.
+        """
+        if self._images == self.IMAGES_SKIP:
+            return
+        universal_product_code = record.get('universal_product_code', '')
+        previous_img_dir = os.path.join(self._previous_output_path, os.path.relpath(img_dir_path, self._output_path))
+        for subtype in self.IMAGE_SUBTYPES:
+            previous_img_file = os.path.join(previous_img_dir, self._gen_filename(universal_product_code, f".{subtype}"))
+            if os.path.isfile(previous_img_file):
+                if not os.path.exists(img_dir_path):
+                    os.makedirs(img_dir_path, mode = 0o777)
+                self._link_or_copy(previous_img_file, os.path.join(img_dir_path, os.path.basename(previous_img_file)))
+                return
+        if image_url := record.get('image_url'):
+            self._handle_image(image_url, universal_product_code, img_dir_path)
+
+    @staticmethod
+    def _link_or_copy(source_file: str, target_file: str):
+        """
+        Hard links a file of a previous output: the snapshots share the unchanged files instead of copying them.
+        Falls back to a copy if the file system does not support hard links (or across file systems).
+        The output files are never written through: a new image replaces the link (see _save_image()).
+        """
+        if os.path.lexists(target_file):
+            os.remove(target_file)
+        try:
+            os.link(source_file, target_file)
+        except OSError:
+            shutil.copy2(source_file, target_file)
+
+    def _sync_url_state_with_output(self, writer: AbstractBookDataWriter, urls_index: ScrapeIndex):
+        """
+        Makes sure the url state store is consistent with an existing output file:
+        urls found in the output file but not recorded as scraped are imported
+        (output written without a state store, or a run interrupted between writing a record and recording its url:
+        these books are not scraped twice on resume),
+        and the urls recorded for an output file that has since been deleted are forgotten.
+        Without a state store, just mark the urls found in the output file as scraped.
+        """
+        url_store = self._get_url_store()
+        if url_store is None:
+            self._mark_scraped_urls_from_output(writer, urls_index)
+            return
+        output_key = self._output_key(writer.full_file_path)
+        has_output = os.path.isfile(writer.full_file_path) and os.stat(writer.full_file_path).st_size > 0
+        recorded_urls = url_store.count_output_urls(output_key)
+        if has_output:
+            scraped_urls = set(url_store.list_output_urls(output_key, UrlStateStore.SCRAPED))
+            missing_urls = [url for row in writer.read_records() if (url := row.get('product_page_url')) and url not in scraped_urls]
+            if missing_urls:
+                logger.info(f"Import {len(missing_urls)} scraped urls from existing output file {writer.full_file_path}")
+                url_store.set_many_scraped(missing_urls, output_file= output_key)
+        elif recorded_urls > 0:
+            logger.info(f"Output file {writer.full_file_path} not found, forget {recorded_urls} recorded urls")
+            url_store.forget_output(output_key)
+
+    def close(self):
+        """
+        Releases the resources held by the scraper (url state store, image pipeline).
+        In background mode, waits for the pending images to be downloaded first.
+        """
+        if self._image_pipeline is not None:
+            if self._images == self.IMAGES_BACKGROUND:
+                logger.info(f"Wait for {self._image_pipeline.pending_count()} pending images")
+                self._image_pipeline.join()
+            self._image_pipeline.close()
+            self._image_pipeline = None
+        if self._hedging is not None:
+            self._hedging.close()
+        if self._timeouts is not None:
+            logger.info(f"Adaptive read timeouts: {self._timeouts.summary()}")
+        self._record_connection_stats()
+        if self._own_session:
+            self._session.close()
+        if self._written_output_files:
+            # the output files are complete: record them to the manifest
+            manifest = self._get_manifest()
+            for output_file in sorted(self._written_output_files):
+                if os.path.isfile(output_file):
+                    manifest.record_file(output_file)
+            self._written_output_files.clear()
+        if self._manifest is not None:
+            self._manifest.close()
+            self._manifest = None
+        self._close_url_store()
+        if self._previous_url_store is not None:
+            self._previous_url_store.close()
+            self._previous_url_store = None
+
+    def _record_connection_stats(self):
         """
-        Returns a valid csv basename with a .csv extension. Spaces and slashes are replaced by an underscore character ('_').
+        Counts the connections opened and re-used since the last call to the metrics
+        ("connections_new", "connections_reused", "tls_handshakes").
         """
-        return self._gen_filename(name, '.csv')
+        stats = connection_stats(self._session)
+        new = {counter: n - self._connections_baseline.get(counter, 0) for counter, n in stats.items()}
+        self._connections_baseline = stats
+        if new['requests'] == 0:
+            return
+        logger.info(
+            f"Connections: {new['requests']} requests, {new['new_connections']} new connections "
+            f"({new['tls_handshakes']} TLS handshakes), {new['reused_connections']} re-used")
+        for counter, metric in (('new_connections', "connections_new"), ('reused_connections', "connections_reused"), ('tls_handshakes', "tls_handshakes")):
+            if new[counter] > 0:
+                self.metrics.count(metric, new[counter])
+
+    def create_writer(self, output_file: str) -> AbstractBookDataWriter:
+        """
+        Returns a writer for the configured output format and compression.
+        The output file is recorded to the manifest when the scraper is closed.
+        While streaming the books (see iter_books()), returns a writer handing the books to the consumer,
+        and to the output file if the stream writes the files.
+        """
+        if self._book_stream is not None:
+            books, closed, write_files = self._book_stream
+            file_writer = self._create_file_writer(output_file) if write_files else None
+            return QueueBookDataWriter(output_file, books, closed, file_writer)
+        return self._create_file_writer(output_file)
+
+    def _create_file_writer(self, output_file: str) -> AbstractBookDataWriter:
+        with self._lock:
+            self._written_output_files.add(output_file)
+        return create_writer(output_file, output_format= self._output_format, compression= self._compression)
+
+    def _gen_output_filename(self, name: str) -> str:
+        """
+        Returns a valid output file basename with the extension matching the output format (ex.: .csv, .jsonl.gz).
+        Spaces and slashes are replaced by an underscore character ('_').
+        """
+        return self._gen_filename(name, output_file_suffix(self._output_format, self._compression))
 
     def _gen_filename(self, name: str, suffix: str = "") -> str:
         """
@@ -168,43 +1312,142 @@ class Scraper:
         """
         return re.sub(r'[\s/]+', '_', name.strip(" /")) + suffix
 
-    def _mark_scraped_urls_from_csv(self, csv_file: str, urls_index: ScrapeIndex):
+    def _mark_scraped_urls_from_output(self, writer: AbstractBookDataWriter, urls_index: ScrapeIndex):
         """
-        Read the urls found in a csv file and mark them as already scraped.
-        The method first checks if the file exists.
+        Read the urls found in an existing output file and mark them as already scraped.
         """
-        if os.path.exists(csv_file) and os.path.isfile(csv_file) and os.stat(csv_file).st_size > 0:
-            with open(csv_file, "r") as f:
-                csv_reader = csv.DictReader(f)
-                for row in csv_reader:
-                    if url := row['product_page_url']:
-                        urls_index.mark_url(url)
+        for row in writer.read_records():
+            if url := row.get('product_page_url'):
+                urls_index.mark_url(url)
     
     def _handle_url_hook(self, url: str, scrape_type: str):
         """
-        call a custom handler, if set
+        Publishes a scrape event (see custom_url_handler)
         """
-        if isinstance(self._custom_url_handler, Callable):
-            self._custom_url_handler(url= url, scrape_type= scrape_type)
+        self.events.emit(EventBus.SCRAPE, url= url, scrape_type= scrape_type)
+
+    def _emit_error(self, url: str, context: str, error: Exception):
+        """
+        Publishes an error event.
+        """
+        self.events.emit(EventBus.ERROR, url= url, context= context, error_type= type(error).__name__, message= str(error))
 
-    @max_attempts_decorator(2)
     def _fetch_book_image(self, book: BookData, image_dir: str) -> str:
         """
-        Fetch the image file from an URL and store it to image directory.
-        The local file will be named after the book title, with the appropriate file extension.
+        Fetch the image file of a book and store it to image directory.
         Returns the local image filename on success, None on failure.
         """
         if book.image_url:
-            logger.debug(f"Downloading book image from {book.image_url}")
-            self._handle_url_hook(book.image_url, self.SCRAPE_IMAGE)
-            if img_data := self._data_source.fetch_binary(book.image_url):
-                if not os.path.exists(image_dir):
-                    os.makedirs(image_dir, mode = 0o777)
-                mime_type, mime_subtype = self._data_source.mime_type()
-                if mime_subtype.lower() in ['jpeg', 'jpg', 'png', 'gif']:
-                    img_file = os.path.join(image_dir, self._gen_filename(book.universal_product_code, f".{mime_subtype.lower()}"))
-                    logger.debug(f"write image to {img_file}")
-                    with open(img_file, "wb") as f:
-                        f.write(img_data)
-                        return img_file
+            return self._handle_image(book.image_url, book.universal_product_code, image_dir)
         return None
+
+    def _handle_image(self, image_url: str, universal_product_code: str, image_dir: str) -> str:
+        """
+        Downloads an image right away, or adds it to the image pipeline, depending on the images mode.
+        Returns the local image filename if downloaded.
+        """
+        if self._images == self.IMAGES_SKIP:
+            return None
+        if self._images == self.IMAGES_INLINE:
+            return self._fetch_image(image_url, universal_product_code, image_dir)
+        self._get_image_pipeline().add(image_url, universal_product_code, image_dir)
+        return None
+
+    def _get_image_pipeline(self) -> ImagePipeline:
+        """
+        Lazily opens the image pipeline of the output directory, and starts it in background mode.
+        """
+        with self._lock:
+            if self._image_pipeline is None:
+                if not os.path.exists(self._output_path):
+                    os.makedirs(self._output_path, mode = 0o777)
+                self._image_pipeline = ImagePipeline(
+                    os.path.join(self._output_path, ImagePipeline.DEFAULT_FILENAME),
+                    download= self._save_image,
+                    workers= self._image_workers)
+                if self._images == self.IMAGES_BACKGROUND:
+                    self._image_pipeline.start()
+            return self._image_pipeline
+
+    def fetch_pending_images(self, retry_failed: bool = True) -> int:
+        """
+        Downloads the pending images of the output directory: deferred images, or images left by an interrupted run.
+        retry_failed -- also retry the images given up after too many failed downloads
+        Returns the number of images still pending (or given up).
+        """
+        pipeline = self._get_image_pipeline()
+        if retry_failed:
+            pipeline.retry_failed()
+        pending = pipeline.pending_count()
+        logger.info(f"Download {pending} pending images with {self._image_workers} workers")
+        pipeline.start()
+        pipeline.join()
+        logger.info(f"Downloaded {pipeline.downloaded} images")
+        return pipeline.pending_count() + pipeline.queue.counts()[pipeline.queue.FAILED]
+
+    def _add_pending_image(self, image_url: str, universal_product_code: str, image_dir: str):
+        """
+        Adds an image to the pending images, saved to the checkpoint until downloaded.
+        """
+        with self._lock:
+            self._pending_images[image_url] = {
+                'image_url': image_url,
+                'universal_product_code': universal_product_code,
+                'image_dir': image_dir
+            }
+
+    def _fetch_image(self, image_url: str, universal_product_code: str, image_dir: str) -> str:
+        """
+        Fetch the image file from an URL and store it to image directory.
+        The local file will be named after the book's universal product code, with the appropriate file extension.
+        The image stays in the pending images (saved to the checkpoint) until it is successfully downloaded.
+        Returns the local image filename on success, None on failure.
+        """
+        self._add_pending_image(image_url, universal_product_code, image_dir)
+        try:
+            return self._download_image(image_url, universal_product_code, image_dir)
+        except Exception as e:
+            e_type = type(e).__name__
+            logger.warning(f"An error ({e_type}) occured while downloading image from URL {image_url}", exc_info= True)
+            self._emit_error(image_url, self.SCRAPE_IMAGE, e)
+            return None
+
+    @max_attempts_decorator(2)
+    def _download_image(self, image_url: str, universal_product_code: str, image_dir: str) -> str:
+        """
+        Download an image and write it to the image directory.
+        Removes the image from the pending images once downloaded (or if the content is not a supported image).
+        """
+        img_file = self._save_image(image_url, universal_product_code, image_dir)
+        with self._lock:
+            self._pending_images.pop(image_url, None)
+        return img_file
+
+    def _save_image(self, image_url: str, universal_product_code: str, image_dir: str) -> str:
+        """
+        Fetch an image and write it to the image directory. Raises an exception on connection errors.
+        Returns the local image filename, or None if the content is not a supported image.
+        """
+        logger.debug(f"Downloading book image from {image_url}")
+        self._handle_url_hook(image_url, self.SCRAPE_IMAGE)
+        img_file = None
+        with self.metrics.measure("image_fetch") as m:
+            img_data = self._data_source.fetch_binary(image_url)
+            m.bytes = len(img_data or b'')
+        if img_data:
+            if not os.path.exists(image_dir):
+                os.makedirs(image_dir, mode = 0o777)
+            mime_type, mime_subtype = self._data_source.mime_type()
+            if mime_subtype.lower() in self.IMAGE_SUBTYPES:
+                img_file = os.path.join(image_dir, self._gen_filename(universal_product_code, f".{mime_subtype.lower()}"))
+                logger.debug(f"write image to {img_file}")
+                # replace the file instead of writing through an image hard linked from a previous output
+                with open(img_file + ".tmp", "wb") as f:
+                    f.write(img_data)
+                os.replace(img_file + ".tmp", img_file)
+                self._get_manifest().record_data(img_file, img_data)
+                self.metrics.count("images_written")
+            else:
+                self.metrics.count("images_unsupported")
+                logger.warning(f"Unsupported image type {mime_type}/{mime_subtype} at {image_url}")
+        return img_file
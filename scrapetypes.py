@@ -0,0 +1,12 @@
+"""
+openclassrooms Python - Project 2
+bookscraper package
+@author Christian Debray - christian.debray@gmail.com
+"""
+# scrape types: what a scraped url is (see the Scraper.SCRAPE_* constants and the scrape events),
+# kept apart from the scraper so that light modules (crawl plan, command line) don't import it
+SCRAPE_ALL = "scrape_all"
+SCRAPE_CATEGORY = "scrape_category"
+SCRAPE_PRODUCT = "scrape_product"
+SCRAPE_IMAGE = "scrape_image"
+SCRAPE_TYPES = [SCRAPE_ALL, SCRAPE_CATEGORY, SCRAPE_PRODUCT, SCRAPE_IMAGE]
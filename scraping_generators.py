@@ -27,6 +27,16 @@ class AbstractScrapingGenerator(ABC):
         """
         pass
 
+    def gen_listing_items_from_index(self, index_soup: BeautifulSoup, base_url: str) -> list[dict[str, str]]:
+        """
+        Called by ScrapeIndex._read_url_index()
+        Returns the products listed on an index page as dictionaries with a 'url' key,
+        and the product data shown on the listing (ex. price, availability) under other keys.
+        Used to detect the products that changed since the previous run.
+        Defaults to the urls only.
+        """
+        return [{'url': url} for url in self.gen_product_urls_from_index(index_soup= index_soup, base_url= base_url)]
+
     @abstractmethod
     def gen_index_next_page_url(self, index_soup: BeautifulSoup, base_url: str) -> str:
         """
@@ -0,0 +1,192 @@
+"""
+openclassrooms Python - Project 2
+bookscraper package
+@author Christian Debray - christian.debray@gmail.com
+"""
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+import hashlib
+import math
+
+class DigestUrlSet:
+    """
+    Compact set of URLs: only stores a fixed-size digest of each URL instead of the full URL string.
+
+    Digests are kept in a sorted array of unsigned 64 bits integers (8 bytes per url, up to 16 bytes while merging)
+    plus a small buffer of recent additions, merged into the array (without duplicates) once it grows past 1/16th of the array size.
+    A python set of ints would cost about 70 bytes per url.
+
+    With the default 8 bytes digest, the probability of a collision stays below 1e-5 for 10 million URLs.
+    """
+    MIN_PENDING = 4096
+
+    def __init__(self, digest_size: int = 8):
+        if not (1 <= digest_size <= 8):
+            raise ValueError("Digest size must be between 1 and 8 bytes")
+        self.digest_size = digest_size
+        self._sorted = array('Q')
+        self._pending: set[int] = set()
+
+    def _digest(self, url: str) -> int:
+        return int.from_bytes(hashlib.blake2b(url.encode(), digest_size= self.digest_size).digest(), 'big')
+
+    def _find(self, digest: int) -> int:
+        """
+        Position of the digest in the sorted array, or -1
+        """
+        pos = bisect_left(self._sorted, digest)
+        return pos if pos < len(self._sorted) and self._sorted[pos] == digest else -1
+
+    def _merge_pending(self):
+        # insert the sorted pending digests into the array: slices are copied in C, no python int per stored digest
+        merged = array('Q')
+        start = 0
+        for digest in sorted(self._pending):
+            pos = bisect_left(self._sorted, digest, start)
+            merged.extend(self._sorted[start:pos])
+            start = pos
+            # already stored digests are not duplicated
+            if pos == len(self._sorted) or self._sorted[pos] != digest:
+                merged.append(digest)
+        merged.extend(self._sorted[start:])
+        self._sorted = merged
+        self._pending.clear()
+
+    def add(self, url: str):
+        self._pending.add(self._digest(url))
+        if len(self._pending) >= max(self.MIN_PENDING, len(self._sorted) // 16):
+            self._merge_pending()
+
+    def discard(self, url: str):
+        digest = self._digest(url)
+        self._pending.discard(digest)
+        pos = self._find(digest)
+        if pos >= 0:
+            del self._sorted[pos]
+
+    def __contains__(self, url: str) -> bool:
+        digest = self._digest(url)
+        return digest in self._pending or self._find(digest) >= 0
+
+    def __len__(self) -> int:
+        # pending digests may already be in the array
+        self._merge_pending()
+        return len(self._sorted)
+
+
+class BloomUrlSet:
+    """
+    Probabilistic set of URLs with a fixed memory footprint (Bloom filter).
+
+    capacity -- expected number of URLs
+    error_rate -- false positive rate when the set holds `capacity` urls.
+    A false positive means that a URL not scraped yet will be reported as seen (and skipped).
+
+    Bloom filters don't support removals: discarded URLs are kept in a list of exceptions,
+    capped to max_discarded digests (defaults to 1% of the capacity, at least 1000).
+    Past this size the oldest exceptions are dropped, and these URLs are reported as seen again, like false positives.
+    """
+    def __init__(self, capacity: int = 100_000, error_rate: float = 0.001, max_discarded: int = None):
+        if capacity <= 0 or not (0 < error_rate < 1):
+            raise ValueError("Bloom filter capacity must be positive and error rate in ]0, 1[")
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size_bits = math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2))
+        self.hash_count = max(1, round(self.size_bits / capacity * math.log(2)))
+        self._bits = bytearray((self.size_bits + 7) // 8)
+        self.max_discarded = max_discarded if max_discarded is not None else max(1000, capacity // 100)
+        # discarded url digests, oldest first
+        self._discarded: OrderedDict[bytes, None] = OrderedDict()
+        self._count = 0
+
+    def _digest(self, url: str) -> bytes:
+        return hashlib.blake2b(url.encode(), digest_size= 16).digest()
+
+    def _positions(self, digest: bytes):
+        # double hashing: derive k positions from two 64 bits hashes
+        h1 = int.from_bytes(digest[:8], 'big')
+        h2 = int.from_bytes(digest[8:], 'big') | 1
+        for i in range(self.hash_count):
+            yield (h1 + i * h2) % self.size_bits
+
+    def _in_filter(self, digest: bytes) -> bool:
+        return all(self._bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(digest))
+
+    def add(self, url: str):
+        digest = self._digest(url)
+        self._discarded.pop(digest, None)
+        for pos in self._positions(digest):
+            self._bits[pos >> 3] |= 1 << (pos & 7)
+        self._count += 1
+
+    def discard(self, url: str):
+        digest = self._digest(url)
+        # urls not in the filter are already reported as not seen
+        if digest in self._discarded or not self._in_filter(digest):
+            return
+        self._discarded[digest] = None
+        while len(self._discarded) > self.max_discarded:
+            self._discarded.popitem(last= False)
+
+    def __contains__(self, url: str) -> bool:
+        digest = self._digest(url)
+        return digest not in self._discarded and self._in_filter(digest)
+
+    def __len__(self) -> int:
+        """
+        Number of add() calls: duplicates are counted.
+        """
+        return self._count
+
+
+URL_SET_KINDS = ["digest", "bloom"]
+
+def create_url_set(kind: str = "digest", capacity: int = 100_000, error_rate: float = 0.001) -> DigestUrlSet | BloomUrlSet:
+    """
+    Instanciates a seen-urls set: "digest" (exact, up to hash collisions) or "bloom" (fixed size, probabilistic).
+    """
+    if kind == "digest":
+        return DigestUrlSet()
+    if kind == "bloom":
+        return BloomUrlSet(capacity= capacity, error_rate= error_rate)
+    raise ValueError(f"Unsupported url set kind: {kind}")
+
+if __name__ == "__main__":
+    urls = [f"https://books.toscrape.com/catalogue/book-{i}_{i}/index.html" for i in range(20_000)]
+    others = [f"https://books.toscrape.com/catalogue/other-{i}_{i}/index.html" for i in range(20_000)]
+
+    digests = create_url_set("digest")
+    for url in urls:
+        digests.add(url)
+    assert all(url in digests for url in urls)
+    assert not any(url in digests for url in others)
+    digests.discard(urls[0])
+    assert urls[0] not in digests and len(digests) == len(urls) - 1
+    # digests merged into the sorted array and pending ones
+    assert len(digests._sorted) > 0 and list(digests._sorted) == sorted(digests._sorted)
+    digests.add(urls[1])
+    assert len(digests) == len(urls) - 1
+    digests.discard(urls[-1])
+    assert urls[-1] not in digests and len(digests) == len(urls) - 2
+
+    bloom = create_url_set("bloom", capacity= len(urls), error_rate= 0.01)
+    for url in urls:
+        bloom.add(url)
+    # no false negatives:
+    assert all(url in bloom for url in urls)
+    false_positives = sum(1 for url in others if url in bloom)
+    assert false_positives / len(others) < 0.02, f"false positive rate too high: {false_positives}"
+    bloom.discard(urls[0])
+    assert urls[0] not in bloom
+    bloom.add(urls[0])
+    assert urls[0] in bloom
+    # urls never added don't use exceptions, and the exceptions list is capped
+    bloom.max_discarded = 10
+    bloom.discard(others[0])
+    assert len(bloom._discarded) == 0
+    for url in urls[:20]:
+        bloom.discard(url)
+    assert len(bloom._discarded) == 10 and urls[19] not in bloom and urls[0] in bloom
+    print(f"bloom filter: {len(bloom._bits)} bytes, {bloom.hash_count} hashes, {false_positives} false positives / {len(others)}")
+    print("Test completed")
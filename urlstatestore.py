@@ -0,0 +1,186 @@
+"""
+openclassrooms Python - Project 2
+bookscraper package
+@author Christian Debray - christian.debray@gmail.com
+"""
+import sqlite3
+import threading
+import time
+import os
+import logging
+logger = logging.getLogger(__name__)
+
+class UrlStateStore:
+    """
+    Persistent record of the URLs handled by the scraper, shared across runs.
+
+    Each URL is stored with its status (scraped / failed), the timestamp of its last update,
+    a hash of the scraped content, a hash of the product data shown on the listing pages
+    and the output file the data was written to.
+    The store is backed by a SQLite database, so that checking a URL is a single indexed lookup
+    instead of a rescan of the output files.
+
+    Usage:
+    ```
+     store = UrlStateStore('path/to/state.sqlite')
+     if not store.is_scraped(url):
+        # scrape the url...
+        store.set_state(url, UrlStateStore.SCRAPED, content_hash= h, output_file= 'mystery.csv')
+     store.close()
+    ```
+    """
+    SCRAPED = "scraped"
+    FAILED = "failed"
+    # unchanged since the previous run, waiting to be copied from the previous output (see Scraper delta mode)
+    CARRIED = "carried"
+
+    DEFAULT_FILENAME = ".scrape_state.sqlite"
+
+    FIELDS = ("url", "status", "updated_at", "content_hash", "listing_hash", "output_file")
+
+    def __init__(self, db_path: str, read_only: bool = False):
+        """
+        db_path -- path to the SQLite database, created if needed
+        read_only -- open an existing database in read only mode (ex. the state of a previous run)
+        """
+        self.db_path = db_path
+        self._lock = threading.RLock()
+        if read_only:
+            self._db = sqlite3.connect(f"file:{db_path}?mode=ro", uri= True, check_same_thread= False, isolation_level= None)
+            return
+        self._db = sqlite3.connect(db_path, check_same_thread= False, isolation_level= None)
+        # WAL journal: readers don't block the writer and commits don't need a full fsync
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS url_state (
+                url TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                updated_at REAL NOT NULL,
+                content_hash TEXT,
+                output_file TEXT,
+                listing_hash TEXT
+            )""")
+        self._db.execute("CREATE INDEX IF NOT EXISTS url_state_output_file ON url_state(output_file)")
+        # upgrade databases created before listing hashes were recorded
+        columns = [row[1] for row in self._db.execute("PRAGMA table_info(url_state)")]
+        if "listing_hash" not in columns:
+            self._db.execute("ALTER TABLE url_state ADD COLUMN listing_hash TEXT")
+
+    def get_state(self, url: str) -> dict | None:
+        """
+        Returns the state recorded for a URL as a dictionary, or None if the URL is unknown.
+        """
+        with self._lock:
+            row = self._db.execute(
+                f"SELECT {', '.join(self.FIELDS)} FROM url_state WHERE url = ?",
+                (url,)).fetchone()
+        if row is None:
+            return None
+        return dict(zip(self.FIELDS, row))
+
+    def is_scraped(self, url: str) -> bool:
+        """
+        Returns True if the URL has been successfully scraped.
+        """
+        with self._lock:
+            row = self._db.execute("SELECT status FROM url_state WHERE url = ?", (url,)).fetchone()
+        return row is not None and row[0] == self.SCRAPED
+
+    def set_state(self, url: str, status: str, content_hash: str = None, output_file: str = None, listing_hash: str = None):
+        """
+        Records the state of a URL. Keeps the previous content hash, listing hash and output file if not set.
+        """
+        with self._lock:
+            self._db.execute("""
+                INSERT INTO url_state (url, status, updated_at, content_hash, output_file, listing_hash) VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT(url) DO UPDATE SET
+                    status = excluded.status,
+                    updated_at = excluded.updated_at,
+                    content_hash = COALESCE(excluded.content_hash, url_state.content_hash),
+                    output_file = COALESCE(excluded.output_file, url_state.output_file),
+                    listing_hash = COALESCE(excluded.listing_hash, url_state.listing_hash)
+                """, (url, status, time.time(), content_hash, output_file, listing_hash))
+
+    def set_many_scraped(self, urls: list[str], output_file: str = None):
+        """
+        Marks a batch of URLs as scraped in a single transaction.
+        """
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN")
+            try:
+                self._db.executemany("""
+                    INSERT INTO url_state (url, status, updated_at, output_file) VALUES (?, ?, ?, ?)
+                    ON CONFLICT(url) DO UPDATE SET status = excluded.status, updated_at = excluded.updated_at,
+                        output_file = COALESCE(excluded.output_file, url_state.output_file)
+                    """, [(url, self.SCRAPED, now, output_file) for url in urls])
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def count_output_urls(self, output_file: str) -> int:
+        """
+        Returns the number of URLs recorded for an output file.
+        """
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM url_state WHERE output_file = ?", (output_file,)).fetchone()[0]
+
+    def list_output_urls(self, output_file: str, status: str = None) -> list[str]:
+        """
+        Returns the URLs recorded for an output file, optionally filtered by status.
+        """
+        with self._lock:
+            if status is None:
+                rows = self._db.execute("SELECT url FROM url_state WHERE output_file = ?", (output_file,)).fetchall()
+            else:
+                rows = self._db.execute("SELECT url FROM url_state WHERE output_file = ? AND status = ?", (output_file, status)).fetchall()
+        return [row[0] for row in rows]
+
+    def forget_output(self, output_file: str) -> int:
+        """
+        Removes all URLs recorded for an output file (ex. when the file has been deleted).
+        Returns the number of URLs removed.
+        """
+        with self._lock:
+            return self._db.execute("DELETE FROM url_state WHERE output_file = ?", (output_file,)).rowcount
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+if __name__ == "__main__":
+    import tempfile
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = os.path.join(tmp_dir, UrlStateStore.DEFAULT_FILENAME)
+        with UrlStateStore(db_path) as store:
+            url = "https://books.toscrape.com/catalogue/a-light-in-the-attic_1000/index.html"
+            assert store.get_state(url) is None
+            assert not store.is_scraped(url)
+            store.set_state(url, UrlStateStore.FAILED, output_file= "poetry.csv")
+            assert not store.is_scraped(url)
+            store.set_state(url, UrlStateStore.SCRAPED, content_hash= "abc")
+            store.set_many_scraped([f"https://example.com/{i}" for i in range(100)], output_file= "other.csv")
+        # state persists across runs:
+        with UrlStateStore(db_path) as store:
+            state = store.get_state(url)
+            assert state['status'] == UrlStateStore.SCRAPED and state['content_hash'] == "abc", state
+            assert state['output_file'] == "poetry.csv", state
+            assert store.count_output_urls("other.csv") == 100
+            store.set_state(url, UrlStateStore.CARRIED, listing_hash= "def")
+            assert store.list_output_urls("poetry.csv", UrlStateStore.CARRIED) == [url]
+            assert store.get_state(url)['listing_hash'] == "def"
+            assert store.forget_output("other.csv") == 100
+            assert not store.is_scraped("https://example.com/1")
+        with UrlStateStore(db_path, read_only= True) as store:
+            assert store.get_state(url)['content_hash'] == "abc"
+    print("Test completed")
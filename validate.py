@@ -2,14 +2,26 @@ import os
 import re
 import csv
 import argparse
+from collections.abc import Callable
+from concurrent.futures import ProcessPoolExecutor
+from manifest import FileManifest
+from imageinfo import read_image_info, IMAGE_FORMATS
 import logging
 logger = logging.getLogger(__name__)
 
 class ScrapingDataValidator:
     """
     Validate data produced by the scraping utility
+
+    When the data directory holds a manifest (see manifest.py, written by the scraper), the validator also checks
+    the size and content hash of the files against the manifest, and records its results to the manifest:
+    files unchanged (same size and modification time) since their last validation are not validated again.
     """
-    def __init__(self, data_dir: str, expected_categories: dict[str, int], expected_product_fields: dict[str, str]):
+    def __init__(self, data_dir: str, expected_categories: dict[str, int], expected_product_fields: dict[str, str], use_manifest: bool = True, full: bool = False):
+        """
+        use_manifest -- use the manifest of the data directory, if found
+        full -- validate all the files, even the files unchanged since their last validation
+        """
         self.data_dir = data_dir
         self.expected_categories = expected_categories
         self.expected_product_fields = expected_product_fields
@@ -27,21 +39,74 @@ class ScrapingDataValidator:
         self._count_validated_categories = 0
         self._count_validated_products = 0
         self._count_validated_images = 0
+        # errors are printed as they are found, except in the worker processes (see validate_categories)
+        self._print_errors = True
+        self._use_manifest = use_manifest and FileManifest.exists(data_dir)
+        self._full = full
+        self._manifest: FileManifest = None
+        # validation results to record to the manifest
+        self._new_results: list[dict] = []
+        # validation results loaded from the manifest, by directory
+        self._cached_dirs: dict[str, dict] = {}
+        self._count_cached_results = 0
+
+    def __getstate__(self):
+        # the manifest connection is opened again in each worker process
+        return dict(self.__dict__, _manifest= None)
 
     def _validation_error(self, error_msg):
-        print(error_msg)
+        if self._print_errors:
+            print(error_msg)
         self.errors.append(error_msg)
 
-    def validate_all(self):
+    def validate_all(self, workers: int = None):
         """
         Validate all the data found in data_dir.
         expected_categories -- map category names
         (as spelled on the website) to the expected number of books
+        workers -- number of processes validating the categories in parallel (defaults to the number of CPUs)
+        """
+        self.errors = []
+        return self.validate_categories(self.expected_categories, workers= workers)
+
+    def validate_categories(self, categories: dict[str, int], workers: int = None) -> bool:
+        """
+        Validates several categories (mapping category names to the expected number of books), in parallel processes.
+        The errors of all the categories are merged in the order of the categories.
+        Returns True if no error was found.
+        """
+        errors_before = len(self.errors)
+        workers = min(workers or os.cpu_count() or 1, len(categories))
+        if workers <= 1:
+            for cat_name, cat_product_count in categories.items():
+                self.validate_category_contents(cat_name, cat_product_count)
+        else:
+            with ProcessPoolExecutor(max_workers= workers) as executor:
+                futures = [executor.submit(self._validate_category_job, cat_name, cat_product_count) for cat_name, cat_product_count in categories.items()]
+                for future in futures:
+                    errors, counts, new_results = future.result()
+                    for error_msg in errors:
+                        self._validation_error(error_msg)
+                    self._count_validated_categories += counts[0]
+                    self._count_validated_products += counts[1]
+                    self._count_validated_images += counts[2]
+                    self._count_cached_results += counts[3]
+                    self._new_results += new_results
+        self._save_results()
+        return len(self.errors) == errors_before
+
+    def _validate_category_job(self, category_name: str, expected_product_count: int) -> tuple[list[str], tuple[int, int, int, int], list[dict]]:
+        """
+        Validates a category in a worker process (on a copy of the validator).
+        Returns the errors, the counts of validated categories, products, images and cached results, and the new validation results.
         """
         self.errors = []
-        for cat_name, cat_product_count in self.expected_categories.items():
-            self.validate_category_contents(cat_name, cat_product_count)
-        return len(self.errors) == 0
+        self._print_errors = False
+        self._count_validated_categories = self._count_validated_products = self._count_validated_images = self._count_cached_results = 0
+        self.validate_category_contents(category_name, expected_product_count)
+        if self._manifest is not None:
+            self._manifest.close()
+        return self.errors, (self._count_validated_categories, self._count_validated_products, self._count_validated_images, self._count_cached_results), self._new_results
 
     def validate_category_contents(self, category_name: str, expected_product_count: int):
         """
@@ -50,20 +115,43 @@ class ScrapingDataValidator:
         - check the corresponding CSV filename is found in the data directory
         - check CSV format
         - check row count
-        - check existence of image file for each product
+        - check existence of image file for each product, and check the image header (format and dimensions)
+        - with a manifest: check the size and content hash of the CSV and image files
         """
         logger.info(f"Validating category {category_name}...")
         self._count_validated_categories += 1
         category_csv_path = self._expected_category_csv_path(category_name)
         category_images_path = self._expected_category_image_dir(category_name)
-        if not os.path.exists(category_csv_path):
+        try:
+            csv_stat = os.stat(category_csv_path)
+        except FileNotFoundError:
             self._validation_error(f"Missing CSV file for category {category_name} - expected: {category_csv_path}")
             return
-        validate_images = True
-        if not os.path.exists(category_images_path) or not os.path.isdir(category_images_path):
+        # list the image directory once, rather than checking each image file (stat calls are slow on network filesystems)
+        image_files = self._list_image_files(category_images_path)
+        validate_images = image_files is not None
+        if not validate_images:
             self._validation_error(f"Can't find images directory for category {category_name} - expected: {category_images_path}")
-            validate_images = False
-        
+
+        csv_result = self._get_result(category_csv_path, csv_stat, lambda: self._validate_category_csv(category_name, category_csv_path, csv_stat))
+        for error_msg in csv_result['errors']:
+            self._validation_error(error_msg)
+        self._count_validated_products += csv_result['row_count']
+        if not csv_result['fields_ok']:
+            return
+        if csv_result['row_count'] != expected_product_count:
+            self._validation_error(f"Wrong product count for category {category_name} in {category_csv_path}. Expected {expected_product_count}, found {csv_result['row_count']}")
+        if validate_images:
+            for row_n, product_code in csv_result['products']:
+                self._validate_product_image(product_code, row_n, category_name, category_csv_path, category_images_path, image_files)
+
+    def _validate_category_csv(self, category_name: str, category_csv_path: str, csv_stat: os.stat_result) -> dict:
+        """
+        Reads and validates a category CSV file.
+        Returns the errors found, the row count and the product codes (with their row number) to check the images.
+        """
+        errors = [f"Modified CSV file {category_csv_path}: {error_msg}" for error_msg in self._check_manifest(category_csv_path, csv_stat)]
+        result = {'errors': errors, 'row_count': 0, 'products': [], 'fields_ok': True}
         with open(category_csv_path, "r") as csv_f:
             try:
                 cat_csv_reader = csv.DictReader(csv_f, strict=True, restkey= self._restkey, restval=self._restval_error_str, **self._csv_format)
@@ -73,24 +161,26 @@ class ScrapingDataValidator:
                         if not self._validate_csv_fields(
                             csv_filename= category_csv_path,
                             field_list= list(row.keys()),
-                            expected_fields= self.expected_product_fields):
-                                return
+                            expected_fields= self.expected_product_fields,
+                            errors= errors):
+                                result['fields_ok'] = False
+                                return result
                     row_count += 1
+                    result['row_count'] = row_count
                     self._validate_product_row(
                         row = row,
                         row_n = row_count,
                         category_name= category_name,
                         category_csv_path= category_csv_path,
-                        category_images_path = category_images_path,
-                        validate_images= validate_images
+                        errors= errors
                     )
-
-                if row_count != expected_product_count:
-                    self._validation_error(f"Wrong product count for category {category_name} in {category_csv_path}. Expected {expected_product_count}, found {row_count}")
+                    if product_code := row.get("universal_product_code", None):
+                        result['products'].append((row_count, product_code))
             except csv.Error as csv_err:
-                self._validation_error(f"Malformed CSV file {category_csv_path}: {csv_err}")
+                errors.append(f"Malformed CSV file {category_csv_path}: {csv_err}")
+        return result
 
-    def _validate_csv_fields(self, csv_filename: str, field_list: list[str], expected_fields: list[str]) -> bool:
+    def _validate_csv_fields(self, csv_filename: str, field_list: list[str], expected_fields: list[str], errors: list[str]) -> bool:
         """
         Validates the field names found in a CSV file.
         """
@@ -99,27 +189,121 @@ class ScrapingDataValidator:
         missing_fields = f_r.difference(f1)
         unexpected_fields = f1.difference(f_r)
         if len(missing_fields) > 0:
-            self._validation_error("Missing fields in CSV file {0}: {1}".format(csv_filename, ", ".join(missing_fields)))
+            errors.append("Missing fields in CSV file {0}: {1}".format(csv_filename, ", ".join(missing_fields)))
         if len(unexpected_fields) > 0:
-            self._validation_error("Unexpected fields in CSV file {0}: {1}".format(csv_filename, ", ".join(unexpected_fields)))
+            errors.append("Unexpected fields in CSV file {0}: {1}".format(csv_filename, ", ".join(unexpected_fields)))
         return 0 == len(missing_fields) + len(unexpected_fields)
 
-    def _validate_product_row(self, row: dict, row_n: int, category_name: str, category_csv_path: str, category_images_path: str, validate_images: bool = True):
+    def _validate_product_row(self, row: dict, row_n: int, category_name: str, category_csv_path: str, errors: list[str]):
         """
         Validates a single row from a CSV file.
-        Checks for product image as well when the validate_image parameter is set to True.
         """
-        self._count_validated_products += 1
         for field_n in self.expected_product_fields:
             if row.get(field_n) == self._restval_error_str:
-                self._validation_error(f"Field not set for product at row #{row_n}: {field_n} (in category {category_name}, {category_csv_path})")
+                errors.append(f"Field not set for product at row #{row_n}: {field_n} (in category {category_name}, {category_csv_path})")
         if row.get(self._restkey, None) is not None:
-            self._validation_error(f"Malformed record at row #{row_n} (in category {category_name}, {category_csv_path})")
-        if validate_images and (product_code := row.get("universal_product_code", None)):
-            self._count_validated_images += 1
-            expected_img_file = os.path.join(category_images_path, f"{product_code}.jpeg")
-            if not os.path.exists(expected_img_file) or not os.path.isfile(expected_img_file):
-                self._validation_error(f"Image file not found for product {product_code} at row #{row_n} (in category {category_name}, {category_csv_path})")
+            errors.append(f"Malformed record at row #{row_n} (in category {category_name}, {category_csv_path})")
+
+    def _validate_product_image(self, product_code: str, row_n: int, category_name: str, category_csv_path: str, category_images_path: str, image_files: dict[str, os.stat_result]):
+        """
+        Checks the image file of a product: existence, header (format and dimensions), size and hash recorded in the manifest.
+        image_files -- files found in the image directory (see _list_image_files)
+        """
+        self._count_validated_images += 1
+        image_name = f"{product_code}.jpeg"
+        if image_name not in image_files:
+            self._validation_error(f"Image file not found for product {product_code} at row #{row_n} (in category {category_name}, {category_csv_path})")
+            return
+        image_path = os.path.join(category_images_path, image_name)
+        image_stat = image_files[image_name] or os.stat(image_path)
+        result = self._get_result(image_path, image_stat, lambda: self._validate_image_file(image_path, image_stat))
+        for error_msg in result['errors']:
+            self._validation_error(f"Invalid image file for product {product_code} at row #{row_n}: {error_msg} (in category {category_name}, {image_path})")
+
+    def _validate_image_file(self, image_path: str, image_stat: os.stat_result) -> dict:
+        """
+        Checks an image file. Only the image header is read, unless the content hash is checked against the manifest.
+        """
+        errors = self._check_manifest(image_path, image_stat)
+        try:
+            info = read_image_info(image_path)
+        except ValueError as e:
+            errors.append(str(e))
+            return {'errors': errors}
+        expected_format = IMAGE_FORMATS.get(os.path.splitext(image_path)[1][1:].lower())
+        if info['format'] != expected_format:
+            errors.append(f"{info['format'].upper()} image, expected {str(expected_format).upper()}")
+        return {'errors': errors, **info}
+
+    def _check_manifest(self, path: str, file_stat: os.stat_result) -> list[str]:
+        """
+        Checks the size and content hash of a file against the manifest. Files not recorded to the manifest are not checked.
+        """
+        if not self._use_manifest:
+            return []
+        manifest = self._get_manifest()
+        if (entry := manifest.get(manifest.key(path))) is None:
+            return []
+        if file_stat.st_size != entry['size']:
+            return [f"size {file_stat.st_size} differs from the manifest ({entry['size']})"]
+        if FileManifest.file_sha256(path) != entry['sha256']:
+            return ["content differs from the manifest (SHA-256 mismatch)"]
+        return []
+
+    def _get_result(self, path: str, file_stat: os.stat_result, validate: Callable[[], dict]) -> dict:
+        """
+        Returns the last validation result of a file if it has not changed since, otherwise validates the file
+        and keeps the result to record it to the manifest.
+        """
+        if not self._use_manifest:
+            return validate()
+        key = self._get_manifest().key(path)
+        if not self._full:
+            cached = self._cached_results(key).get(key)
+            if cached and cached['size'] == file_stat.st_size and cached['mtime_ns'] == file_stat.st_mtime_ns:
+                self._count_cached_results += 1
+                return cached['result']
+        result = validate()
+        self._new_results.append({'path': key, 'size': file_stat.st_size, 'mtime_ns': file_stat.st_mtime_ns, 'result': result})
+        return result
+
+    def _cached_results(self, key: str) -> dict[str, dict]:
+        """
+        Loads the validation results of the files of a directory at once (ex. the images of a category).
+        """
+        prefix = key.rpartition("/")[0] + "/" if "/" in key else key
+        if prefix not in self._cached_dirs:
+            self._cached_dirs[prefix] = self._get_manifest().validations(prefix)
+        return self._cached_dirs[prefix]
+
+    def _get_manifest(self) -> FileManifest:
+        if self._manifest is None:
+            self._manifest = FileManifest(self.data_dir, read_only= True)
+        return self._manifest
+
+    def _save_results(self):
+        """
+        Records the new validation results to the manifest.
+        """
+        if self._manifest is not None:
+            self._manifest.close()
+            self._manifest = None
+            self._cached_dirs = {}
+        if self._new_results:
+            with FileManifest(self.data_dir) as manifest:
+                manifest.set_validations(self._new_results)
+            self._new_results = []
+
+    def _list_image_files(self, images_path: str) -> dict[str, os.stat_result] | None:
+        """
+        Lists the files found in an image directory, or returns None if the directory can't be found.
+        Returns a dictionary mapping the file names to their stat results when using a manifest (to detect the changed files), to None otherwise.
+        """
+        try:
+            with os.scandir(images_path) as entries:
+                return {entry.name: (entry.stat() if self._use_manifest else None) for entry in entries if entry.is_file()}
+        except (FileNotFoundError, NotADirectoryError):
+            return None
 
     def _expected_category_csv_path(self, category_name: str) -> str:
         """
@@ -168,6 +352,25 @@ if __name__ == "__main__":
         default = [],
         help="Specify categories to validate as a space separated list of category names."
     )
+    parser.add_argument(
+        "--workers",
+        type= int,
+        default= None,
+        help="Number of processes validating the categories in parallel (defaults to the number of CPUs)."
+    )
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        default=False,
+        help="Validate all the files, including the files unchanged since their last validation."
+    )
+    parser.add_argument(
+        "--no-manifest",
+        dest="use_manifest",
+        action="store_false",
+        default=True,
+        help="Ignore the manifest written by the scraper: don't check the file hashes, don't record the validation results."
+    )
     args = parser.parse_args()
 
     # expected fields in categories_specs_csv: ["category", "product_count"]
@@ -193,17 +396,18 @@ if __name__ == "__main__":
     validator = ScrapingDataValidator(
         data_dir= args.data_directory,
         expected_categories= expected_categories,
-        expected_product_fields= expected_product_fields)
+        expected_product_fields= expected_product_fields,
+        use_manifest= args.use_manifest,
+        full= args.full)
     
     print("Starting validation...")
     if len(args.validate_categories) == 0:
-        validator.validate_all()
+        validator.validate_all(workers= args.workers)
         total_expected_categories = len(expected_categories)
         total_expected_products = sum(list(expected_categories.values()))
         total_expected_images = total_expected_products
     else:
-        for cat in args.validate_categories:
-            validator.validate_category_contents(cat, expected_categories[cat])
+        validator.validate_categories({cat: expected_categories[cat] for cat in args.validate_categories}, workers= args.workers)
         total_expected_categories = len(args.validate_categories)
         total_expected_products = sum([expected_categories[c] for c in args.validate_categories])
         total_expected_images = total_expected_products
@@ -212,6 +416,7 @@ if __name__ == "__main__":
         {validator._count_validated_categories}/{total_expected_categories} categories
         {validator._count_validated_products}/{total_expected_products} products
         {validator._count_validated_images}/{total_expected_images} images
+        ({validator._count_cached_results} files unchanged since their last validation)
     """
     print(summary)
     if len(validator.errors) > 0:
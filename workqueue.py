@@ -0,0 +1,374 @@
+"""
+openclassrooms Python - Project 2
+bookscraper package
+@author Christian Debray - christian.debray@gmail.com
+"""
+import sqlite3
+import contextlib
+import json
+import os
+import socket
+import threading
+import time
+import logging
+logger = logging.getLogger(__name__)
+
+def default_worker_id() -> str:
+    """
+    Returns an identifier unique to the current process: <hostname>-<pid>
+    """
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+class SqliteWorkQueue:
+    """
+    Work queue shared by several scraping workers, in several processes or on several hosts sharing a filesystem.
+
+    Tasks are identified by their kind and url: adding the same task twice is a no-op,
+    so that every worker may seed the queue with the same starting url.
+    Workers lease tasks for lease_timeout seconds. The task of a worker that died is handed to another worker
+    once its lease expires, up to max_attempts times.
+
+    The queue is a SQLite database using a rollback journal (no WAL), which only relies on file locks
+    and may be shared over a network filesystem supporting them.
+    A queue object may also be shared by several threads.
+
+    Usage (in each worker):
+    ```
+     queue = SqliteWorkQueue('path/to/queue.sqlite')
+     queue.put('index', start_url)
+     while not queue.is_finished():
+        if task := queue.lease(worker_id):
+            # do the work, possibly queue.put() new tasks...
+            queue.complete(task['id'], worker_id)
+        else:
+            time.sleep(1)
+    ```
+    """
+    PENDING = "pending"
+    LEASED = "leased"
+    DONE = "done"
+    FAILED = "failed"
+
+    def __init__(self, db_path: str, lease_timeout: float = 300.0, max_attempts: int = 3):
+        self.db_path = db_path
+        self.lease_timeout = lease_timeout
+        self.max_attempts = max_attempts
+        self._lock = threading.RLock()
+        # wait for the other workers to release their locks
+        self._db = sqlite3.connect(db_path, timeout= 60.0, isolation_level= None, check_same_thread= False)
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS tasks (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                kind TEXT NOT NULL,
+                url TEXT NOT NULL,
+                payload TEXT,
+                priority INTEGER NOT NULL DEFAULT 0,
+                status TEXT NOT NULL,
+                worker_id TEXT,
+                lease_expires REAL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                UNIQUE(kind, url)
+            )""")
+        self._db.execute("CREATE INDEX IF NOT EXISTS tasks_status ON tasks(status, priority, id)")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS locks (
+                name TEXT PRIMARY KEY,
+                worker_id TEXT NOT NULL,
+                acquired_at REAL NOT NULL,
+                expires_at REAL
+            )""")
+        if "expires_at" not in [row[1] for row in self._db.execute("PRAGMA table_info(locks)")]:
+            # queue created by a previous version: locks never expired
+            self._db.execute("ALTER TABLE locks ADD COLUMN expires_at REAL")
+
+    def put(self, kind: str, url: str, payload: dict = None, priority: int = 0) -> bool:
+        """
+        Adds a task to the queue. Lower priority values are leased first.
+        Returns False if the task was already queued.
+        """
+        return self.put_many([(kind, url, payload, priority)]) > 0
+
+    def put_many(self, tasks: list[tuple[str, str, dict, int]]) -> int:
+        """
+        Adds several tasks, given as (kind, url, payload, priority) tuples, in a single transaction.
+        Returns the number of new tasks.
+        """
+        if not tasks:
+            return 0
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                before = self._db.total_changes
+                self._db.executemany(
+                    "INSERT OR IGNORE INTO tasks (kind, url, payload, priority, status) VALUES (?, ?, ?, ?, ?)",
+                    [(kind, url, json.dumps(payload or {}), priority, self.PENDING) for kind, url, payload, priority in tasks])
+                added = self._db.total_changes - before
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        return added
+
+    def lease(self, worker_id: str) -> dict | None:
+        """
+        Leases the next pending task (or a task whose lease expired) to a worker.
+        Returns the task as a dictionary {id, kind, url, payload, attempts}, or None if no task is available right now.
+        """
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                # give up the tasks that expired too many times (they probably crash their workers)
+                self._db.execute(
+                    "UPDATE tasks SET status = ?, error = 'lease expired' WHERE status = ? AND lease_expires < ? AND attempts >= ?",
+                    (self.FAILED, self.LEASED, now, self.max_attempts))
+                row = self._db.execute("""
+                    SELECT id, kind, url, payload, attempts FROM tasks
+                    WHERE status = ? OR (status = ? AND lease_expires < ?)
+                    ORDER BY priority, id LIMIT 1""", (self.PENDING, self.LEASED, now)).fetchone()
+                if row is not None:
+                    self._db.execute(
+                        "UPDATE tasks SET status = ?, worker_id = ?, lease_expires = ?, attempts = attempts + 1 WHERE id = ?",
+                        (self.LEASED, worker_id, now + self.lease_timeout, row[0]))
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        if row is None:
+            return None
+        return {'id': row[0], 'kind': row[1], 'url': row[2], 'payload': json.loads(row[3] or '{}'), 'attempts': row[4] + 1}
+
+    def complete(self, task_id: int, worker_id: str) -> bool:
+        """
+        Marks a leased task as done. Returns False if the lease was lost (expired and handed to another worker).
+        """
+        with self._lock:
+            cursor = self._db.execute(
+                "UPDATE tasks SET status = ?, lease_expires = NULL WHERE id = ? AND worker_id = ? AND status = ?",
+                (self.DONE, task_id, worker_id, self.LEASED))
+            return cursor.rowcount > 0
+
+    def fail(self, task_id: int, worker_id: str, error: str = "") -> bool:
+        """
+        Releases a task that failed: it will be leased again, unless it already failed max_attempts times.
+        """
+        with self._lock:
+            cursor = self._db.execute("""
+                UPDATE tasks SET
+                    status = CASE WHEN attempts >= ? THEN ? ELSE ? END,
+                    lease_expires = NULL,
+                    error = ?
+                WHERE id = ? AND worker_id = ? AND status = ?""",
+                (self.max_attempts, self.FAILED, self.PENDING, error, task_id, worker_id, self.LEASED))
+            return cursor.rowcount > 0
+
+    def is_finished(self) -> bool:
+        """
+        Returns True when no task is pending or leased.
+        """
+        with self._lock:
+            return self._db.execute(
+                "SELECT COUNT(*) FROM tasks WHERE status IN (?, ?)", (self.PENDING, self.LEASED)).fetchone()[0] == 0
+
+    def counts(self) -> dict[str, int]:
+        """
+        Returns the number of tasks by status.
+        """
+        counts = {self.PENDING: 0, self.LEASED: 0, self.DONE: 0, self.FAILED: 0}
+        with self._lock:
+            for status, count in self._db.execute("SELECT status, COUNT(*) FROM tasks GROUP BY status"):
+                counts[status] = count
+        return counts
+
+    def retry_failed(self) -> int:
+        """
+        Sets the failed tasks back to pending, with a new count of attempts.
+        Returns the number of tasks to retry.
+        """
+        with self._lock:
+            cursor = self._db.execute("UPDATE tasks SET status = ?, attempts = 0 WHERE status = ?", (self.PENDING, self.FAILED))
+            return cursor.rowcount
+
+    def try_acquire(self, name: str, worker_id: str, lease_timeout: float = None) -> bool:
+        """
+        Acquires a named lock, once for all the workers: only the first caller gets True,
+        until the lock is released or its lease expires (after lease_timeout seconds, defaults to the lease timeout of the tasks),
+        so that the lock of a worker that died is handed to another worker.
+        Typically used to elect the worker that merges the partitioned outputs.
+        """
+        now = time.time()
+        lease_timeout = self.lease_timeout if lease_timeout is None else lease_timeout
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._db.execute("SELECT worker_id, expires_at FROM locks WHERE name = ?", (name,)).fetchone()
+                acquired = row is None or row[0] == worker_id or (row[1] is not None and row[1] < now)
+                if acquired:
+                    self._db.execute(
+                        "INSERT OR REPLACE INTO locks (name, worker_id, acquired_at, expires_at) VALUES (?, ?, ?, ?)",
+                        (name, worker_id, now, now + lease_timeout))
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        return acquired
+
+    def renew(self, name: str, worker_id: str, lease_timeout: float = None) -> bool:
+        """
+        Extends the lease of a named lock still held by a worker (for lease_timeout seconds, defaults to the lease timeout of the tasks).
+        Returns False if the lock was lost: released, or expired and taken by another worker.
+        """
+        lease_timeout = self.lease_timeout if lease_timeout is None else lease_timeout
+        with self._lock:
+            cursor = self._db.execute(
+                "UPDATE locks SET expires_at = ? WHERE name = ? AND worker_id = ?",
+                (time.time() + lease_timeout, name, worker_id))
+            return cursor.rowcount > 0
+
+    def release(self, name: str, worker_id: str) -> bool:
+        """
+        Releases a named lock held by a worker, once the work it protects is done or failed.
+        """
+        with self._lock:
+            cursor = self._db.execute("DELETE FROM locks WHERE name = ? AND worker_id = ?", (name, worker_id))
+            return cursor.rowcount > 0
+
+    @contextlib.contextmanager
+    def holding(self, name: str, worker_id: str):
+        """
+        Holds a named lock acquired with try_acquire() while the work it protects runs:
+        a background thread renews its lease (every third of the lease timeout), so that a long work doesn't outlive it,
+        and the lock is released at the end, whether the work succeeded or failed.
+
+        Usage:
+        ```
+         if queue.try_acquire("merge", worker_id):
+            with queue.holding("merge", worker_id):
+                # merge...
+        ```
+        """
+        done = threading.Event()
+        def renew_lease():
+            while not done.wait(self.lease_timeout / 3):
+                if not self.renew(name, worker_id):
+                    logger.warning(f"Worker {worker_id} lost the {name} lock")
+                    return
+        renewer = threading.Thread(target= renew_lease, name= f"lock-{name}", daemon= True)
+        renewer.start()
+        try:
+            yield
+        finally:
+            done.set()
+            renewer.join()
+            self.release(name, worker_id)
+
+    def active_workers(self) -> set[str]:
+        """
+        Returns the identifiers of the workers holding a task lease that didn't expire.
+        """
+        with self._lock:
+            return {row[0] for row in self._db.execute(
+                "SELECT DISTINCT worker_id FROM tasks WHERE status = ? AND lease_expires >= ?", (self.LEASED, time.time()))}
+
+    def restart(self, kind: str, url: str, payload: dict = None, priority: int = 0) -> bool:
+        """
+        Starts a new run on a finished queue: removes the tasks and locks of the previous run and adds the first task.
+        Returns False (and changes nothing) if the queue is not finished, ex. when another worker already restarted it.
+        """
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                if self._db.execute(
+                        "SELECT COUNT(*) FROM tasks WHERE status IN (?, ?)", (self.PENDING, self.LEASED)).fetchone()[0] > 0:
+                    self._db.execute("ROLLBACK")
+                    return False
+                self._db.execute("DELETE FROM tasks")
+                self._db.execute("DELETE FROM locks")
+                self._db.execute(
+                    "INSERT INTO tasks (kind, url, payload, priority, status) VALUES (?, ?, ?, ?, ?)",
+                    (kind, url, json.dumps(payload or {}), priority, self.PENDING))
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        return True
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _self_test_worker(db_path: str, results_dir: str, crash: bool):
+    """
+    Worker process of the self test: squares numbers, the crashing worker dies after its first lease.
+    """
+    worker_id = default_worker_id()
+    with SqliteWorkQueue(db_path, lease_timeout= 1.0) as queue:
+        while not queue.is_finished():
+            if task := queue.lease(worker_id):
+                if crash:
+                    os._exit(1)
+                n = int(task['url'])
+                if n < 100 and n % 10 == 0:
+                    # tasks may create new tasks
+                    queue.put('square', str(n + 1000))
+                with open(os.path.join(results_dir, task['url']), "w") as f:
+                    f.write(str(n * n))
+                queue.complete(task['id'], worker_id)
+            else:
+                time.sleep(0.05)
+
+if __name__ == "__main__":
+    import multiprocessing
+    import tempfile
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = os.path.join(tmp_dir, "queue.sqlite")
+        with SqliteWorkQueue(db_path) as queue:
+            assert queue.put_many([('square', str(n), None, 0) for n in range(100)]) == 100
+            # duplicates are ignored
+            assert not queue.put('square', '1')
+        workers = [multiprocessing.Process(target= _self_test_worker, args= (db_path, tmp_dir, i == 0)) for i in range(4)]
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join()
+        with SqliteWorkQueue(db_path) as queue:
+            counts = queue.counts()
+            print(counts)
+            assert counts[SqliteWorkQueue.DONE] == 110 and queue.is_finished(), counts
+            assert queue.try_acquire("merge", "a") and not queue.try_acquire("merge", "b")
+            # the lock of a worker that died expires, a released lock is free
+            assert queue.try_acquire("merge", "a", lease_timeout= 0)
+            time.sleep(0.01)
+            assert queue.try_acquire("merge", "b")
+            assert queue.release("merge", "b") and queue.try_acquire("merge", "a")
+            # a held lock is renewed past its lease timeout, and released once done
+            queue.lease_timeout = 0.3
+            with queue.holding("merge", "a"):
+                time.sleep(0.6)
+                assert not queue.try_acquire("merge", "b")
+            assert not queue.renew("merge", "a") and queue.try_acquire("merge", "b") and queue.release("merge", "b")
+            queue.lease_timeout = 300.0
+            # a finished queue is restarted for a new run, a running queue is not
+            assert queue.restart('square', '2') and queue.counts()[SqliteWorkQueue.PENDING] == 1
+            assert not queue.restart('square', '3')
+            task = queue.lease("a")
+            assert task['url'] == '2' and queue.active_workers() == {"a"}
+            assert queue.complete(task['id'], "a") and not queue.active_workers()
+        with SqliteWorkQueue(db_path, max_attempts= 1) as queue:
+            queue.put('square', 'x')
+            assert queue.fail(queue.lease("a")['id'], "a", "not a number")
+            assert queue.counts()[SqliteWorkQueue.FAILED] == 1 and queue.is_finished()
+            assert queue.retry_failed() == 1 and queue.lease("a")['url'] == 'x'
+        assert len([f for f in os.listdir(tmp_dir) if f.isdigit()]) == 110
+    print("Test completed")